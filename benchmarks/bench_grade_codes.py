@@ -0,0 +1,166 @@
+"""
+Benchmark for storing grades as grade_scale codes instead of letters.
+
+Builds a database with the letter column of migrations 001-005, fills it
+with grades, copies it and upgrades the copy with 006_grade_scale.sql. Then
+compares the two: table and grade index size on disk (from the dbstat
+table), whole file size, and the median time of the grade distribution
+report and of counting the rows with some grades. A third copy keeps the
+letters but gets the (class_id, grade) index the codes have, to tell the
+effect of the index from that of the encoding.
+
+Run from the repository root:
+  python3 benchmarks/bench_grade_codes.py [number_of_grades]
+"""
+import glob
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from project_db import DBManager  # noqa: E402
+
+GRADE_SCALE_MIGRATION = 6
+LETTERS = ('A', 'A-', 'B+', 'B', 'B-', 'C+', 'C', 'C-', 'D+', 'D', 'F')
+REPEATS = 11
+
+# the queries as they were before the grade scale
+LETTER_DISTRIBUTION = '''
+    SELECT class.class_id, class.name as c_name, grade,
+    COUNT(*) as students
+    FROM grade JOIN class ON class.class_id = grade.class_id
+    GROUP BY class.class_id, grade
+    ORDER BY class.class_id, grade;
+    '''
+LETTER_COUNT = "SELECT COUNT(*) FROM grade WHERE grade IN ('A', 'A-');"
+CODE_COUNT = '''
+    SELECT COUNT(*) FROM grade
+    WHERE grade_code IN (SELECT code FROM grade_scale
+                         WHERE letter IN ('A', 'A-'));
+    '''
+
+
+def build_database(path, number_of_grades):
+    """
+    Creates the schema as it was before the grade scale and fills it with
+    number_of_grades grades spread over 200 classes.
+    """
+    conn = sqlite3.connect(path)
+    with open('init_db.sql') as script:
+        conn.executescript(script.read())
+    for script_path in sorted(glob.glob('migrations/[0-9]*.sql')):
+        if int(os.path.basename(script_path)[:3]) < GRADE_SCALE_MIGRATION:
+            with open(script_path) as script:
+                conn.executescript(script.read())
+
+    # only the grade table is compared, so there are no students to point at
+    conn.execute('PRAGMA foreign_keys = OFF;')
+    random.seed(1)
+    conn.executemany('INSERT INTO class(name) VALUES(?)',
+                     [('CS-%d' % i,) for i in range(200)])
+    conn.executemany('INSERT INTO grade(grade, class_id, student_id, '
+                     'faculty_id) VALUES(?,?,?,?)',
+                     [(random.choice(LETTERS), i % 200 + 1, i + 1, 1)
+                      for i in range(number_of_grades)])
+    conn.execute('DELETE FROM change_log;')  # only the grades are compared
+    conn.commit()
+    conn.execute('VACUUM;')
+    conn.close()
+
+
+def sizes(path, indexes):
+    """
+    :return: (grade table bytes, bytes of indexes, file bytes)
+    """
+    conn = sqlite3.connect(path)
+    try:
+        pages = dict(conn.execute('SELECT name, SUM(pgsize) FROM dbstat '
+                                  'GROUP BY name;').fetchall())
+    except sqlite3.OperationalError:
+        pages = {}  # sqlite built without dbstat
+    conn.close()
+    index_bytes = sum(pages.get(index, 0) for index in indexes)
+    return pages.get('grade'), index_bytes, os.path.getsize(path)
+
+
+def median_ms(function):
+    function()  # warm up the page cache and the statement cache
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    number_of_grades = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    directory = tempfile.mkdtemp()
+    letters_path = os.path.join(directory, 'letters.sqlite')
+    indexed_path = os.path.join(directory, 'indexed.sqlite')
+    codes_path = os.path.join(directory, 'codes.sqlite')
+    try:
+        build_database(letters_path, number_of_grades)
+        shutil.copy(letters_path, codes_path)
+        shutil.copy(letters_path, indexed_path)
+
+        conn = sqlite3.connect(indexed_path)
+        conn.execute('CREATE INDEX grade_class_grade '
+                     'ON grade(class_id, grade);')
+        conn.close()
+
+        conn = sqlite3.connect(codes_path)
+        with open(glob.glob('migrations/%03d_*.sql'
+                            % GRADE_SCALE_MIGRATION)[0]) as script:
+            start = time.perf_counter()
+            conn.executescript(script.read())
+            migration_seconds = time.perf_counter() - start
+        conn.execute('VACUUM;')
+        conn.close()
+        print('grades: %d, migration to codes took %.2f s' % (
+            number_of_grades, migration_seconds))
+
+        app = Flask(__name__)
+        app.config['DATABASE'] = codes_path
+        db = DBManager(app)
+        results = {}
+        for name, path in (('letters', letters_path),
+                           ('letters+index', indexed_path)):
+            letters = sqlite3.connect(path)
+            results[name] = sizes(path, ('grade_grade',
+                                         'grade_class_grade')) + (
+                median_ms(lambda: letters.execute(
+                    LETTER_DISTRIBUTION).fetchall()),
+                median_ms(lambda: letters.execute(LETTER_COUNT).fetchall()))
+            letters.close()
+
+        with app.app_context():
+            codes = db.get_db()
+            results['codes'] = sizes(codes_path, ('grade_code',
+                                                  'grade_class_code')) + (
+                median_ms(db.get_grade_distribution),
+                median_ms(lambda: codes.execute(CODE_COUNT).fetchall()))
+
+        print('%-14s %10s %10s %10s %14s %12s' % (
+            '', 'table KiB', 'index KiB', 'file KiB', 'distribution',
+            'count A/A-'))
+        for name, (table, index, total, distribution, count) in \
+                results.items():
+            print('%-14s %10s %10s %10.0f %11.2f ms %9.2f ms' % (
+                name, '%.0f' % (table / 1024) if table else '?',
+                '%.0f' % (index / 1024) if index else '?', total / 1024,
+                distribution, count))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Login throughput benchmark for the password hashing in project_passwords.py.
+
+Builds a populated database whose users have hashes of the calibrated cost,
+then runs a login storm from many threads against the app while two other
+threads keep loading a faculty page. Reports logins per second, login
+latency and the page latency during the storm, for:
+
+  inline  - hashes checked on the request thread (PASSWORD_WORKERS=0)
+  pool    - hashes checked on the bounded pool (PASSWORD_WORKERS=2)
+
+The page latency with no storm at all is printed first for comparison.
+
+Run from the repository root:
+  python3 benchmarks/bench_login.py [login_threads] [seconds]
+"""
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main_app import create_app  # noqa: E402
+
+USERS = 50
+PAGE = '/faculty/Sommer'
+
+
+def build_database(path):
+    """
+    Creates the populated database plus USERS students, and logs each user
+    in once so every password is stored as a hash of the current cost.
+    """
+    app = create_app({'DATABASE': path, 'ADMISSION_LIMITS': {}})
+    manager = app.extensions['db_manager']
+    with app.app_context():
+        manager.init_db('init_db.sql')
+        manager.migrate_db('migrations')
+        manager.populate_db('populate_db.sql')
+        manager.insert_students(1, [
+            {'name': 'Bench %d' % number, 'username': 'bench%d' % number,
+             'password': 'bench%d' % number} for number in range(USERS)])
+    client = app.test_client()
+    for number in range(USERS):
+        client.post('/login', data={'username': 'bench%d' % number,
+                                    'password': 'bench%d' % number})
+    return app.extensions['password_hasher'].cost
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] * 1000
+
+
+def storm(path, workers, login_threads, seconds):
+    """
+    :return: (logins, login latencies, page latencies) over seconds
+    """
+    app = create_app({'DATABASE': path, 'ADMISSION_LIMITS': {},
+                      'PASSWORD_WORKERS': workers,
+                      'PASSWORD_MAX_PENDING': 1000})
+    deadline = time.monotonic() + seconds
+    logins, pages = [], []
+
+    def log_in(number):
+        client = app.test_client()
+        while time.monotonic() < deadline:
+            user = 'bench%d' % (number % USERS)
+            start = time.perf_counter()
+            response = client.post('/login', data={'username': user,
+                                                   'password': user})
+            assert response.status_code == 302, response.status_code
+            logins.append(time.perf_counter() - start)
+            number += login_threads
+
+    def load_pages():
+        client = app.test_client()
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            client.get(PAGE)
+            pages.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=log_in, args=(number,))
+               for number in range(login_threads)]
+    threads += [threading.Thread(target=load_pages) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(logins), logins, pages
+
+
+def main():
+    login_threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'login.sqlite')
+    try:
+        cost = build_database(path)
+        print('calibrated cost: %d iterations, cpus: %d, login threads: %d'
+              % (cost, os.cpu_count() or 1, login_threads))
+
+        _, _, quiet = storm(path, 2, 0, seconds / 2)
+        print('%-8s %9s %11s %11s %11s %11s' % (
+            '', 'logins/s', 'login p50', 'login p95', 'page p50',
+            'page p99'))
+        print('%-8s %9s %11s %11s %8.1f ms %8.1f ms' % (
+            'no storm', '-', '-', '-', statistics.median(quiet) * 1000,
+            percentile(quiet, 0.99)))
+        for name, workers in (('inline', 0), ('pool', 2)):
+            count, logins, pages = storm(path, workers, login_threads,
+                                         seconds)
+            print('%-8s %9.1f %8.1f ms %8.1f ms %8.1f ms %8.1f ms' % (
+                name, count / seconds, percentile(logins, 0.5),
+                percentile(logins, 0.95), percentile(pages, 0.5),
+                percentile(pages, 0.99)))
+    finally:
+        for name in os.listdir(directory):
+            os.unlink(os.path.join(directory, name))
+        os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    main()
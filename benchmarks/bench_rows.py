@@ -0,0 +1,125 @@
+"""
+Benchmark for the RowSet result path.
+
+Compares the old read path (sqlite3.Row, dict(row) per row, then json.dumps
+of the list of dicts) against DBManager.read_rows() plus encode_rowset().
+Reports the median time and the peak traced allocation of each path.
+
+Run from the repository root:
+  python3 benchmarks/bench_rows.py [number_of_rows]
+"""
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from project_db import DBManager  # noqa: E402
+import project_json  # noqa: E402
+
+QUERY = '''
+    SELECT student.name as s_name, class.name as c_name, grade
+    FROM student JOIN grade ON grade.student_id = student.student_id
+    JOIN class ON grade.class_id = class.class_id;
+    '''
+REPEATS = 15
+
+
+def build_database(path, number_of_rows):
+    """
+    Creates the schema from init_db.sql and fills it with number_of_rows
+    grades spread over 50 classes.
+    """
+    conn = sqlite3.connect(path)
+    with open('init_db.sql') as script:
+        conn.executescript(script.read())
+    conn.executemany('INSERT INTO class(name) VALUES(?)',
+                     [('CS-%d' % i,) for i in range(50)])
+    conn.executemany('INSERT INTO student(name, username, password, class_id)'
+                     ' VALUES(?,?,?,?)',
+                     [('Student %d' % i, 'student%d' % i, 'pw', i % 50 + 1)
+                      for i in range(number_of_rows)])
+    conn.executemany('INSERT INTO grade(grade, class_id, student_id)'
+                     ' VALUES(?,?,?)',
+                     [('B+', i % 50 + 1, i + 1)
+                      for i in range(number_of_rows)])
+    conn.commit()
+    conn.close()
+
+
+def dict_path(db):
+    """
+    The read path every DBManager method used before RowSet.
+    """
+    cur = db.get_db().cursor()
+    cur.execute(QUERY)
+    results = []
+    for row in cur.fetchall():
+        results.append(dict(row))
+    return json.dumps(results, separators=(',', ':')).encode('utf-8')
+
+
+def rowset_path(db):
+    return project_json.encode_rowset(db.read_rows(QUERY))
+
+
+def rowset_columns_path(db):
+    return project_json.encode_rowset(db.read_rows(QUERY), 'columns')
+
+
+def measure(function, db):
+    """
+    :return: (median seconds, peak traced bytes) for function(db)
+    """
+    function(db)  # warm up the statement cache
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function(db)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function(db)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return statistics.median(timings), peak
+
+
+def main():
+    number_of_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    db_fd, db_path = tempfile.mkstemp()
+    app = Flask(__name__)
+    app.config['DATABASE'] = db_path
+    db = DBManager(app)
+
+    try:
+        build_database(db_path, number_of_rows)
+        print('rows: %d, json encoder: %s' % (
+            number_of_rows,
+            'orjson' if project_json.orjson is not None else 'stdlib json'))
+
+        with app.app_context():
+            baseline = None
+            for name, function in (('dict(row)', dict_path),
+                                   ('rowset records', rowset_path),
+                                   ('rowset columns', rowset_columns_path)):
+                seconds, peak = measure(function, db)
+                if baseline is None:
+                    baseline = seconds
+                print('%-16s %8.2f ms  %8.1f KiB peak  %5.2fx' % (
+                    name, seconds * 1000, peak / 1024, baseline / seconds))
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+
+if __name__ == '__main__':
+    main()
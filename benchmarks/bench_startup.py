@@ -0,0 +1,85 @@
+"""
+Startup benchmark for the app factory.
+
+Each measurement runs in a fresh interpreter so nothing is cached between
+runs. Reports the median of:
+
+  import   - importing main_app (blueprints, DBManager, extensions)
+  factory  - create_app()
+  first    - the first request to /api/grades/ on a populated database
+  cli      - running 'flask --help' end to end
+
+Run from the repository root:
+  python3 benchmarks/bench_startup.py [runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask  # noqa: E402
+from project_db import DBManager  # noqa: E402
+
+PROBE = '''
+import time
+start = time.perf_counter()
+import main_app
+imported = time.perf_counter()
+app = main_app.create_app({'DATABASE': %r, 'DEBUG': False})
+created = time.perf_counter()
+app.test_client().get('/api/grades/')
+served = time.perf_counter()
+print(imported - start, created - imported, served - created)
+'''
+
+
+def build_database(path):
+    """
+    Creates the schema, brings it up to date with the migrations and
+    populates it, like project_dbcheck.build_database does.
+    """
+    app = Flask(__name__)
+    app.config['DATABASE'] = path
+    manager = DBManager(app)
+    with app.app_context():
+        manager.init_db(os.path.join(ROOT, 'init_db.sql'))
+        manager.migrate_db(os.path.join(ROOT, 'migrations'))
+        manager.populate_db(os.path.join(ROOT, 'populate_db.sql'))
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    db_fd, db_path = tempfile.mkstemp()
+    try:
+        build_database(db_path)
+
+        samples = {'import': [], 'factory': [], 'first': [], 'cli': []}
+        for _ in range(runs):
+            output = subprocess.check_output(
+                [sys.executable, '-c', PROBE % db_path], cwd=ROOT)
+            imported, created, served = map(float, output.split())
+            samples['import'].append(imported)
+            samples['factory'].append(created)
+            samples['first'].append(served)
+
+            start = time.perf_counter()
+            subprocess.check_call(
+                [sys.executable, '-m', 'flask', '--app', 'main_app', '--help'],
+                cwd=ROOT, stdout=subprocess.DEVNULL)
+            samples['cli'].append(time.perf_counter() - start)
+
+        for name, values in samples.items():
+            print('%-8s %8.2f ms' % (name, statistics.median(values) * 1000))
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+
+if __name__ == '__main__':
+    main()
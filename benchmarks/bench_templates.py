@@ -0,0 +1,96 @@
+"""
+First-request benchmark for the compiled template cache.
+
+Each measurement runs in a fresh interpreter, like a newly forked or
+recycled worker. Reports the median of create_app() and of the first
+request to /student/<username> and /faculty/<username> for:
+
+  no cache   - templates compiled on the first request (the old behaviour)
+  cold cache - empty bytecode cache, templates compiled by the warm-up
+  warm cache - bytecode cache filled by an earlier process, plus warm-up
+
+Run from the repository root:
+  python3 benchmarks/bench_templates.py [runs]
+"""
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask  # noqa: E402
+from project_db import DBManager  # noqa: E402
+
+PROBE = '''
+import time
+import main_app
+start = time.perf_counter()
+app = main_app.create_app({'DATABASE': %r, 'DEBUG': False,
+                           'TEMPLATE_CACHE_DIR': %r, 'TEMPLATE_WARMUP': %r})
+created = time.perf_counter()
+client = app.test_client()
+client.get('/student/micheas')
+student = time.perf_counter()
+client.get('/faculty/Sommer')
+faculty = time.perf_counter()
+print(created - start, student - created, faculty - student)
+'''
+
+MODES = ('no cache', 'cold cache', 'warm cache')
+
+
+def build_database(path):
+    """
+    Creates the schema, brings it up to date with the migrations and
+    populates it, like project_dbcheck.build_database does.
+    """
+    app = Flask(__name__)
+    app.config['DATABASE'] = path
+    manager = DBManager(app)
+    with app.app_context():
+        manager.init_db(os.path.join(ROOT, 'init_db.sql'))
+        manager.migrate_db(os.path.join(ROOT, 'migrations'))
+        manager.populate_db(os.path.join(ROOT, 'populate_db.sql'))
+
+
+def probe(db_path, cache_dir, warmup):
+    output = subprocess.check_output(
+        [sys.executable, '-c', PROBE % (db_path, cache_dir, warmup)],
+        cwd=ROOT)
+    return [float(value) * 1000 for value in output.split()]
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    db_fd, db_path = tempfile.mkstemp()
+    cache_dir = tempfile.mkdtemp()
+    try:
+        build_database(db_path)
+
+        samples = {mode: [] for mode in MODES}
+        for _ in range(runs):
+            samples['no cache'].append(probe(db_path, False, False))
+
+            shutil.rmtree(cache_dir)
+            samples['cold cache'].append(probe(db_path, cache_dir, True))
+            samples['warm cache'].append(probe(db_path, cache_dir, True))
+
+        print('%-12s %12s %13s %13s' % ('', 'create_app', 'first student',
+                                        'first faculty'))
+        for mode in MODES:
+            medians = [statistics.median(column)
+                       for column in zip(*samples[mode])]
+            print('%-12s %9.2f ms %10.2f ms %10.2f ms' % (mode, *medians))
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
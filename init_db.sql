@@ -2,9 +2,22 @@ DROP TABLE IF EXISTS class;
 DROP TABLE IF EXISTS student;
 DROP TABLE IF EXISTS faculty;
 DROP TABLE IF EXISTS grade;
+DROP TABLE IF EXISTS grade_scale;
+DROP TABLE IF EXISTS job;
+DROP TABLE IF EXISTS change_log;
+DROP TABLE IF EXISTS change_log_horizon;
+DROP TABLE IF EXISTS maintenance;
 
 PRAGMA foreign_keys = ON;
 
+-- lets project_maintenance.py hand free pages back a few at a time; only
+-- takes effect on a new file ('flask maintain --vacuum' converts an old one)
+PRAGMA auto_vacuum = INCREMENTAL;
+
+-- the schema below is migration 0; 'flask initdb' applies the scripts in
+-- migrations/ on top of it
+PRAGMA user_version = 0;
+
 CREATE TABLE class(name TEXT, class_id INTEGER PRIMARY KEY);
 
 CREATE TABLE student(name TEXT, student_id INTEGER PRIMARY KEY,
@@ -1,27 +1,59 @@
-from flask import Flask, request, abort, redirect, Response, url_for
-from flask import render_template
+from flask import Blueprint, Flask, request, abort, redirect, Response
+from flask import current_app, render_template, url_for
 from flask_login import LoginManager, login_required, UserMixin
-from flask_login import login_user
-from team_project_db import DBManager
+from flask_login import current_user, login_user
+from project_db import db  # shared DBManager, bound to the app by create_app
+from project_json import RowSetJSONProvider
+from project_admission import AdmissionController
+from project_capture import TrafficRecorder
+from project_changes import ChangeFeed
+from project_jobs import JobRunner
+from project_maintenance import Maintenance
+from project_memory import MemoryProfiler
+from project_passwords import PasswordHasher, PasswordPoolFull
+from project_profiling import RequestProfiler
+from project_push import GradePush
+from project_slowlog import SlowQueryLog, summarize_log
+from project_streaming import RowPage, stream_page
+from project_templates import TemplateCache
+from project_tenants import TenantRouter
+import project_api
+import click
 import os
 
-app = Flask(__name__)
-app.config['DATABASE'] = os.path.join(app.root_path, 'woodle.sqlite')
+# the website is a blueprint; create_app() registers it next to the API
+# blueprint from project_api.py so one process serves both
+site = Blueprint('site', __name__, cli_group=None)
 
-app.config.update(DEBUG=True, SECRET_KEY='secret_xxx')
+# token bucket limits (tokens per second, bucket size) checked before any
+# database work is done for a login or registration
+SITE_ADMISSION_LIMITS = {
+    'site.login': {'methods': ('POST',),
+                   'client_rate': 1.0, 'client_burst': 5,
+                   'global_rate': 50.0, 'global_burst': 100},
+    'site.register': {'methods': ('POST',),
+                      'client_rate': 0.2, 'client_burst': 3,
+                      'global_rate': 10.0, 'global_burst': 20},
+}
+
+# schema changes made after init_db.sql, applied in order by migrate_db()
+MIGRATIONS_DIRECTORY = 'migrations'
 
 # log in managers
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = "login"
-
-db = DBManager(app)  # create object to interact w/ data base
+login_manager.login_view = "site.login"
 
 
 class User(UserMixin):
     """
     A user entity (either student or faculty). Used by login_manager to
     handle tokens for login sessions.
+
+    The id names the table as well as the row, e.g. 'student:1', because
+    student and faculty ids overlap. It is what the session cookie stores,
+    so any worker process can rebuild the user from the database. Users of
+    a tenant (see project_tenants.py) have the tenant in front, e.g.
+    'lincoln/student:1', since each tenant numbers its rows on its own.
     """
 
     def __init__(self, username, password, id, active=True):
@@ -37,6 +69,10 @@ class User(UserMixin):
 class UserRepository:
     """
     Stores users for the session. Long term storage is in the sqlite db
+
+    Each worker process has its own repository, so it is only a cache:
+    load_user() falls back to the database for users that logged in
+    through another worker.
     """
 
     def __init__(self):
@@ -52,7 +88,7 @@ class UserRepository:
     #     return self.users(username)
 
     def get_user_by_id(self, userid):
-        return self.users.get(userid)
+        return self.users_id_dict.get(userid)
 
     def next_index(self):
         self.identifier += 1
@@ -62,7 +98,31 @@ class UserRepository:
 local_user_repository = UserRepository()
 
 
-@app.cli.command('initdb')  # '@app' decorated functions should be in this file
+def make_user_id(kind, row_id):
+    """
+    :return: the User id of row row_id of the student or faculty table of
+    the current tenant
+    """
+    tenant = db.current_tenant()
+    user_id = '%s:%d' % (kind, row_id)
+    return user_id if tenant is None else '%s/%s' % (tenant, user_id)
+
+
+def parse_user_id(userid):
+    """
+    :return: (kind, row id) of a User id of the current tenant, or
+    (None, None) if it is malformed or belongs to another tenant
+    """
+    tenant, _, user_id = userid.rpartition('/')
+    if tenant != (db.current_tenant() or ''):
+        return None, None
+    kind, _, row_id = user_id.partition(':')
+    if kind not in ('student', 'faculty') or not row_id.isdigit():
+        return None, None
+    return kind, int(row_id)
+
+
+@site.cli.command('initdb')
 def init_db():
     """
     When 'flask initdb' is entered on the command line while the program is
@@ -71,10 +131,24 @@ def init_db():
     """
     initialization_sql_file = 'init_db.sql'  # name of sql file that inits db
     db.init_db(initialization_sql_file)
+    db.migrate_db(MIGRATIONS_DIRECTORY)
     print('The website\'s database has been initialized.')
 
 
-@app.cli.command('populatedb')
+@site.cli.command('migratedb')
+def migrate_db():
+    """
+    When 'flask migratedb' is entered on the command line, the scripts in
+    migrations/ that the database has not seen yet are applied. Existing
+    rows are kept.
+    """
+    applied = db.migrate_db(MIGRATIONS_DIRECTORY)
+    for script_name in applied:
+        print('Applied %s' % script_name)
+    print('The website\'s database is up to date.')
+
+
+@site.cli.command('populatedb')
 def populate_db():
     """
     When 'flask populatedb' is entered on the command line while the program is
@@ -87,9 +161,37 @@ def populate_db():
     db.populate_db(populate_db_sql_file)
     print('The website\'s database has been populated.')
 
+
+@site.cli.command('tenant-init')
+@click.argument('name')
+@click.option('--populate', is_flag=True,
+              help='also load the sample data of populate_db.sql')
+def tenant_init_command(name, populate):
+    """
+    Creates the database file of a new tenant (see project_tenants.py).
+    """
+    tenant_router = current_app.extensions.get('tenant_router')
+    if tenant_router is None:
+        raise click.ClickException('TENANT_MODE is not configured')
+    try:
+        database = tenant_router.database_of(name)
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    if os.path.exists(database):
+        raise click.ClickException('%s exists already' % database)
+
+    os.makedirs(os.path.dirname(os.path.abspath(database)), exist_ok=True)
+    db.use_tenant(name, database)
+    db.init_db('init_db.sql')
+    db.migrate_db(MIGRATIONS_DIRECTORY)
+    if populate:
+        db.populate_db('populate_db.sql')
+    print('Created %s for tenant %s' % (database, name))
+
+
 @login_required
-@app.route('/')
-@app.route('/hello')
+@site.route('/')
+@site.route('/hello')
 def index():
     """
     Determines the response to a /hello request
@@ -99,7 +201,7 @@ def index():
 
 
 @login_required
-@app.route('/home')
+@site.route('/home')
 def home():
     """
     Determines response to a /home request
@@ -108,36 +210,102 @@ def home():
 
 
 @login_required
-@app.route('/faculty/<username>')
+@site.route('/faculty/<username>')
 def faculty(username):
     """
-    Determines response to a /faculty request
+    Determines response to a /faculty request. The page is streamed while
+    the roster is read, ROSTER_PAGE_SIZE rows at a time (see
+    project_streaming.py).
 
     :return: a rendered template webpage specific to the faculty memeber
     """
-    faculty_query = db.get_faculty(username)
-    return render_template('faculty.html',
-                           grade=faculty_query,
-                           full_name=db.get_name_of_user(username, 'faculty')
-                           )
+    page = roster_page(db.iter_faculty, username,
+                       lambda after=None: url_for('.faculty',
+                                                  username=username,
+                                                  after=after))
+    return stream_page('faculty.html',
+                       grade=page,
+                       page=page,
+                       full_name=db.get_name_of_user(username, 'faculty')
+                       )
 
 
 @login_required
-@app.route('/student/<username>')
+@site.route('/student/<username>')
 def student(username):
     """
-    Determines response to a /student request
+    Determines response to a /student request. The page is streamed while
+    the grades are read, like the faculty page.
 
     :return: a rendered template webpage specific to the student
     """
-    student_query = db.get_class_grade(username)
-    return render_template('student.html',
-                           grade=student_query,
-                           full_name=db.get_name_of_user(username, 'student')
-                           )
+    # read before the grades: the event stream sends every change after
+    # it, so none saved while the page is on its way is left out
+    since = db.get_last_change()
+    page = roster_page(db.iter_class_grade, username,
+                       lambda after=None: url_for('.student',
+                                                  username=username,
+                                                  after=after))
+    return stream_page('student.html',
+                       grade=page,
+                       page=page,
+                       full_name=db.get_name_of_user(username, 'student'),
+                       events_url=url_for('.student_events',
+                                          username=username, since=since)
+                       )
+
+
+def roster_page(read_rows, username, url):
+    """
+    :param read_rows: DBManager.iter_faculty or iter_class_grade
+    :param url: function(after=None) returning the URL of a page
+    :return: the RowPage of username's rows the ?after= argument asks for
+    """
+    after = request.args.get('after', 0, type=int)
+    size = current_app.config['ROSTER_PAGE_SIZE']
+    return RowPage(read_rows(username, after), size, after, url)
+
 
+@site.route('/student/<username>/events')
+@login_required
+def student_events(username):
+    """
+    Server-sent event stream of the logged-in student's grade changes,
+    used by student.html to update the page in place. It starts after the
+    change log seq in the Last-Event-ID header of a reconnecting browser,
+    or else the ?since= seq the page was rendered at.
 
-@app.route('/login', methods=['GET', 'POST'])
+    :return: a streaming text/event-stream response
+    """
+    # the student id is in the session's user id, so opening a stream
+    # needs no database work beyond catching up on missed events
+    kind, student_id = parse_user_id(current_user.id)
+    if kind != 'student' or current_user.username != username:
+        abort(403)
+
+    last_event_id = request.headers.get('Last-Event-ID') \
+        or request.args.get('since', '')
+    since = int(last_event_id) if last_event_id.isdigit() else None
+
+    grade_push = current_app.extensions['grade_push']
+    subscription = grade_push.subscribe(student_id, since)
+    if subscription is None:
+        return Response('too many open streams\n', status=503,
+                        headers={'Retry-After': '30'})
+
+    missed = []
+    if since is not None:
+        missed = grade_push.missed(student_id, since)
+
+    response = Response(grade_push.stream(subscription, missed),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache',
+                                 'X-Accel-Buffering': 'no'})
+    response.call_on_close(lambda: grade_push.unsubscribe(subscription))
+    return response
+
+
+@site.route('/login', methods=['GET', 'POST'])
 def login():
     """
     This function handles the login process for the website. A successful login
@@ -152,33 +320,39 @@ def login():
         username = request.form['username']
         password = request.form['password']
 
-        # None if username and password are a valid pair
-        query_result = db.query_login_info(username, password)
+        # None if username and password are a valid pair; the password is
+        # checked on the hashing pool (see project_passwords.py)
+        try:
+            query_result = current_app.extensions['password_hasher'].login(
+                username, password)
+        except PasswordPoolFull:
+            return Response('too many logins, try again shortly\n',
+                            status=503, headers={'Retry-After': '5'})
 
         # if a user w/ that username and password exists
         if query_result is not None:
             # if user logging in is a student
             if 'student_id' in query_result[0]:
-                new_session_student_user = User(username,
-                                                password,
-                                                query_result[0]['student_id'])
+                new_session_student_user = User(
+                    username, password,
+                    make_user_id('student', query_result[0]['student_id']))
                 local_user_repository.save_user(new_session_student_user)
                 login_user(new_session_student_user)
-                return redirect(url_for('student', username=username))
+                return redirect(url_for('.student', username=username))
 
             # else user is one of the faculty
             else:
-                new_session_faculty_user = User(username,
-                                                password,
-                                                query_result[0]['faculty_id'])
+                new_session_faculty_user = User(
+                    username, password,
+                    make_user_id('faculty', query_result[0]['faculty_id']))
                 local_user_repository.save_user(new_session_faculty_user)
                 login_user(new_session_faculty_user)
-                return redirect(url_for('faculty', username=username))
+                return redirect(url_for('.faculty', username=username))
 
         # else, username and password are not a pair, no such user exists,
         # so go ahead and direct the user to make one such user
         else:
-            return redirect(url_for('register'))
+            return redirect(url_for('.register'))
 
     # else, get request
     else:
@@ -195,7 +369,7 @@ def login():
         ''')
 
 
-@app.route('/register', methods=['GET', 'POST'])
+@site.route('/register', methods=['GET', 'POST'])
 def register():
     """
     Register a new user such that the user is inserted into the data base.
@@ -211,15 +385,21 @@ def register():
                          'name', 'title', 'class_id']
         for key in all_data_keys:
             if key not in request.form:
-                return redirect(url_for('register'))
+                return redirect(url_for('.register'))
 
         username = request.form['username']
         password = request.form['password']
-        is_student = 'Y' is request.form['is_student']\
-                        or 'y' is request.form['is_student']
+        is_student = 'Y' == request.form['is_student']\
+                        or 'y' == request.form['is_student']
         name = request.form['name']
         title = request.form['title']
         class_id = request.form['class_id']
+        try:
+            password = current_app.extensions['password_hasher'].hash(
+                password)
+        except PasswordPoolFull:
+            return Response('too many registrations, try again shortly\n',
+                            status=503, headers={'Retry-After': '5'})
 
         # if registering user is a student and provided all info
         if is_student:
@@ -228,14 +408,14 @@ def register():
                 return abort(401)
 
             # else, success; go login
-            return redirect(url_for('login'))
+            return redirect(url_for('.login'))
 
         # else, must be faculty
         else:
             # if failed to insert
             db.insert_user(username, password, name, class_id, title=title)
 
-            return redirect(url_for('login'))
+            return redirect(url_for('.login'))
 
     else:
         # Provide a form to create a new user profile
@@ -256,16 +436,296 @@ def register():
 
 
 # handle login failed
-@app.errorhandler(401)
-def page_not_found():
+@site.app_errorhandler(401)
+def page_not_found(error):
     return Response('<p>Login failed</p>')
 
 
 # callback to reload the user object
 @login_manager.user_loader
 def load_user(userid):
-    return local_user_repository.get_user_by_id(userid)
+    # a session from another tenant is not a login here
+    table, row_id = parse_user_id(userid)
+    if table is None:
+        return None
+
+    user = local_user_repository.get_user_by_id(userid)
+    if user is not None:
+        return user
+
+    # logged in through another worker process; rebuild from the database
+    row = db.get_user_by_id(table, row_id)
+    if row is None:
+        return None
+
+    user = User(row['username'], row['password'], userid)
+    local_user_repository.save_user(user)
+    return user
+
+
+@site.cli.command('slow-queries')
+@click.option('--limit', default=20, help='statements to show')
+def slow_queries_command(limit):
+    """
+    Show the slowest statements from the slow-query log, by fingerprint.
+    """
+    slow_query_log = current_app.extensions.get('slow_query_log')
+    if slow_query_log is None or not os.path.exists(slow_query_log.path):
+        print('No slow queries have been logged.')
+        return
+
+    for group in summarize_log(slow_query_log.path)[:limit]:
+        print('%s  %d x, total %.1f ms, max %.1f ms, rows %s' % (
+            group['fingerprint'], group['count'], group['total_ms'],
+            group['max_ms'], group['rows']))
+        print('    ' + group['sql'])
+        for line in group['plan'] or []:
+            print('    plan: ' + line)
+
+
+@site.cli.command('transcripts')
+@click.option('--out', default=None,
+              help='output folder (default: instance/transcripts)')
+@click.option('--workers', default=0,
+              help='worker processes (default: one per CPU)')
+def transcripts_command(out, workers):
+    """
+    Write an HTML transcript for every student, rendered in parallel.
+    """
+    from project_transcripts import RANGES_PER_WORKER, generate_transcripts
+
+    workers = workers or os.cpu_count() or 1
+    out = out or os.path.join(current_app.instance_path, 'transcripts')
+    id_ranges = [(row['first_id'], row['last_id']) for row in
+                 db.get_student_id_ranges(workers * RANGES_PER_WORKER)]
+    db.close_db()  # the workers open their own connections
+
+    result = generate_transcripts(create_app, current_app.config['DATABASE'],
+                                  out, workers, id_ranges)
+    print('Wrote %d transcripts to %s in %.2f s (%.0f per second, '
+          '%d workers)' % (result['transcripts'], out, result['seconds'],
+                           result['per_second'], result['workers']))
+
+
+@site.cli.command('compile-templates')
+def compile_templates_command():
+    """
+    Compile every template into the shared bytecode cache.
+    """
+    template_cache = current_app.extensions['template_cache']
+    timings = template_cache.warm_up(current_app)
+    for name, milliseconds in sorted(timings.items()):
+        print('%-20s %8.2f ms' % (name, milliseconds))
+    print('Compiled %d templates into %s' % (
+        len(timings), template_cache.directory or 'memory only'))
+
+
+@site.cli.command('compact-changes')
+@click.option('--keep-hours', default=None, type=float,
+              help='hours of full history to keep (default: '
+                   'CHANGES_RETENTION)')
+def compact_changes_command(keep_hours):
+    """
+    Drop superseded and old delete entries from the change log.
+    """
+    change_feed = current_app.extensions['change_feed']
+    result = change_feed.compact(keep_hours * 3600
+                                 if keep_hours is not None else None)
+    print('Dropped %d superseded and %d delete entries; horizon is now %d'
+          % (result['superseded'], result['deletes'], result['horizon']))
+
+
+@site.cli.command('backup')
+@click.option('--out', default=None,
+              help='backup folder (default: BACKUP_DIR)')
+@click.option('--keep', default=None, type=int,
+              help='backups to keep (default: BACKUP_KEEP)')
+@click.option('--pages', default=None, type=int,
+              help='pages copied per step (default: BACKUP_STEP_PAGES)')
+@click.option('--pause', default=None, type=float,
+              help='seconds between steps (default: BACKUP_STEP_PAUSE)')
+@click.option('--every', default=None, type=float,
+              help='keep running and back up every this many hours')
+def backup_command(out, keep, pages, pause, every):
+    """
+    Back up the live database without blocking the site.
+    """
+    import time
+    from project_backup import backup_database, backup_settings
+    from project_backup import prune_backups
+
+    settings = backup_settings(current_app)
+    out = out or settings['directory']
+    keep = keep if keep is not None else settings['keep']
+    pages = pages or settings['pages']
+    pause = pause if pause is not None else settings['pause']
+
+    def report(copied, total):
+        click.echo('\r%d of %d pages (%.0f%%)' % (
+            copied, total, 100.0 * copied / total if total else 100.0),
+            nl=False)
+
+    while True:
+        result = backup_database(current_app.config['DATABASE'], out, pages,
+                                 pause, settings['max_restarts'], report)
+        click.echo()
+        print('Wrote %s: %d pages, %.1f MB in %.2f s (%.1f MB/s, '
+              '%d restarts%s), quick_check %s' % (
+                  result['path'], result['pages'], result['bytes'] / 1e6,
+                  result['seconds'], result['mb_per_second'],
+                  result['restarts'],
+                  ', finished in one step' if result['single_step'] else '',
+                  result['check']))
+        for path in prune_backups(out, keep):
+            print('Removed ' + path)
+
+        if every is None:
+            break
+        time.sleep(every * 3600)
+
+
+@site.cli.command('maintain')
+@click.option('--force', is_flag=True,
+              help='run every task, whatever the thresholds say')
+@click.option('--vacuum', is_flag=True,
+              help='first rebuild the file with incremental auto_vacuum; '
+                   'locks the database while it runs')
+def maintain_command(force, vacuum):
+    """
+    Run a database maintenance round now and show its effect.
+    """
+    if vacuum:
+        db.vacuum()
+        print('Rebuilt the database with incremental auto_vacuum')
+
+    result = current_app.extensions['maintenance'].run(force)
+    for task, outcome in result['tasks'].items():
+        print('%-16s %s' % (task, outcome))
+    if not result['tasks']:
+        print('Nothing was due.')
+
+    before, after = result['before'], result['after']
+    print('%-20s %12s %12s' % ('', 'before', 'after'))
+    print('%-20s %12d %12d' % ('file bytes', before['file_bytes'],
+                               after['file_bytes']))
+    print('%-20s %12d %12d' % ('free pages',
+                               before['storage']['freelist_count'],
+                               after['storage']['freelist_count']))
+    for name in before['probes']:
+        print('%-20s %9.3f ms %9.3f ms' % (name, before['probes'][name],
+                                           after['probes'][name]))
+
+
+@site.cli.command('serve')
+@click.option('--host', default='127.0.0.1', help='interface to listen on')
+@click.option('--port', default=5000, help='port to listen on')
+@click.option('--workers', default=0,
+              help='worker processes (default: one per CPU)')
+@click.option('--threads', default=4, help='request threads per worker')
+@click.option('--reload', is_flag=True,
+              help='restart the workers when a source file changes')
+def serve_command(host, port, workers, threads, reload):
+    """
+    Serve the site and the API from pre-forked worker processes.
+    """
+    from project_serve import serve
+
+    serve(create_app, host, port, workers or None, threads,
+          reload_root=current_app.root_path if reload else None)
+
+
+def create_app(config=None):
+    """
+    Builds the Flask app serving both the website and the API.
+
+    Nothing slow happens here: the database is only opened when a request
+    (or CLI command) first needs a connection, so the flask command and the
+    tests start quickly. The templates are warmed up from the shared
+    bytecode cache (see project_templates.py), which takes a few
+    milliseconds once the cache is filled.
+
+    :param config: optional dict of settings that override the defaults,
+    e.g. {'DATABASE': '/tmp/test.sqlite', 'TESTING': True}
+    :return: the Flask app
+    """
+    app = Flask(__name__)
+    app.json = RowSetJSONProvider(app)  # encodes RowSets without per-row dicts
+
+    app.config.update(DEBUG=True, SECRET_KEY='secret_xxx')
+    app.config['DATABASE'] = os.path.join(app.root_path, 'woodle.sqlite')
+    app.config['ADMISSION_LIMITS'] = dict(SITE_ADMISSION_LIMITS,
+                                          **project_api.API_ADMISSION_LIMITS)
+
+    # optional traffic capture for load tests
+    # (WOODLE_CAPTURE_FILE=traffic.jsonl)
+    app.config['CAPTURE_FILE'] = os.environ.get('WOODLE_CAPTURE_FILE')
+    app.config['CAPTURE_SAMPLE_RATE'] = float(
+        os.environ.get('WOODLE_CAPTURE_SAMPLE_RATE', 0.1))
+
+    # on-demand profiling, off unless a token or a sample rate is set
+    app.config['PROFILE_TOKEN'] = os.environ.get('WOODLE_PROFILE_TOKEN')
+    app.config['PROFILE_SAMPLE_RATE'] = float(
+        os.environ.get('WOODLE_PROFILE_SAMPLE_RATE', 0))
+
+    # memory instrumentation, off unless a token or a sample rate is set
+    app.config['MEMORY_TOKEN'] = os.environ.get('WOODLE_MEMORY_TOKEN')
+    app.config['MEMORY_SAMPLE_RATE'] = float(
+        os.environ.get('WOODLE_MEMORY_SAMPLE_RATE', 0))
+
+    # password hashing cost is calibrated to this many seconds per check
+    app.config['PASSWORD_VERIFY_SECONDS'] = float(
+        os.environ.get('WOODLE_PASSWORD_VERIFY_SECONDS', 0.05))
+
+    # statements slower than this many milliseconds go to the slow-query log
+    app.config['SLOW_QUERY_MS'] = float(
+        os.environ.get('WOODLE_SLOW_QUERY_MS', 100))
+
+    # threads per process running background jobs (project_jobs.py)
+    app.config['JOB_WORKERS'] = int(os.environ.get('WOODLE_JOB_WORKERS', 2))
+    # lets admins start the backup and maintenance jobs from the API
+    app.config['JOB_ADMIN_TOKEN'] = os.environ.get('WOODLE_JOB_ADMIN_TOKEN')
+
+    # seconds between background maintenance rounds (project_maintenance.py)
+    app.config['MAINTENANCE_INTERVAL'] = float(
+        os.environ.get('WOODLE_MAINTENANCE_INTERVAL', 600))
+
+    # rows per faculty or student page; 0 puts every row on one page
+    app.config['ROSTER_PAGE_SIZE'] = int(
+        os.environ.get('WOODLE_ROSTER_PAGE_SIZE', 500))
+
+    # per-school databases, off unless a mode is set (project_tenants.py)
+    app.config['TENANT_MODE'] = os.environ.get('WOODLE_TENANT_MODE')
+    app.config['TENANT_DOMAIN'] = os.environ.get('WOODLE_TENANT_DOMAIN')
+    app.config['TENANT_ADMIN_TOKEN'] = os.environ.get(
+        'WOODLE_TENANT_ADMIN_TOKEN')
+
+    if config is not None:
+        app.config.update(config)
+
+    db.init_app(app)
+    login_manager.init_app(app)
+    TenantRouter(app, db)  # its WSGI wrapper runs before everything else
+
+    # capture is installed before admission control so shed requests are
+    # recorded too
+    TrafficRecorder(app)
+    admission = AdmissionController(app)
+    RequestProfiler(app, db)
+    MemoryProfiler(app)
+    SlowQueryLog(app, db)
+    PasswordHasher(app, db)
+    JobRunner(app, db)
+    ChangeFeed(app, db)
+    GradePush(app, db)
+    Maintenance(app, db)
+    admission.set_rejection('api', project_api.too_many_requests)
+
+    app.register_blueprint(site)
+    app.register_blueprint(project_api.api)
+    TemplateCache(app)  # last, so the warm-up sees every blueprint
+
+    return app
 
 
 if __name__ == "__main__":
-    app.run(app.run(host='127.0.0.1', port=12345))
+    create_app().run(host='127.0.0.1', port=12345)
@@ -0,0 +1,13 @@
+-- One grade per student per class. Lets a class's grades be upserted in a
+-- single statement (INSERT ... ON CONFLICT) and makes looking up a class's
+-- grades an index search instead of a table scan.
+
+-- Databases from before this migration may hold several grades for the same
+-- student in the same class; the last one entered (highest rowid) is kept.
+DELETE FROM grade
+WHERE class_id IS NOT NULL AND student_id IS NOT NULL
+AND rowid NOT IN (SELECT MAX(rowid) FROM grade
+                  GROUP BY class_id, student_id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS grade_class_student
+    ON grade(class_id, student_id);
@@ -0,0 +1,15 @@
+-- Background jobs run by project_jobs.JobRunner. parameters and result are
+-- JSON; worker_pid is the process running the job, so a job whose process
+-- died can be told apart from one still running.
+CREATE TABLE IF NOT EXISTS job(job_id INTEGER PRIMARY KEY,
+                               kind TEXT NOT NULL,
+                               status TEXT NOT NULL DEFAULT 'queued',
+                               parameters TEXT,
+                               progress REAL NOT NULL DEFAULT 0,
+                               message TEXT,
+                               result TEXT,
+                               error TEXT,
+                               worker_pid INTEGER,
+                               created REAL NOT NULL,
+                               started REAL,
+                               finished REAL);
@@ -0,0 +1,122 @@
+-- Append-only change log read by GET /api/changes. Triggers on class,
+-- student, faculty and grade add one entry per changed row. seq never goes
+-- backwards and is never reused (AUTOINCREMENT), even after compaction.
+-- data is the row as JSON after the change (before it, for deletes);
+-- passwords are left out. grade has no key of its own, so its entries use
+-- the rowid.
+CREATE TABLE IF NOT EXISTS change_log(
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    table_name TEXT NOT NULL,
+    row_id INTEGER NOT NULL,
+    operation TEXT NOT NULL,
+    data TEXT,
+    changed REAL NOT NULL
+        DEFAULT ((julianday('now') - 2440587.5) * 86400.0));
+
+-- used by compaction to find the newest entry of each row
+CREATE INDEX IF NOT EXISTS change_log_row
+    ON change_log(table_name, row_id, seq);
+
+-- highest seq whose entry compaction dropped without a newer entry for the
+-- same row; a consumer that has not read up to it has missed a delete
+CREATE TABLE IF NOT EXISTS change_log_horizon(seq INTEGER NOT NULL);
+INSERT INTO change_log_horizon(seq) VALUES(0);
+
+CREATE TRIGGER IF NOT EXISTS class_insert_log AFTER INSERT ON class
+BEGIN
+    INSERT INTO change_log(table_name, row_id, operation, data)
+    VALUES('class', NEW.class_id, 'insert',
+            json_object('name', NEW.name, 'class_id', NEW.class_id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS class_update_log AFTER UPDATE ON class
+BEGIN
+    INSERT INTO change_log(table_name, row_id, operation, data)
+    VALUES('class', NEW.class_id, 'update',
+            json_object('name', NEW.name, 'class_id', NEW.class_id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS class_delete_log AFTER DELETE ON class
+BEGIN
+    INSERT INTO change_log(table_name, row_id, operation, data)
+    VALUES('class', OLD.class_id, 'delete',
+            json_object('name', OLD.name, 'class_id', OLD.class_id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS student_insert_log AFTER INSERT ON student
+BEGIN
+    INSERT INTO change_log(table_name, row_id, operation, data)
+    VALUES('student', NEW.student_id, 'insert',
+            json_object('name', NEW.name, 'student_id', NEW.student_id,
+                        'username', NEW.username, 'class_id', NEW.class_id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS student_update_log AFTER UPDATE ON student
+BEGIN
+    INSERT INTO change_log(table_name, row_id, operation, data)
+    VALUES('student', NEW.student_id, 'update',
+            json_object('name', NEW.name, 'student_id', NEW.student_id,
+                        'username', NEW.username, 'class_id', NEW.class_id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS student_delete_log AFTER DELETE ON student
+BEGIN
+    INSERT INTO change_log(table_name, row_id, operation, data)
+    VALUES('student', OLD.student_id, 'delete',
+            json_object('name', OLD.name, 'student_id', OLD.student_id,
+                        'username', OLD.username, 'class_id', OLD.class_id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS faculty_insert_log AFTER INSERT ON faculty
+BEGIN
+    INSERT INTO change_log(table_name, row_id, operation, data)
+    VALUES('faculty', NEW.faculty_id, 'insert',
+            json_object('name', NEW.name, 'title', NEW.title,
+                        'faculty_id', NEW.faculty_id,
+                        'username', NEW.username, 'class_id', NEW.class_id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS faculty_update_log AFTER UPDATE ON faculty
+BEGIN
+    INSERT INTO change_log(table_name, row_id, operation, data)
+    VALUES('faculty', NEW.faculty_id, 'update',
+            json_object('name', NEW.name, 'title', NEW.title,
+                        'faculty_id', NEW.faculty_id,
+                        'username', NEW.username, 'class_id', NEW.class_id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS faculty_delete_log AFTER DELETE ON faculty
+BEGIN
+    INSERT INTO change_log(table_name, row_id, operation, data)
+    VALUES('faculty', OLD.faculty_id, 'delete',
+            json_object('name', OLD.name, 'title', OLD.title,
+                        'faculty_id', OLD.faculty_id,
+                        'username', OLD.username, 'class_id', OLD.class_id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS grade_insert_log AFTER INSERT ON grade
+BEGIN
+    INSERT INTO change_log(table_name, row_id, operation, data)
+    VALUES('grade', NEW.rowid, 'insert',
+            json_object('grade', NEW.grade, 'class_id', NEW.class_id,
+                        'student_id', NEW.student_id,
+                        'faculty_id', NEW.faculty_id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS grade_update_log AFTER UPDATE ON grade
+BEGIN
+    INSERT INTO change_log(table_name, row_id, operation, data)
+    VALUES('grade', NEW.rowid, 'update',
+            json_object('grade', NEW.grade, 'class_id', NEW.class_id,
+                        'student_id', NEW.student_id,
+                        'faculty_id', NEW.faculty_id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS grade_delete_log AFTER DELETE ON grade
+BEGIN
+    INSERT INTO change_log(table_name, row_id, operation, data)
+    VALUES('grade', OLD.rowid, 'delete',
+            json_object('grade', OLD.grade, 'class_id', OLD.class_id,
+                        'student_id', OLD.student_id,
+                        'faculty_id', OLD.faculty_id));
+END;
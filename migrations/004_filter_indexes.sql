@@ -0,0 +1,8 @@
+-- Indexes behind the ?class_id=, ?username= and ?faculty= filters of the
+-- grade and student API (DBManager.read_class_grades) and the username
+-- lookups done on every login and page view.
+CREATE INDEX IF NOT EXISTS student_class ON student(class_id);
+CREATE INDEX IF NOT EXISTS student_username ON student(username);
+CREATE INDEX IF NOT EXISTS faculty_username ON faculty(username);
+CREATE INDEX IF NOT EXISTS grade_faculty ON grade(faculty_id);
+CREATE INDEX IF NOT EXISTS grade_grade ON grade(grade);
@@ -0,0 +1,7 @@
+-- when each maintenance task last ran (see project_maintenance.py). For
+-- 'analyze:<table>' last_seq is the change log position reached by the last
+-- ANALYZE of the table, so the writes to it since can be counted.
+CREATE TABLE IF NOT EXISTS maintenance(task TEXT PRIMARY KEY,
+                                       last_run REAL NOT NULL DEFAULT 0,
+                                       last_seq INTEGER NOT NULL DEFAULT 0,
+                                       result TEXT);
@@ -0,0 +1,83 @@
+-- Grades are stored as small integer codes into grade_scale instead of as
+-- letters in every row; readers join back to the letter for display.
+-- ordering sorts best first; points is NULL for grades that do not count
+-- towards a GPA.
+CREATE TABLE IF NOT EXISTS grade_scale(code INTEGER PRIMARY KEY,
+                                       letter TEXT NOT NULL UNIQUE,
+                                       points REAL,
+                                       ordering INTEGER NOT NULL);
+
+INSERT OR IGNORE INTO grade_scale(code, letter, points, ordering)
+VALUES (1, 'A+', 4.0, 1), (2, 'A', 4.0, 2), (3, 'A-', 3.7, 3),
+       (4, 'B+', 3.3, 4), (5, 'B', 3.0, 5), (6, 'B-', 2.7, 6),
+       (7, 'C+', 2.3, 7), (8, 'C', 2.0, 8), (9, 'C-', 1.7, 9),
+       (10, 'D+', 1.3, 10), (11, 'D', 1.0, 11), (12, 'D-', 0.7, 12),
+       (13, 'F', 0.0, 13), (14, 'P', NULL, 14), (15, 'NP', NULL, 15),
+       (16, 'I', NULL, 16), (17, 'W', NULL, 17);
+
+-- letters already given that are not on the scale keep their meaning
+INSERT INTO grade_scale(letter, ordering)
+SELECT DISTINCT grade, 100 FROM grade
+WHERE grade IS NOT NULL
+AND grade NOT IN (SELECT letter FROM grade_scale);
+
+-- sqlite cannot change a column's type, so the table is rebuilt; rowids
+-- are kept, so the change log still points at the same grades
+CREATE TABLE grade_coded(grade_code INTEGER,
+                         class_id INTEGER, student_id INTEGER,
+                         faculty_id INTEGER,
+                         FOREIGN KEY (grade_code) REFERENCES grade_scale(code),
+                         FOREIGN KEY (class_id) REFERENCES class(class_id),
+                         FOREIGN KEY (student_id)
+                             REFERENCES student(student_id),
+                         FOREIGN KEY (faculty_id)
+                             REFERENCES faculty(faculty_id));
+
+INSERT INTO grade_coded(rowid, grade_code, class_id, student_id, faculty_id)
+SELECT grade.rowid, grade_scale.code, grade.class_id, grade.student_id,
+       grade.faculty_id
+FROM grade LEFT JOIN grade_scale ON grade_scale.letter = grade.grade;
+
+DROP TABLE grade;
+ALTER TABLE grade_coded RENAME TO grade;
+
+CREATE UNIQUE INDEX IF NOT EXISTS grade_class_student
+    ON grade(class_id, student_id);
+CREATE INDEX IF NOT EXISTS grade_faculty ON grade(faculty_id);
+CREATE INDEX IF NOT EXISTS grade_code ON grade(grade_code);
+-- covers the grade distribution report: counted straight off the index
+CREATE INDEX IF NOT EXISTS grade_class_code ON grade(class_id, grade_code);
+
+-- the change log keeps recording letters, so its consumers see no change
+CREATE TRIGGER IF NOT EXISTS grade_insert_log AFTER INSERT ON grade
+BEGIN
+    INSERT INTO change_log(table_name, row_id, operation, data)
+    VALUES('grade', NEW.rowid, 'insert',
+            json_object('grade', (SELECT letter FROM grade_scale
+                                  WHERE code = NEW.grade_code),
+                        'class_id', NEW.class_id,
+                        'student_id', NEW.student_id,
+                        'faculty_id', NEW.faculty_id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS grade_update_log AFTER UPDATE ON grade
+BEGIN
+    INSERT INTO change_log(table_name, row_id, operation, data)
+    VALUES('grade', NEW.rowid, 'update',
+            json_object('grade', (SELECT letter FROM grade_scale
+                                  WHERE code = NEW.grade_code),
+                        'class_id', NEW.class_id,
+                        'student_id', NEW.student_id,
+                        'faculty_id', NEW.faculty_id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS grade_delete_log AFTER DELETE ON grade
+BEGIN
+    INSERT INTO change_log(table_name, row_id, operation, data)
+    VALUES('grade', OLD.rowid, 'delete',
+            json_object('grade', (SELECT letter FROM grade_scale
+                                  WHERE code = OLD.grade_code),
+                        'class_id', OLD.class_id,
+                        'student_id', OLD.student_id,
+                        'faculty_id', OLD.faculty_id));
+END;
@@ -7,8 +7,8 @@ VALUES('Micheas', 1, 'micheas', 'micheas');
 INSERT INTO faculty(name, title, username, password, class_id)
 VALUES('Sommer','Prof','Sommer', 'Sommer', 1);
 
-INSERT INTO grade(grade, class_id, student_id, faculty_id)
-VALUES ('A',1,1,1);
+INSERT INTO grade(grade_code, class_id, student_id, faculty_id)
+VALUES ((SELECT code FROM grade_scale WHERE letter = 'A'),1,1,1);
 
 INSERT INTO class(name)
 VALUES('Math-339');
@@ -19,8 +19,8 @@ VALUES('Micheas', 2, 'micheas', 'micheas');
 INSERT INTO faculty(name, title, username, password, class_id)
 VALUES('Hartman','Prof','Hartman', 'Hartman', 2);
 
-INSERT INTO grade(grade, class_id, student_id, faculty_id)
-VALUES ('A',2,1,2);
+INSERT INTO grade(grade_code, class_id, student_id, faculty_id)
+VALUES ((SELECT code FROM grade_scale WHERE letter = 'A'),2,1,2);
 
 INSERT INTO class(name)
 VALUES('Math-229');
@@ -31,8 +31,8 @@ VALUES('Micheas', 3, 'micheas', 'micheas');
 INSERT INTO faculty(name, title, username, password, class_id)
 VALUES('Pasteur','Prof','Pasteur', 'Pasteur', 3);
 
-INSERT INTO grade(grade, class_id, student_id, faculty_id)
-VALUES ('B-',3,1,3);
+INSERT INTO grade(grade_code, class_id, student_id, faculty_id)
+VALUES ((SELECT code FROM grade_scale WHERE letter = 'B-'),3,1,3);
 
 /* More aribitray entries */
 /* classes */
@@ -70,7 +70,7 @@ INSERT INTO faculty(name, title, username, password, class_id) /* 7 */
 VALUES('The Mysterious Stranger','Prof','username', 'password', 11);
 
 /* grades */
-INSERT INTO grade(grade, class_id, student_id, faculty_id)
-VALUES ('C+', 5, 4, 6);
-INSERT INTO grade(grade, class_id, student_id, faculty_id)
-VALUES ('C+', 6, 8, 4);
+INSERT INTO grade(grade_code, class_id, student_id, faculty_id)
+VALUES ((SELECT code FROM grade_scale WHERE letter = 'C+'), 5, 4, 6);
+INSERT INTO grade(grade_code, class_id, student_id, faculty_id)
+VALUES ((SELECT code FROM grade_scale WHERE letter = 'C+'), 6, 8, 4);
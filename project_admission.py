@@ -0,0 +1,351 @@
+"""
+Admission control for the Flask apps.
+
+Requests to rate limited endpoints must take a token from two token buckets
+before the view runs: one bucket for the client and one global bucket shared
+by every client. When either bucket is empty the request is rejected with a
+429 straight from a before_request hook, so no database work is done. A
+client turned away by the global bucket gets its own token back.
+
+Limits are set per endpoint in app.config['ADMISSION_LIMITS']:
+
+    app.config['ADMISSION_LIMITS'] = {
+        'site.login': {'methods': ('POST',),
+                       'client_rate': 1.0, 'client_burst': 5,
+                       'global_rate': 50.0, 'global_burst': 100},
+    }
+
+Endpoints are named the way url_for() names them, blueprint included.
+Rates are tokens per second and bursts are bucket capacities. Either pair
+can be left out to skip that bucket.
+
+Buckets live in process memory by default. Setting
+app.config['ADMISSION_SHARED_FILE'] to a path keeps them in a memory mapped
+file instead, so every worker process on the machine draws from the same
+buckets.
+"""
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from flask import Response, request
+
+
+class MemoryBucketStore:
+    """
+    Token buckets kept in a dictionary in this process. The number of
+    per-client buckets is bounded; the least recently used client bucket is
+    dropped when the store is full.
+    """
+
+    def __init__(self, max_buckets=100000):
+        self.max_buckets = max_buckets
+        self.buckets = OrderedDict()  # key -> [tokens, last refill time]
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        """
+        Refills the bucket for key and takes one token from it if it can.
+
+        :param key: bucket name
+        :param rate: tokens added per second
+        :param burst: bucket capacity
+        :param now: current time.monotonic() value
+        :return: (True, 0) if a token was taken, else (False, seconds until
+        the next token)
+        """
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = [float(burst), now]
+                self.buckets[key] = bucket
+                if len(self.buckets) > self.max_buckets:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+
+            return _take_token(bucket, rate, burst, now)
+
+    def give_back(self, key, rate, burst):
+        """
+        Returns a token taken from the bucket for key, e.g. when another
+        bucket refused the request it was taken for.
+        """
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket[0] = min(float(burst), bucket[0] + 1.0)
+
+
+class SharedBucketStore:
+    """
+    Token buckets kept in a memory mapped file so several worker processes
+    share them. The file is a fixed table of slots; a bucket key is hashed
+    to a slot and probes the next PROBES slots from there. Each slot holds
+    the key hash, the token count, the last refill time and the time the
+    bucket will be full again. An exclusive flock() on the file serialises
+    updates between processes.
+
+    A key takes a free slot, or a slot whose bucket is full again: that
+    bucket is the same as a new one, so dropping it loses nothing. When
+    every probed slot belongs to a bucket that is still drawn down, the
+    request is refused rather than resetting another key's bucket.
+
+    Times are stored from time.time() because time.monotonic() is not
+    comparable across processes.
+    """
+
+    SLOT = struct.Struct('<Qddd')
+    PROBES = 8
+
+    def __init__(self, path, slots=4096):
+        self.path = path
+        self.slots = slots
+        self.lock = threading.Lock()
+
+        size = self.SLOT.size * slots
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        self.map = mmap.mmap(self.fd, size)
+
+    def find_slot(self, key_hash, now):
+        """
+        Probes the slots of key_hash; called with the file locked.
+
+        :return: (offset, slot values) of the key's slot, (offset, None) of
+        a slot it may claim, or (None, seconds until one can be claimed)
+        """
+        first = key_hash % self.slots
+        claimable, wait = None, None
+        for probe in range(min(self.PROBES, self.slots)):
+            offset = ((first + probe) % self.slots) * self.SLOT.size
+            slot = self.SLOT.unpack_from(self.map, offset)
+            if slot[0] == key_hash:
+                return offset, slot
+            if slot[0] == 0 or slot[3] <= now:
+                if claimable is None:
+                    claimable = offset
+            elif wait is None or slot[3] - now < wait:
+                wait = slot[3] - now
+        if claimable is not None:
+            return claimable, None
+        return None, wait
+
+    def take(self, key, rate, burst, now):
+        """
+        Same as MemoryBucketStore.take(), but the bucket state lives in the
+        shared file. now is ignored in favour of the wall clock.
+        """
+        now = time.time()
+        key_hash = _key_hash(key)
+
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                offset, slot = self.find_slot(key_hash, now)
+                if offset is None:
+                    return False, slot  # every probed slot is in use
+
+                if slot is None:
+                    bucket = [float(burst), now]
+                else:
+                    bucket = [slot[1], slot[2]]
+                result = _take_token(bucket, rate, burst, now)
+                self.SLOT.pack_into(self.map, offset, key_hash, *bucket,
+                                    _full_at(bucket, rate, burst))
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+        return result
+
+    def give_back(self, key, rate, burst):
+        """
+        Same as MemoryBucketStore.give_back().
+        """
+        key_hash = _key_hash(key)
+
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                offset, slot = self.find_slot(key_hash, time.time())
+                if slot is not None:
+                    bucket = [min(float(burst), slot[1] + 1.0), slot[2]]
+                    self.SLOT.pack_into(self.map, offset, key_hash, *bucket,
+                                        _full_at(bucket, rate, burst))
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def close(self):
+        self.map.close()
+        os.close(self.fd)
+
+
+def _key_hash(key):
+    """
+    :return: 64 bit hash of a bucket key; 0 is kept to mark a free slot
+    """
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+
+def _full_at(bucket, rate, burst):
+    """
+    :return: the time bucket ([tokens, last refill time]) is full again
+    """
+    if rate <= 0:
+        return math.inf
+    return bucket[1] + max(0.0, float(burst) - bucket[0]) / rate
+
+
+def _take_token(bucket, rate, burst, now):
+    """
+    Refills bucket ([tokens, last refill time]) in place and takes a token.
+
+    :return: (True, 0) on success, else (False, seconds until a token)
+    """
+    tokens = min(float(burst), bucket[0] + max(0.0, now - bucket[1]) * rate)
+    bucket[1] = now
+
+    if tokens >= 1.0:
+        bucket[0] = tokens - 1.0
+        return True, 0.0
+
+    bucket[0] = tokens
+    return False, (1.0 - tokens) / rate if rate > 0 else 60.0
+
+
+class AdmissionController:
+    """
+    Rejects requests to rate limited endpoints before they reach the view.
+
+    Counters of admitted and shed requests are kept per endpoint and can be
+    read with stats().
+    """
+
+    def __init__(self, app=None, client_key=None, on_reject=None):
+        """
+        :param app: Flask app to install on; init_app() can be called later
+        :param client_key: function returning the client identity for the
+        current request; defaults to the remote address
+        :param on_reject: function taking the retry delay in seconds and
+        returning the 429 response; defaults to a short HTML message
+        """
+        self.client_key = client_key or _remote_address
+        self.on_reject = on_reject or _default_rejection
+        self.blueprint_rejections = {}
+        self.limits = {}
+        self.store = MemoryBucketStore()
+        self.counters = {}
+        self.counter_lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Reads the limits from the app config and registers the hook that
+        checks every request.
+        """
+        self.limits = dict(app.config.get('ADMISSION_LIMITS', {}))
+        shared_file = app.config.get('ADMISSION_SHARED_FILE')
+        if shared_file:
+            self.store = SharedBucketStore(shared_file)
+
+        app.extensions['admission'] = self
+        app.before_request(self.check_request)
+
+    def set_rejection(self, blueprint, on_reject):
+        """
+        Uses on_reject instead of the default for endpoints of a blueprint,
+        e.g. to answer API clients with JSON.
+
+        :param blueprint: blueprint name
+        :param on_reject: function taking the retry delay in seconds and
+        returning the 429 response
+        """
+        self.blueprint_rejections[blueprint] = on_reject
+
+    def check_request(self):
+        """
+        before_request hook. Returns a 429 response when the request must
+        be shed, otherwise None so Flask carries on to the view.
+        """
+        limit = self.limits.get(request.endpoint)
+        if limit is None:
+            return None
+
+        methods = limit.get('methods')
+        if methods and request.method not in methods:
+            return None
+
+        admitted, retry_after = self.admit(request.endpoint, limit,
+                                           self.client_key())
+        if admitted:
+            return None
+
+        on_reject = self.blueprint_rejections.get(request.blueprint,
+                                                  self.on_reject)
+        return on_reject(retry_after)
+
+    def admit(self, endpoint, limit, client):
+        """
+        Takes a token from the client bucket and the global bucket.
+
+        :return: (admitted, seconds until the client should retry)
+        """
+        now = time.monotonic()
+
+        if 'client_rate' in limit:
+            admitted, retry_after = self.store.take(
+                '%s|%s' % (endpoint, client),
+                limit['client_rate'], limit['client_burst'], now)
+            if not admitted:
+                self.count(endpoint, 'shed')
+                return False, retry_after
+
+        if 'global_rate' in limit:
+            admitted, retry_after = self.store.take(
+                endpoint, limit['global_rate'], limit['global_burst'], now)
+            if not admitted:
+                if 'client_rate' in limit:
+                    # the request was not served, so it does not count
+                    # against the client
+                    self.store.give_back(
+                        '%s|%s' % (endpoint, client),
+                        limit['client_rate'], limit['client_burst'])
+                self.count(endpoint, 'shed')
+                return False, retry_after
+
+        self.count(endpoint, 'admitted')
+        return True, 0.0
+
+    def count(self, endpoint, outcome):
+        with self.counter_lock:
+            counter = self.counters.setdefault(endpoint,
+                                               {'admitted': 0, 'shed': 0})
+            counter[outcome] += 1
+
+    def stats(self):
+        """
+        :return: dict of endpoint -> {'admitted': n, 'shed': n}
+        """
+        with self.counter_lock:
+            return {endpoint: dict(counter)
+                    for endpoint, counter in self.counters.items()}
+
+
+def _remote_address():
+    return request.remote_addr or 'unknown'
+
+
+def _default_rejection(retry_after):
+    response = Response('<p>Too many requests, try again shortly</p>',
+                        status=429)
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
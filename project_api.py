@@ -5,16 +5,40 @@ and website. API requests return JSON objects or an error code with a message.
 The API provides support for GET and POST requests where
 relevant and allowed.
 
+GET /api/students/ and GET /api/grades/ return one row per grade, with the
+student it was given to and the class it was given in. They can be narrowed
+down so only what is needed is read and sent. Each parameter takes a comma
+separated list:
+fields - columns to return, some of s_name, c_name, grade, username,
+         student_id, class_id (default s_name, c_name, grade)
+class_id - only grades given in these classes
+student_id - only rows of these students (their ids)
+username - only rows of these students
+faculty - only grades given by these faculty members (their usernames)
+grade - only these grades, e.g. grade=A,A-
+For example /api/grades/?class_id=4&fields=s_name,grade
+
+GET requests that return table rows accept an optional format parameter.
+format=columns returns the column names once followed by an array of row
+arrays, which is much smaller for large results:
+{
+    columns: ["s_name", "c_name", "grade"],
+    rows: [["Johnny Johns", "CS-232", "A"], ["Daniel Daniellovich", ...]]
+}
+
 ### Supported Requests
 
                             ## Student Requests
 # GET class requests
 
 GET /api/students/
+GET /api/students/<student_id>
 Description:
-Get all student entities from the student table.
+Get all student entities from the student table, or the rows of one
+student; an unknown student_id gets a 404.
 Parameters:
-none
+fields, class_id, student_id, username, faculty, grade - see above
+(optional)
 Example Response:
 [
 {
@@ -38,15 +62,14 @@ or an error.
 Parameters:
 name - name of the student want to add (text, form data)
 username - usernaem
-password - password for new
+password - password for new (stored hashed, never returned)
 class_id - id of class enrolled in
 Example Response:
 [
 {
     class_id - 987,
     name - "Mark Kram",
-    username - "mkUltra",
-    password- "cia"
+    username - "mkUltra"
 }
 ]
 
@@ -60,14 +83,13 @@ Parameters:
 name - name of the faculty member to insert (text, form data)
 title - title of the person inserting (text, form data)
 username - username of new faculty
-paassword - paswrod of new faculty
+paassword - paswrod of new faculty (stored hashed, never returned)
 Example Response:
 [
 {
     username: "jkaine",
     name: "Jane Kaine"
     title: "professor",
-    password: "jkaine",
     class_id: 1
 }
 ]
@@ -81,6 +103,7 @@ One of four actions:
 
 Parameters:
     username - username of student for whom want grades (can be None for all)
+    fields, class_id, student_id, faculty, grade - see above (optional)
 Example Response:
 [
 {
@@ -95,18 +118,285 @@ Example Response:
 }
 ]
 
+# POST and PUT class grade requests
+POST /api/classes/<class_id>/grades
+PUT /api/classes/<class_id>/grades
+Description:
+Grade a whole class at once. Every student must be enrolled in the class
+(registered in it or already graded in it); if any is not, nothing is saved
+and a 422 lists them. All grades are saved in one transaction. POST adds or
+updates the grades sent; PUT also deletes the class's grades for students
+left out, so the class ends up with exactly the roster sent. Grades must be
+letters of the grade scale (A+ to F, P, NP, I, W); a 422 lists any other.
+A faculty_id sent must be one of the faculty members teaching the class,
+otherwise nothing is saved and the answer is a 422 as well.
+Parameters (JSON body):
+faculty_id - faculty member giving the grades (optional, defaults to the
+             faculty member teaching the class)
+grades - list of [student_id, grade] pairs or of
+         {student_id: .., grade: ..} objects; a bare list is also accepted
+Example Request:
+{
+    faculty_id: 1,
+    grades: [[1, "A"], [2, "B+"], {student_id: 3, grade: "C"}]
+}
+Example Response:
+[
+{
+    class_id: 1,
+    faculty_id: 1,
+    saved: 3,
+    removed: 0,
+    not_enrolled: [],
+    unknown_grades: [],
+    not_teaching: []
+}
+]
+
+                            ## Job Requests
+# POST job requests
+POST /api/jobs/
+Description:
+Start slow work in the background. Returns status 202 at once with the id
+of the job; follow it with GET /api/jobs/<job_id>.
+Parameters (JSON body):
+kind - one of:
+    import_roster - enroll new students in a class; parameters class_id and
+                    students, a list of {name, username, password}
+    export_gradebook - every grade, or those of parameter class_id
+    grade_statistics - how many of each grade every class gave
+    compact_change_log - compact the log behind GET /api/changes; optional
+                         parameter retention, seconds of history to keep
+    backup - back up the database; optional parameter keep
+    maintenance - run a maintenance round; optional parameter force
+The backup and maintenance kinds need the X-Woodle-Jobs header set to the
+app's JOB_ADMIN_TOKEN and are refused with status 403 otherwise.
+parameters - object with the parameters of the kind
+Example Response:
+[
+{
+    job_id: 12,
+    status: "queued",
+    url: "/api/jobs/12"
+}
+]
+
+# GET job requests
+GET /api/jobs/<job_id>
+Description:
+Get the progress of a job and, once it is done, its result. status is
+queued, running, done or failed; progress goes from 0 to 1.
+Example Response:
+[
+{
+    job_id: 12,
+    kind: "import_roster",
+    status: "done",
+    progress: 1.0,
+    message: null,
+    result: {class_id: 4, imported: 1200},
+    error: null,
+    created: 1760000000.1,
+    started: 1760000000.1,
+    finished: 1760000000.4
+}
+]
+
+                            ## Batch Requests
+# POST batch requests
+POST /api/batch
+Description:
+Run up to 20 GET requests for the API in one round trip. They are answered
+in order from one consistent read of the database. wait is ignored for
+/api/changes inside a batch.
+Parameters (JSON body):
+requests - list of paths, or of {method: "GET", path: ..} objects
+Example Request:
+{
+    requests: ["/api/grades/?username=micheas", "/api/jobs/12"]
+}
+Example Response:
+[
+{
+    status: 200,
+    body: [{s_name: "Micheas", c_name: "CS-232", grade: "A"}, ...]
+},
+{
+    status: 404,
+    body: [{error: "job with that id not found"}]
+}
+]
+
+                            ## Change Requests
+# GET change requests
+GET /api/changes
+Description:
+Get what changed in the class, student, faculty and grade tables after a
+sequence number, oldest first, so a mirror of the data only downloads the
+deltas. Apply each change as an upsert of row (or a delete) keyed by table
+and row_id, then ask again with since set to next. Reading from since=0
+rebuilds every row. A since older than what compaction kept gets a 410;
+start again from since=0.
+Parameters:
+since - last seq already applied (default 0)
+limit - most changes to return (default 500, at most 5000)
+wait - seconds to wait for a change if there is none yet (default 0, at
+       most 30)
+Example Response:
+[
+{
+    changes: [
+        {
+            seq: 41,
+            table: "grade",
+            row_id: 7,
+            operation: "update",
+            changed: 1760000000.1,
+            row: {grade: "B+", class_id: 4, student_id: 9, faculty_id: 5}
+        }
+    ],
+    next: 41,
+    more: false
+}
+]
+
+                            ## Admin Requests
+These need the X-Woodle-Memory header set to the app's MEMORY_TOKEN and
+answer 404 when no token is configured. See project_memory.py.
+
+# GET memory requests
+GET /api/admin/memory
+Description:
+Get the memory of the worker that answers: its resident size, whether
+tracemalloc is tracing and how much it traced, and the peak and kept
+allocation per route of the requests sampled with MEMORY_SAMPLE_RATE.
+Example Response:
+[
+{
+    pid: 4242,
+    rss_kib: 61440,
+    tracing: false,
+    routes: [
+        {
+            route: "GET /api/grades/",
+            requests: 12,
+            mean_peak_kib: 830.2,
+            max_peak_kib: 1204.9,
+            mean_kept_kib: 0.4
+        }
+    ],
+    ...
+}
+]
+
+# POST memory snapshot requests
+POST /api/admin/memory/snapshots
+Description:
+Take a tracemalloc snapshot, starting tracing first if it is off. Returns
+the largest allocation sites, and the sites that changed most since the
+previous snapshot and since the first one.
+Parameters:
+group_by - lineno, traceback or filename (default lineno)
+top - allocation sites to list (default MEMORY_TOP)
+frames - frames kept per allocation when tracing starts (default
+         MEMORY_FRAMES)
+Example Response:
+[
+{
+    status: {...},
+    top: [{site: "project_db.py:120", kib: 512.3, count: 4100}, ...],
+    since_previous: [{site: "main_app.py:78", kib: 96.0, count: 800,
+                      kib_diff: 48.0, count_diff: 400}, ...]
+}
+]
+
+# DELETE memory snapshot requests
+DELETE /api/admin/memory/snapshots
+Description:
+Stop tracing and drop the snapshots. Responds with status 204.
+
+# GET tenant requests
+GET /api/admin/tenants
+Description:
+Get the traffic of each tenant (school) the answering worker served, and
+its database connections. Needs the X-Woodle-Tenants header set to the
+app's TENANT_ADMIN_TOKEN instead of X-Woodle-Memory, and answers 404 when
+TENANT_MODE or the token is not configured. See project_tenants.py.
+Example Response:
+[
+{
+    pid: 4242,
+    pool: {max_databases: 64, max_idle: 4, databases: 2, idle: 3},
+    tenants: [
+        {
+            tenant: "lincoln",
+            database: "/srv/woodle/instance/tenants/lincoln.sqlite",
+            requests: 120,
+            server_errors: 0,
+            mean_request_ms: 4.21,
+            queries: 310,
+            query_ms: 95.3,
+            connections: {opened: 2, reused: 118, closed: 0,
+                          evicted: 0, idle: 2}
+        },
+        ...
+    ]
+}
+]
+
 """
-from flask import Flask, jsonify, request
+from flask import Blueprint, current_app, jsonify, request, url_for
+from werkzeug.exceptions import HTTPException, InternalServerError
 from flask.views import MethodView
-from team_project_db import DBManager
-import os
+from project_changes import ChangesCompacted
+from project_db import db  # shared DBManager, bound to the app by create_app
+from project_db import GRADE_FIELDS, GRADE_FILTERS
+from project_jobs import JOB_ADMIN_HEADER, JOB_KINDS, JobQueueFull
+from project_memory import MEMORY_HEADER
+from project_passwords import PasswordPoolFull
+from project_tenants import TENANT_HEADER
+import json
+import math
+
+# most sub-requests one POST /api/batch may carry
+BATCH_MAX_REQUESTS = 20
+
+# the API is a blueprint; create_app() in main_app.py registers it on the
+# same app as the website so both share one DBManager
+api = Blueprint('api', __name__)
+
+# token bucket limits (tokens per second, bucket size) for the write API;
+# shed requests get a 429 before any database work is done
+API_ADMISSION_LIMITS = {
+    'api.students_api_view': {'methods': ('POST',),
+                              'client_rate': 2.0, 'client_burst': 10,
+                              'global_rate': 100.0, 'global_burst': 200},
+    'api.faculty_api_view': {'methods': ('POST',),
+                             'client_rate': 2.0, 'client_burst': 10,
+                             'global_rate': 100.0, 'global_burst': 200},
+    'api.class_grades_api_view': {'methods': ('POST', 'PUT'),
+                                  'client_rate': 1.0, 'client_burst': 5,
+                                  'global_rate': 20.0, 'global_burst': 40},
+    'api.batch_api_view': {'methods': ('POST',),
+                           'client_rate': 5.0, 'client_burst': 20,
+                           'global_rate': 200.0, 'global_burst': 400},
+    'api.jobs_api_view': {'methods': ('POST',),
+                          'client_rate': 0.5, 'client_burst': 5,
+                          'global_rate': 10.0, 'global_burst': 20},
+}
+
+
+def too_many_requests(retry_after):
+    """
+    Builds the JSON 429 response for a request shed by admission control.
 
-app = Flask(__name__)  # flask app
-database_path = 'woodle.sqlite'  # should be same as db in main_app.py
-app.config['DATABASE'] = os.path.join(app.root_path,
-                                      database_path)  # same as in main_app
-db = DBManager(app)  # object fo database class
-# to handle database interactions w/in API classes
+    :param retry_after: seconds until the client may try again
+    :return: the error response
+    """
+    response = RequestError(429, 'too many requests, '
+                                 'try again shortly').to_response()
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
 
 
 class StudentsAPIView(MethodView):
@@ -114,22 +404,23 @@ class StudentsAPIView(MethodView):
     This view handles all /api/students/ requests.
     """
 
-    def get(self):
+    def get(self, student_id=None):
         """
         Handle GET requests for the student table.
 
+        :param student_id: only the grades of this student, if given
         :return: a list of dictionaries where each dictionary
         represents a student entity
         """
+        fields, filters = grade_query()
+        if student_id is not None:
+            if db.get_user_by_id('student', student_id) is None:
+                raise RequestError(404, 'student with that id not found')
+            filters['student_id'] = [student_id]
 
-        # some of the db function names make no sense
-        students = db.get_id()
-
-        if students is not None:
-            response = students
-        else:
-            raise RequestError(404, 'student with that id not found')
-        return jsonify(response)
+        # one row per grade (see read_class_grades), narrowed down by the
+        # query string
+        return jsonify(db.read_class_grades(fields, filters))
 
     def post(self):
         """
@@ -153,7 +444,7 @@ class StudentsAPIView(MethodView):
         # else form is complete, go ahead and insert
         else:
             username = request.form['username']
-            password = request.form['password']
+            password = hash_form_password()
             name = request.form['name']
             class_id = request.form['class_id']
 
@@ -197,7 +488,7 @@ class FacultyAPIView(MethodView):
         # else form is complete, go ahead and insert
         else:
             username = request.form['username']
-            password = request.form['password']
+            password = hash_form_password()
             name = request.form['name']
             class_id = request.form['class_id']
             title = request.form['title']
@@ -229,12 +520,13 @@ class GradesAPIView(MethodView):
         :return: a JSONified list of dictionaries where each dictionary
         represents a grade entity
         """
-        if username is None:
-            grades = db.get_class_grade()
+        fields, filters = grade_query()
+        if username is not None:
+            filters['username'] = [username]
 
-        # else looking for grades for a specific class AND a specific student
-        else:
-            grades = db.get_class_grade(username)
+        # one row per grade (see read_class_grades), narrowed down by the
+        # query string
+        grades = db.read_class_grades(fields, filters)
 
         if grades is None:
             raise RequestError(404, 'grades for that student and/or '
@@ -244,6 +536,412 @@ class GradesAPIView(MethodView):
             return jsonify(response)
 
 
+class ClassGradesAPIView(MethodView):
+    """
+    This view handles all /api/classes/<class_id>/grades requests.
+    """
+
+    def post(self, class_id):
+        """
+        Handles a POST request with grades for some or all of the students in
+        a class. Grades of students not in the request are left alone.
+
+        :param class_id: class being graded
+        :return: a list with 1 dict summarizing what was saved
+        """
+        return self.save(class_id, replace=False)
+
+    def put(self, class_id):
+        """
+        Handles a PUT request with the full roster of a class. Afterwards the
+        class has exactly the grades in the request.
+
+        :param class_id: class being graded
+        :return: a list with 1 dict summarizing what was saved
+        """
+        return self.save(class_id, replace=True)
+
+    def save(self, class_id, replace):
+        faculty_id, grades = parse_roster(request.get_json(silent=True))
+
+        saved = db.save_class_grades(class_id, grades, faculty_id, replace)
+
+        if saved is None:
+            raise RequestError(404, 'class with that id not found')
+        elif saved['not_enrolled']:
+            raise RequestError(422, 'students not enrolled in class %d: %s'
+                               % (class_id, ', '.join(
+                                   map(str, saved['not_enrolled']))))
+        elif saved['unknown_grades']:
+            raise RequestError(422, 'grades not on the grade scale: %s'
+                               % ', '.join(saved['unknown_grades']))
+        elif saved['not_teaching']:
+            raise RequestError(422, 'faculty member %d does not teach class '
+                               '%d' % (saved['faculty_id'], class_id))
+        else:
+            return jsonify([saved])
+
+
+def parse_roster(body):
+    """
+    Validates the JSON body of a class grades request. The body is either
+    {"faculty_id": 1, "grades": [...]} or just the list of grades, and each
+    grade is a [student_id, grade] pair or a {"student_id", "grade"} object.
+
+    :return: (faculty_id or None, list of (student_id, grade) pairs)
+    """
+    faculty_id = None
+    if isinstance(body, dict):
+        faculty_id = body.get('faculty_id')
+        body = body.get('grades')
+
+    if not isinstance(body, list) or not body:
+        raise RequestError(422, 'a JSON list of grades is required')
+    if faculty_id is not None and not isinstance(faculty_id, int):
+        raise RequestError(422, 'faculty_id must be an integer')
+
+    grades = {}
+    for entry in body:
+        if isinstance(entry, dict):
+            entry = (entry.get('student_id'), entry.get('grade'))
+        if not isinstance(entry, (list, tuple)) or len(entry) != 2:
+            raise RequestError(422, 'each grade needs a student_id and a '
+                                    'grade')
+
+        student_id, grade = entry
+        if isinstance(student_id, bool) or not isinstance(student_id, int) \
+                or not isinstance(grade, str) or not grade:
+            raise RequestError(422, 'student_id must be an integer and '
+                                    'grade a string')
+        if student_id in grades:
+            raise RequestError(422, 'student %d is graded twice'
+                               % student_id)
+        grades[student_id] = grade
+
+    return faculty_id, list(grades.items())
+
+
+class JobsAPIView(MethodView):
+    """
+    This view handles all /api/jobs/ requests.
+    """
+
+    def get(self, job_id):
+        """
+        Handle GET requests for the progress or result of a job.
+
+        :param job_id: id returned when the job was posted
+        :return: a list with 1 dict, the job
+        """
+        # a write would commit, and so end, the read snapshot of a batch
+        job = current_app.extensions['job_runner'].status(
+            job_id, record=not request.environ.get('woodle.batch'))
+
+        if job is None:
+            raise RequestError(404, 'job with that id not found')
+        else:
+            # parameters may hold what a client sent in confidence
+            del job['worker_pid'], job['parameters']
+            return jsonify([job])
+
+    def post(self):
+        """
+        Handles a POST request to start a job. The job runs in the
+        background; the response only says where to follow it.
+
+        :return: a list with 1 dict holding the job_id, with status 202
+        """
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict) or not isinstance(body.get('kind'),
+                                                        str):
+            raise RequestError(422, 'a JSON object with a kind is required')
+
+        parameters = body.get('parameters') or {}
+        if not isinstance(parameters, dict):
+            raise RequestError(422, 'parameters must be a JSON object')
+
+        job_runner = current_app.extensions['job_runner']
+        function = JOB_KINDS.get(body['kind'])
+        if function is not None and function.admin_only \
+                and not job_runner.requested_by_admin():
+            raise RequestError(403, '%s jobs need the %s header'
+                               % (body['kind'], JOB_ADMIN_HEADER))
+
+        try:
+            job_id = job_runner.submit(body['kind'], parameters)
+        except ValueError as error:
+            raise RequestError(422, str(error))
+        except JobQueueFull:
+            response = RequestError(503, 'too many jobs running, '
+                                         'try again later').to_response()
+            response.headers['Retry-After'] = '30'
+            return response
+
+        location = url_for('.jobs_api_view', job_id=job_id, _method='GET')
+        response = jsonify([{'job_id': job_id, 'status': 'queued',
+                             'url': location}])
+        response.status = '202'
+        response.headers['Location'] = location
+        return response
+
+
+class ChangesAPIView(MethodView):
+    """
+    This view handles all /api/changes requests.
+    """
+
+    def get(self):
+        """
+        Handle GET requests for the changes after a sequence number.
+
+        :return: a list with 1 dict holding the changes, the next since
+        and whether there are more
+        """
+        since = integer_argument('since', 0)
+        limit = integer_argument('limit', 500)
+        if since < 0 or not 1 <= limit <= 5000:
+            raise RequestError(422, 'since must be 0 or more and limit '
+                                    'between 1 and 5000')
+        try:
+            wait = float(request.args.get('wait', 0))
+        except ValueError:
+            raise RequestError(422, 'wait must be a number of seconds')
+        if request.environ.get('woodle.batch'):
+            wait = 0  # the batch's snapshot would never see a new change
+
+        try:
+            changes = current_app.extensions['change_feed'].read(
+                since, limit, max(wait, 0.0))
+        except ChangesCompacted as compacted:
+            raise RequestError(410, 'changes up to %d have been compacted, '
+                                    'start again from since=0'
+                               % compacted.horizon)
+
+        return jsonify([changes])
+
+
+class MemoryAPIView(MethodView):
+    """
+    This view handles all /api/admin/memory requests.
+    """
+
+    def get(self):
+        """
+        Handle GET requests for the memory of this worker.
+
+        :return: a list with 1 dict, the status
+        """
+        return jsonify([admin_memory_profiler().status()])
+
+
+class MemorySnapshotsAPIView(MethodView):
+    """
+    This view handles all /api/admin/memory/snapshots requests.
+    """
+
+    def post(self):
+        """
+        Handles a POST request to take a tracemalloc snapshot.
+
+        :return: a list with 1 dict, the report of the snapshot
+        """
+        memory_profiler = admin_memory_profiler()
+        group_by = request.args.get('group_by', 'lineno')
+        top = integer_argument('top', memory_profiler.top)
+        frames = integer_argument('frames', memory_profiler.frames)
+        if not 1 <= top <= 1000 or not 1 <= frames <= 100:
+            raise RequestError(422, 'top must be between 1 and 1000 and '
+                                    'frames between 1 and 100')
+
+        try:
+            report = memory_profiler.snapshot(group_by, top, frames)
+        except ValueError as error:
+            raise RequestError(422, str(error))
+        return jsonify([report])
+
+    def delete(self):
+        """
+        Handles a DELETE request to stop tracing and drop the snapshots.
+
+        :return: an empty response with status 204
+        """
+        admin_memory_profiler().stop()
+        return '', 204
+
+
+class TenantsAPIView(MethodView):
+    """
+    This view handles all /api/admin/tenants requests.
+    """
+
+    def get(self):
+        """
+        Handle GET requests for the tenant metrics of this worker.
+
+        :return: a list with 1 dict, the stats
+        """
+        tenant_router = current_app.extensions.get('tenant_router')
+        if tenant_router is None or not tenant_router.token:
+            raise RequestError(404, 'not found')
+        if not tenant_router.requested_by_admin():
+            raise RequestError(403, 'the %s header is missing or wrong'
+                               % TENANT_HEADER)
+        return jsonify([tenant_router.stats()])
+
+
+def admin_memory_profiler():
+    """
+    :return: the app's MemoryProfiler, if the request carries its token
+    """
+    memory_profiler = current_app.extensions.get('memory_profiler')
+    if memory_profiler is None or not memory_profiler.token:
+        raise RequestError(404, 'not found')
+    if not memory_profiler.requested_by_admin():
+        raise RequestError(403, 'the %s header is missing or wrong'
+                           % MEMORY_HEADER)
+    return memory_profiler
+
+
+def grade_query():
+    """
+    Reads the ?fields= projection and the filters of a grade or student
+    request. Every argument takes a comma separated list of values.
+
+    :return: (list of fields or None, dict of filter name -> values)
+    """
+    fields = None
+    if request.args.get('fields'):
+        fields = request.args['fields'].split(',')
+        unknown = [name for name in fields if name not in GRADE_FIELDS]
+        if unknown:
+            raise RequestError(422, 'fields must be some of %s'
+                               % ', '.join(sorted(GRADE_FIELDS)))
+
+    filters = {}
+    for name in GRADE_FILTERS:
+        if request.args.get(name):
+            filters[name] = request.args[name].split(',')
+
+    for name in ('class_id', 'student_id'):
+        if name in filters:
+            try:
+                filters[name] = [int(value) for value in filters[name]]
+            except ValueError:
+                raise RequestError(422, '%s must be an integer' % name)
+
+    return fields, filters
+
+
+def hash_form_password():
+    """
+    :return: the hash to store for the password in the request's form
+    """
+    try:
+        return current_app.extensions['password_hasher'].hash(
+            request.form['password'])
+    except PasswordPoolFull:
+        raise RequestError(503, 'too many logins and registrations, '
+                                'try again shortly')
+
+
+def integer_argument(name, default):
+    """
+    :return: the query string argument name as an int, or default
+    """
+    try:
+        return int(request.args.get(name, default))
+    except ValueError:
+        raise RequestError(422, '%s must be an integer' % name)
+
+
+class BatchAPIView(MethodView):
+    """
+    This view handles all /api/batch requests.
+    """
+
+    def post(self):
+        """
+        Handles a POST request carrying several GET requests for the API.
+        They are dispatched to their views inside this request, one after
+        the other, on one database connection and in one read transaction,
+        so they all see the same data.
+
+        :return: a list with one {"status", "body"} dict per sub-request,
+        in order
+        """
+        body = request.get_json(silent=True)
+        if isinstance(body, dict):
+            body = body.get('requests')
+        if not isinstance(body, list) or not body:
+            raise RequestError(422, 'a JSON list of requests is required')
+        if len(body) > BATCH_MAX_REQUESTS:
+            raise RequestError(422, 'at most %d requests per batch'
+                               % BATCH_MAX_REQUESTS)
+
+        paths = []
+        for entry in body:
+            if isinstance(entry, str):
+                entry = {'path': entry}
+            if not isinstance(entry, dict) \
+                    or not isinstance(entry.get('path'), str) \
+                    or not entry['path'].startswith('/api/'):
+                raise RequestError(422, 'every request needs an /api/ path')
+            if entry.get('method', 'GET').upper() != 'GET':
+                raise RequestError(422, 'only GET requests can be batched')
+            paths.append(entry['path'])
+
+        with db.read_snapshot():
+            results = [dispatch_sub_request(path) for path in paths]
+
+        # the sub-responses are JSON already; splice them in as they are
+        # instead of decoding and encoding them again
+        body = '[%s]' % ','.join(
+            '{"status":%d,"body":%s}' % (status, data)
+            for status, data in results)
+        return current_app.response_class(body + '\n',
+                                          mimetype='application/json')
+
+
+def dispatch_sub_request(path):
+    """
+    Runs one GET request of a batch through its view, without the
+    before and after request hooks the batch request itself went through.
+
+    :return: (status code, JSON text of the response body)
+    """
+    environ = {'REMOTE_ADDR': request.remote_addr, 'woodle.batch': True}
+    # same tenant as the batch (see project_tenants.py)
+    for key in ('woodle.tenant', 'woodle.database'):
+        if key in request.environ:
+            environ[key] = request.environ[key]
+    with current_app.test_request_context(path, method='GET',
+                                          environ_base=environ):
+        if request.routing_exception is not None:
+            response = request.routing_exception  # e.g. 404 for a bad path
+        elif request.blueprint != api.name \
+                or request.endpoint == 'api.batch_api_view':
+            response = RequestError(422, 'only API requests can be '
+                                         'batched').to_response()
+        else:
+            try:
+                response = current_app.dispatch_request()
+            except Exception as error:
+                try:
+                    response = current_app.handle_user_exception(error)
+                except Exception:
+                    current_app.logger.exception('batched %s failed', path)
+                    response = InternalServerError()
+
+        if isinstance(response, HTTPException):
+            return response.code, json.dumps([{'error': response.description}])
+
+        response = current_app.make_response(response)
+        data = response.get_data(as_text=True)
+        if not response.is_json:
+            data = json.dumps(data)
+        return response.status_code, data.rstrip('\n')
+
+
 # Custom request error handling class and functions
 class RequestError(Exception):
     """
@@ -271,18 +969,26 @@ class RequestError(Exception):
         return response
 
 
+@api.errorhandler(RequestError)
+def handle_request_error(error):
+    """
+    Turns a RequestError raised by a view into its JSON error response.
+    """
+    return error.to_response()
+
+
 # URL rules for the API
 # Student rules
 # Register StudentsAPIView as the view/handler for all api/students/ requests
 students_api_view = StudentsAPIView.as_view('students_api_view')
 
 # GET student
-app.add_url_rule('/api/students/', defaults={'student_id': None},
+api.add_url_rule('/api/students/', defaults={'student_id': None},
                  view_func=students_api_view, methods=['GET'])
-app.add_url_rule('/api/students/<int:student_id>', view_func=students_api_view,
+api.add_url_rule('/api/students/<int:student_id>', view_func=students_api_view,
                  methods=['GET'])
 # POST student
-app.add_url_rule('/api/students/', view_func=students_api_view,
+api.add_url_rule('/api/students/', view_func=students_api_view,
                  methods=['POST'])
 
 # Faculty rules
@@ -290,10 +996,57 @@ app.add_url_rule('/api/students/', view_func=students_api_view,
 faculty_api_view = FacultyAPIView.as_view('faculty_api_view')
 
 # POST faculty
-app.add_url_rule('/api/faculty/', view_func=faculty_api_view, methods=['POST'])
+api.add_url_rule('/api/faculty/', view_func=faculty_api_view, methods=['POST'])
 
 # Grade rules
 # Register UsersAPIView as the view/handler for all api/grades/ requests.
 grades_api_view = GradesAPIView.as_view('grades_api_view')
 # GET grades
-app.add_url_rule('/api/grades/', view_func=grades_api_view, methods=['GET'])
+api.add_url_rule('/api/grades/', view_func=grades_api_view, methods=['GET'])
+
+# Class grade rules
+# Register ClassGradesAPIView as the view/handler for all
+# api/classes/<class_id>/grades requests.
+class_grades_api_view = ClassGradesAPIView.as_view('class_grades_api_view')
+# POST and PUT class grades
+api.add_url_rule('/api/classes/<int:class_id>/grades',
+                 view_func=class_grades_api_view, methods=['POST', 'PUT'])
+
+# Job rules
+# Register JobsAPIView as the view/handler for all api/jobs/ requests.
+jobs_api_view = JobsAPIView.as_view('jobs_api_view')
+# GET job
+api.add_url_rule('/api/jobs/<int:job_id>', view_func=jobs_api_view,
+                 methods=['GET'])
+# POST job
+api.add_url_rule('/api/jobs/', view_func=jobs_api_view, methods=['POST'])
+
+# Change rules
+# Register ChangesAPIView as the view/handler for all api/changes requests.
+changes_api_view = ChangesAPIView.as_view('changes_api_view')
+# GET changes
+api.add_url_rule('/api/changes', view_func=changes_api_view, methods=['GET'])
+
+# Batch rules
+# Register BatchAPIView as the view/handler for all api/batch requests.
+batch_api_view = BatchAPIView.as_view('batch_api_view')
+# POST batch
+api.add_url_rule('/api/batch', view_func=batch_api_view, methods=['POST'])
+
+# Admin rules
+# Register MemoryAPIView and MemorySnapshotsAPIView as the views/handlers
+# for all api/admin/memory requests.
+memory_api_view = MemoryAPIView.as_view('memory_api_view')
+memory_snapshots_api_view = MemorySnapshotsAPIView.as_view(
+    'memory_snapshots_api_view')
+# GET memory
+api.add_url_rule('/api/admin/memory', view_func=memory_api_view,
+                 methods=['GET'])
+# POST and DELETE memory snapshots
+api.add_url_rule('/api/admin/memory/snapshots',
+                 view_func=memory_snapshots_api_view,
+                 methods=['POST', 'DELETE'])
+# GET tenants
+tenants_api_view = TenantsAPIView.as_view('tenants_api_view')
+api.add_url_rule('/api/admin/tenants', view_func=tenants_api_view,
+                 methods=['GET'])
@@ -0,0 +1,171 @@
+"""
+Hot backups of the live database, used by 'flask backup'.
+
+Copying woodle.sqlite while the site is running can tear the copy in the
+middle of a write, and locking the database for the whole copy stalls the
+site. The sqlite online backup API copies the database a few pages at a
+time instead. The source is only locked while a step runs; between steps
+readers and writers carry on, and if one of them changes the database the
+backup starts over, so the copy is always a consistent snapshot.
+
+Every backup is written next to the others as
+<BACKUP_DIR>/woodle-<YYYYmmdd-HHMMSS-micro>.sqlite, checked with PRAGMA
+quick_check, and only then given its final name; a failed backup never
+looks like a good one. The newest BACKUP_KEEP backups are kept.
+
+'flask backup --every <hours>' keeps running and backs up on a schedule;
+the 'backup' job (see project_jobs.py) runs one from the API.
+
+Settings:
+
+BACKUP_DIR           - folder for the backups (default: the app's
+                       instance folder, in a 'backups' subfolder)
+BACKUP_KEEP          - backups to keep (default 7)
+BACKUP_STEP_PAGES    - pages copied per step (default 256)
+BACKUP_STEP_PAUSE    - seconds to pause between steps (default 0.01)
+BACKUP_MAX_RESTARTS  - restarts caused by writes before the rest is copied
+                       in one step (default 3)
+"""
+import datetime
+import glob
+import os
+import sqlite3
+import time
+
+BACKUP_PATTERN = 'woodle-*.sqlite'
+
+
+class BackupFailed(Exception):
+    """
+    Raised when a finished backup does not pass PRAGMA quick_check.
+    """
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def backup_settings(app):
+    """
+    :return: dict of the app's backup settings, with defaults filled in
+    """
+    return {'directory': app.config.get('BACKUP_DIR') or os.path.join(
+                app.instance_path, 'backups'),
+            'keep': int(app.config.get('BACKUP_KEEP', 7)),
+            'pages': int(app.config.get('BACKUP_STEP_PAGES', 256)),
+            'pause': float(app.config.get('BACKUP_STEP_PAUSE', 0.01)),
+            'max_restarts': int(app.config.get('BACKUP_MAX_RESTARTS', 3))}
+
+
+def backup_database(database, directory, pages=256, pause=0.01,
+                    max_restarts=3, progress=None):
+    """
+    Copies a live database into directory in small steps.
+
+    Every commit to the database by another connection makes the backup
+    start over. Under a steady stream of writes a stepped copy may never
+    finish, so after max_restarts restarts the rest is copied in a single
+    step, which holds the read lock until it is done but always finishes.
+
+    :param database: path of the database to back up
+    :param directory: folder to write the backup to
+    :param pages: pages copied per step
+    :param pause: seconds to sleep between steps
+    :param max_restarts: restarts allowed before copying in one step
+    :param progress: optional function called as progress(copied, total)
+    after every step
+    :return: dict with path, pages, bytes, seconds, mb_per_second,
+    restarts (times a write made the backup start over), single_step (True
+    if it had to fall back to one step) and check
+    :raise BackupFailed: if the copy fails PRAGMA quick_check
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, datetime.datetime.now().strftime(
+        'woodle-%Y%m%d-%H%M%S-%f.sqlite'))
+    partial = path + '.partial'
+
+    state = {'restarts': 0, 'remaining': None, 'total': 0}
+
+    def step_done(status, remaining, total):
+        # remaining goes back up when a write restarted the backup
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] > max_restarts:
+                raise _TooManyRestarts()
+        state['remaining'] = remaining
+        state['total'] = total
+        if progress is not None:
+            progress(total - remaining, total)
+        if remaining and pause:
+            time.sleep(pause)  # no lock is held between steps
+
+    source = sqlite3.connect(database, timeout=5)
+    target = _open_target(partial)
+    single_step = False
+    start = time.perf_counter()
+    try:
+        try:
+            source.backup(target, pages=pages, progress=step_done)
+        except _TooManyRestarts:
+            # the half-written copy is not a database, so start afresh
+            target.close()
+            target = _open_target(partial)
+            single_step = True
+            state['remaining'] = None
+            source.backup(target, pages=-1, progress=step_done)
+        seconds = time.perf_counter() - start
+
+        check = target.execute('PRAGMA quick_check;').fetchone()[0]
+    finally:
+        target.close()
+        source.close()
+
+    if check != 'ok':
+        os.unlink(partial)
+        raise BackupFailed('backup of %s failed quick_check: %s'
+                           % (database, check))
+    _sync(partial)
+    os.replace(partial, path)
+
+    size = os.path.getsize(path)
+    return {'path': path,
+            'pages': state['total'],
+            'bytes': size,
+            'seconds': seconds,
+            'mb_per_second': size / 1e6 / seconds if seconds else 0.0,
+            'restarts': state['restarts'],
+            'single_step': single_step,
+            'check': check}
+
+
+def _open_target(path):
+    if os.path.exists(path):
+        os.unlink(path)
+    target = sqlite3.connect(path)
+    # the copy is checked before it is used, so it needs no journal
+    target.execute('PRAGMA journal_mode = OFF;')
+    target.execute('PRAGMA synchronous = OFF;')
+    return target
+
+
+def _sync(path):
+    # synchronous is off while copying, so flush once before the rename
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def prune_backups(directory, keep):
+    """
+    Deletes all but the newest keep backups in directory.
+
+    :return: list of the deleted paths
+    """
+    # the timestamp in the name sorts oldest first
+    backups = sorted(glob.glob(os.path.join(directory, BACKUP_PATTERN)))
+    doomed = backups[:-keep] if keep > 0 else backups
+    for path in doomed:
+        os.unlink(path)
+    return doomed
@@ -0,0 +1,275 @@
+"""
+Records a sample of live traffic as a JSONL request log that
+project_replay.py can replay.
+
+Recording is off unless app.config['CAPTURE_FILE'] is set. Settings:
+
+CAPTURE_FILE         - log file to append to
+CAPTURE_SAMPLE_RATE  - fraction of requests to record (default 1.0)
+CAPTURE_MAX_BYTES    - rotate the log when it grows past this size
+                       (default 50 MB)
+CAPTURE_BACKUPS      - rotated logs to keep, as CAPTURE_FILE.1, .2, ...
+                       (default 5)
+CAPTURE_KEEP_FIELDS  - form fields and query parameters recorded
+                       verbatim; every other form value, query parameter
+                       value and URL variable is anonymized
+                       (default DEFAULT_KEEP_FIELDS: class_id, is_student,
+                       title and the paging, format and filter parameters
+                       other than usernames)
+
+Each line looks like:
+
+    {"method": "POST", "path": "/login", "route": "/login",
+     "form": {"username": "anon-3f9a1c0e2b7d", "password": "anon-..."},
+     "at": 1760000000.12, "duration": 0.0042, "status": 302, "size": 209}
+
+Anonymized values are a keyed hash of the real value (the app's SECRET_KEY
+is the key), so the same username always maps to the same token and a
+replayed login still matches a replayed page view.
+
+Requests are only turned into dictionaries on the request thread. Encoding
+and writing happen on a background thread that drains a bounded queue; if
+the queue is full the entry is dropped and counted rather than slowing the
+request down.
+
+Every 'flask serve' worker has its own writer appending to the same file.
+Writers take an flock() on CAPTURE_FILE.lock to write and rotate, and
+reopen CAPTURE_FILE when another worker has rotated it, so no entry lands
+in a rotated log.
+"""
+import atexit
+import fcntl
+import hashlib
+import hmac
+import json
+import os
+import queue
+import random
+import threading
+import time
+from urllib.parse import urlencode
+from flask import g, request, url_for
+
+# form fields and query parameters that never hold personal data; the
+# query parameters are the ones a replay needs to ask for the same rows
+DEFAULT_KEEP_FIELDS = ('class_id', 'is_student', 'title', 'after', 'fields',
+                       'format', 'grade', 'limit', 'since', 'wait')
+
+
+class TrafficRecorder:
+    """
+    Flask extension that samples requests into a rotating JSONL file.
+    """
+
+    def __init__(self, app=None):
+        self.writer = None
+        self.sample_rate = 1.0
+        self.keep_fields = frozenset(DEFAULT_KEEP_FIELDS)
+        self.key = b''
+        self.dropped = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Registers the request hooks if CAPTURE_FILE is configured.
+        """
+        path = app.config.get('CAPTURE_FILE')
+        if not path:
+            return
+
+        self.sample_rate = float(app.config.get('CAPTURE_SAMPLE_RATE', 1.0))
+        self.keep_fields = frozenset(app.config.get('CAPTURE_KEEP_FIELDS',
+                                                    DEFAULT_KEEP_FIELDS))
+        self.key = str(app.config.get('SECRET_KEY') or '').encode('utf-8')
+        self.writer = CaptureWriter(
+            path,
+            max_bytes=int(app.config.get('CAPTURE_MAX_BYTES', 50 * 2 ** 20)),
+            backups=int(app.config.get('CAPTURE_BACKUPS', 5)))
+
+        app.extensions['capture'] = self
+        app.before_request(self.start_request)
+        app.after_request(self.record_request)
+
+    def start_request(self):
+        if random.random() < self.sample_rate:
+            g.capture_started = time.perf_counter()
+
+    def record_request(self, response):
+        """
+        after_request hook; hands the sampled request to the writer.
+        """
+        started = g.pop('capture_started', None)
+        if started is None:
+            return response
+
+        entry = {'method': request.method,
+                 'path': self.anonymized_path(),
+                 'route': request.url_rule.rule if request.url_rule else None,
+                 'at': round(time.time(), 3),
+                 'duration': round(time.perf_counter() - started, 6),
+                 'status': response.status_code,
+                 'size': response.calculate_content_length()}
+        if request.form:
+            entry['form'] = {name: self.anonymize(value, name)
+                             for name, value in request.form.items()}
+
+        if not self.writer.put(entry):
+            self.dropped += 1
+        return response
+
+    def close(self):
+        """
+        Writes the entries still queued. Also registered with atexit by the
+        writer, but a 'flask serve' worker leaves through os._exit() and
+        calls this itself.
+        """
+        if self.writer is not None:
+            self.writer.close()
+
+    def anonymize(self, value, name=None):
+        """
+        :param value: the value to hide
+        :param name: form field or query parameter name; names in
+        keep_fields are not hidden
+        :return: value, or a stable keyed hash of it
+        """
+        if name in self.keep_fields:
+            return value
+        digest = hmac.new(self.key, value.encode('utf-8'), hashlib.sha256)
+        return 'anon-' + digest.hexdigest()[:12]
+
+    def anonymized_path(self):
+        """
+        Rebuilds the request path with its string URL variables (usernames)
+        and its query parameter values anonymized, except for parameters
+        in keep_fields.
+        """
+        path = request.path
+        if request.url_rule is not None and request.view_args:
+            arguments = {name: self.anonymize(value)
+                         if isinstance(value, str) else value
+                         for name, value in request.view_args.items()}
+            path = url_for(request.endpoint, **arguments)
+
+        query = urlencode([(name, self.anonymize(value, name))
+                           for name, value in request.args.items(multi=True)])
+        return path + '?' + query if query else path
+
+
+class CaptureWriter:
+    """
+    Appends entries to a JSONL file from a background thread, rotating the
+    file by size the same way logging.handlers.RotatingFileHandler does.
+    """
+
+    def __init__(self, path, max_bytes, backups, queue_size=10000,
+                 flush_interval=1.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.file = open(path, 'a', encoding='utf-8')
+        self.lock_fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+
+        self.thread = threading.Thread(target=self.run, daemon=True,
+                                       name='capture-writer')
+        self.thread.start()
+        atexit.register(self.close)
+
+    def put(self, entry):
+        """
+        :return: False if the queue was full and the entry was dropped
+        """
+        try:
+            self.queue.put_nowait(entry)
+            return True
+        except queue.Full:
+            return False
+
+    def run(self):
+        """
+        Writer loop: waits for an entry, then drains everything queued
+        behind it and writes the batch with a single flush.
+        """
+        while True:
+            try:
+                entry = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            if entry is None:
+                break
+
+            batch = [entry]
+            while True:
+                try:
+                    entry = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is None:
+                    self.write(batch)
+                    return
+                batch.append(entry)
+
+            self.write(batch)
+
+    def write(self, batch):
+        """
+        Appends batch under the lock shared with the other workers,
+        following the file to path if another worker rotated it.
+        """
+        lines = ''.join(json.dumps(entry, separators=(',', ':')) + '\n'
+                        for entry in batch)
+        fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
+        try:
+            if self.rotated():
+                self.file.close()
+                self.file = open(self.path, 'a', encoding='utf-8')
+            self.file.write(lines)
+            self.file.flush()
+
+            if self.file.tell() >= self.max_bytes:
+                self.rotate()
+        finally:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+
+    def rotated(self):
+        """
+        :return: True if path is no longer the file this writer has open
+        """
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            return True
+        opened = os.fstat(self.file.fileno())
+        return (current.st_dev, current.st_ino) != (opened.st_dev,
+                                                    opened.st_ino)
+
+    def rotate(self):
+        """
+        Renames path to path.1, path.1 to path.2, ... and starts a new file.
+        Called with the lock held.
+        """
+        self.file.close()
+        for number in range(self.backups - 1, 0, -1):
+            older = '%s.%d' % (self.path, number)
+            if os.path.exists(older):
+                os.replace(older, '%s.%d' % (self.path, number + 1))
+        if self.backups > 0:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        """
+        Writes whatever is still queued and closes the file.
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout=5)
+        if not self.file.closed:
+            self.file.close()
+            os.close(self.lock_fd)
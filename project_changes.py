@@ -0,0 +1,135 @@
+"""
+Change-data-capture feed behind GET /api/changes.
+
+Triggers (migrations/003_change_log.sql) append an entry to the change_log
+table for every insert, update and delete on class, student, faculty and
+grade. Consumers keep the highest seq they have applied and ask for what
+came after it, so they only download deltas:
+
+    GET /api/changes?since=<seq>&limit=<n>&wait=<seconds>
+
+With wait, a request that finds nothing new holds on for up to that many
+seconds (at most CHANGES_MAX_WAIT) and returns as soon as something is
+committed, from any process. Waiting requests hold one of the worker's
+request threads, so only CHANGES_MAX_WAITERS of them wait at once per
+process; the rest return straight away and the client simply asks again.
+
+Compaction ('flask compact-changes', or the compact_change_log job) keeps
+the table bounded: old entries are dropped when a newer entry for the same
+row exists, and old deletes are dropped altogether. Reading from since=0
+therefore always rebuilds every live row. A consumer whose since is below
+the horizon of dropped deletes may have missed one and gets a 410; it has
+to start over from since=0.
+
+Settings:
+
+CHANGES_MAX_WAIT       - longest wait allowed, in seconds (default 30)
+CHANGES_MAX_WAITERS    - requests per process allowed to wait (default 2)
+CHANGES_POLL_INTERVAL  - seconds between checks while waiting (default 0.1)
+CHANGES_RETENTION      - seconds of full history compaction keeps
+                         (default 86400)
+"""
+import json
+import threading
+import time
+
+
+class ChangesCompacted(Exception):
+    """
+    Raised when the changes after since have partly been compacted away.
+    """
+
+    def __init__(self, horizon):
+        Exception.__init__(self)
+        self.horizon = horizon
+
+
+class ChangeFeed:
+    """
+    Flask extension reading the change log, with long-polling.
+    """
+
+    def __init__(self, app=None, db=None):
+        """
+        :param app: Flask app to read the settings from
+        :param db: DBManager holding the change log
+        """
+        self.db = db
+        self.max_wait = 30.0
+        self.poll_interval = 0.1
+        self.retention = 86400.0
+        self.waiters = threading.BoundedSemaphore(2)
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_wait = float(app.config.get('CHANGES_MAX_WAIT', 30))
+        self.poll_interval = float(app.config.get('CHANGES_POLL_INTERVAL',
+                                                  0.1))
+        self.retention = float(app.config.get('CHANGES_RETENTION', 86400))
+        self.waiters = threading.BoundedSemaphore(
+            int(app.config.get('CHANGES_MAX_WAITERS', 2)))
+        app.extensions['change_feed'] = self
+
+    def read(self, since, limit, wait=0.0):
+        """
+        Reads the changes after since, waiting for some if there are none.
+        Must be called inside an app context.
+
+        :param since: last seq the consumer has applied
+        :param limit: most changes to return
+        :param wait: seconds to wait for a change if there is none yet
+        :return: dict with changes (list of dicts), next (the seq to send
+        as since next time) and more (True if limit cut the list short)
+        :raise ChangesCompacted: if since is below the compaction horizon
+        """
+        horizon = self.db.get_change_horizon()
+        if 0 < since < horizon:
+            raise ChangesCompacted(horizon)
+
+        changes = self.db.get_changes(since, limit + 1)
+        wait = min(wait, self.max_wait)
+        if not changes and wait > 0 and self.waiters.acquire(blocking=False):
+            try:
+                changes = self.wait_for_changes(since, limit + 1, wait)
+            finally:
+                self.waiters.release()
+
+        more = len(changes) > limit
+        entries = [{'seq': seq, 'table': table_name, 'row_id': row_id,
+                    'operation': operation, 'changed': changed,
+                    'row': json.loads(data) if data is not None else None}
+                   for seq, table_name, row_id, operation, data, changed
+                   in changes.rows[:limit]]
+        return {'changes': entries,
+                'next': entries[-1]['seq'] if entries else since,
+                'more': more}
+
+    def wait_for_changes(self, since, limit, wait):
+        """
+        Polls PRAGMA data_version, which is one page read, and only runs the
+        change query again once some other connection has committed.
+
+        :return: RowSet of changes, empty if none arrived in time
+        """
+        deadline = time.monotonic() + wait
+        version = self.db.get_data_version()
+        changes = self.db.get_changes(since, limit)
+
+        while not changes and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            current = self.db.get_data_version()
+            if current != version:
+                version = current
+                changes = self.db.get_changes(since, limit)
+        return changes
+
+    def compact(self, retention=None):
+        """
+        Compacts the entries older than retention seconds (default
+        CHANGES_RETENTION). See DBManager.compact_change_log.
+        """
+        if retention is None:
+            retention = self.retention
+        return self.db.compact_change_log(time.time() - retention)
@@ -1,46 +1,391 @@
+import contextlib
+import glob
+import json
+import os
 import sqlite3
-from flask import g
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, g, has_app_context, has_request_context, \
+    request
+
+
+class Record:
+    """
+        One row of a RowSet. A record holds a reference to the column index
+        shared by every row of its RowSet plus the row's value tuple, so it
+        costs two slots instead of a whole dictionary.
+
+        Records are read the same way the old row dictionaries were:
+        record['c_name'], record.keys() and dict(record) all work, which
+        keeps the Jinja templates unchanged.
+    """
+    __slots__ = ('_index', '_values')
+
+    def __init__(self, index, values):
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._values[self._index[key]]
+        return self._values[key]
+
+    def __getattr__(self, name):
+        try:
+            return self._values[self._index[name]]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __len__(self):
+        return len(self._values)
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return dict(self) == dict(other)
+        if isinstance(other, dict):
+            return dict(self) == other
+        return NotImplemented
+
+    def __repr__(self):
+        return 'Record(%r)' % dict(self)
+
+    def keys(self):
+        return self._index.keys()
+
+    def get(self, key, default=None):
+        if key in self._index:
+            return self._values[self._index[key]]
+        return default
+
+
+class RowSet:
+    """
+        The result of a read query kept as a tuple of column names plus a
+        list of plain row tuples.
+
+        Iterating over a RowSet yields Record objects, so code that used to
+        loop over a list of dictionaries keeps working. The JSON provider in
+        project_json.py encodes the columns and tuples directly without
+        building a record per row.
+    """
+    __slots__ = ('columns', 'rows', '_index')
+
+    def __init__(self, columns, rows):
+        """
+        :param columns: tuple of column names, in select-list order
+        :param rows: list of value tuples, one per row
+        """
+        self.columns = tuple(columns)
+        self.rows = rows
+        self._index = {name: i for i, name in enumerate(self.columns)}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        index = self._index
+        for values in self.rows:
+            yield Record(index, values)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return RowSet(self.columns, self.rows[position])
+        return Record(self._index, self.rows[position])
+
+    def __eq__(self, other):
+        if isinstance(other, RowSet):
+            return self.columns == other.columns and self.rows == other.rows
+        if isinstance(other, list):
+            return self.as_dicts() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return 'RowSet(columns=%r, rows=%d)' % (self.columns, len(self.rows))
+
+    def as_dicts(self):
+        """
+        Builds the old list-of-dictionaries representation. Only use this
+        where a real dict per row is needed; it allocates one per row.
+
+        :return: list of dicts, one per row
+        """
+        columns = self.columns
+        return [dict(zip(columns, values)) for values in self.rows]
+
+
+# rows fetched from sqlite per round by DBManager.iter_rows()
+ROW_BATCH = 256
+
+
+# columns a client may ask the grade readers for (?fields=), and the SQL
+# each one is read from; nothing outside these dicts reaches the SQL text
+GRADE_FIELDS = {
+    's_name': 'student.name',
+    'c_name': 'class.name',
+    'grade': 'grade_scale.letter',
+    'username': 'student.username',
+    'student_id': 'student.student_id',
+    'class_id': 'class.class_id',
+}
+DEFAULT_GRADE_FIELDS = ('s_name', 'c_name', 'grade')
+
+# filters a client may apply to the grade readers. The %s is replaced by
+# "= ?", or by "IN (?, ?)" when several values are given (grade=A,B).
+GRADE_FILTERS = {
+    'class_id': 'grade.class_id %s',
+    'username': 'student.username %s',
+    'student_id': 'student.student_id %s',
+    'grade': 'grade.grade_code IN (SELECT code FROM grade_scale '
+             'WHERE grade_scale.letter %s)',
+    'faculty': 'grade.faculty_id IN (SELECT faculty_id FROM faculty '
+               'WHERE faculty.username %s)',
+}
+
+
+class ConnectionPools:
+    """
+        Idle connections kept open between app contexts, per database file.
+
+        Opening a connection costs a file open and a parse of the schema on
+        its first statement, so connections are handed back here when a
+        context ends and reused by the next one for the same file. At most
+        max_idle connections are kept per file, and idle connections are
+        kept for at most max_databases files: the least recently used file's
+        connections are closed when another file needs room. Serving
+        hundreds of databases (see project_tenants.py) therefore keeps a
+        bounded number of files open.
+
+        Connections in use by a context are not counted; there are as many
+        of those as requests running at once.
+    """
+
+    def __init__(self, max_databases=64, max_idle=4):
+        self.max_databases = max_databases
+        self.max_idle = max_idle
+        self.idle = OrderedDict()  # database path -> list of connections
+        self.counts = {}  # database path -> dict of counters
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.inherited = []
+
+    def check_fork(self):
+        """
+            Forgets connections opened before a fork without closing them:
+            closing a copy in the child would drop the parent's file locks.
+            Called with the lock held.
+            """
+        if self.pid != os.getpid():
+            self.inherited.append(self.idle)
+            self.idle = OrderedDict()
+            self.counts = {}
+            self.pid = os.getpid()
+
+    def count(self, database, name):
+        counts = self.counts.get(database)
+        if counts is None:
+            counts = self.counts[database] = {
+                'opened': 0, 'reused': 0, 'closed': 0, 'evicted': 0}
+        counts[name] += 1
+
+    def acquire(self, database):
+        """
+            :return: an idle connection to database, or None if there is
+            none and the caller should open one
+            """
+        with self.lock:
+            self.check_fork()
+            connections = self.idle.get(database)
+            if connections:
+                conn = connections.pop()
+                if not connections:
+                    del self.idle[database]
+                self.count(database, 'reused')
+                return conn
+            self.count(database, 'opened')
+            return None
+
+    def release(self, database, conn):
+        """
+            Keeps conn for the next context that needs database, or closes
+            it if the pool is full.
+            """
+        if conn.in_transaction:
+            conn.rollback()
+
+        closing = []
+        with self.lock:
+            self.check_fork()
+            connections = self.idle.get(database, [])
+            if len(connections) < self.max_idle:
+                connections.append(conn)
+                self.idle[database] = connections
+                self.idle.move_to_end(database)
+            else:
+                self.count(database, 'closed')
+                closing.append(conn)
+            while len(self.idle) > self.max_databases:
+                evicted, connections = self.idle.popitem(last=False)
+                self.count(evicted, 'evicted')
+                closing.extend(connections)
+        for connection in closing:
+            connection.close()
+
+    def stats(self):
+        """
+            :return: dict of database path -> dict of idle (connections
+            open now) and the opened, reused, closed and evicted counters
+            """
+        with self.lock:
+            self.check_fork()
+            return {database: dict(counts,
+                                   idle=len(self.idle.get(database, ())))
+                    for database, counts in self.counts.items()}
 
 
 class DBManager:
     """
         This class handles all database interactions for a flask app.
 
-        Functions return lists of dictionaries where relevant
-        Lists of dictionaries can be accessed the same way an OrderedDict
-        can be accessed. The only difference, really, is that the
-        dictionaries are not in a particular order.
+        One DBManager is shared by every blueprint of the app built by
+        create_app() in main_app.py.
+
+        Read functions return a RowSet where relevant. A RowSet can be
+        looped over and indexed the same way the old lists of dictionaries
+        could (row['grade']), but the rows themselves are stored as tuples
+        so no dictionary is allocated per row.
     """
-    def __init__(self, flask_app):
+    def __init__(self, flask_app=None):
         """
-            Creates a DBHandler object.
+            Creates a DBHandler object. The app can be given here or later
+            through init_app(), so one DBManager can be created at import
+            time and shared by the site and the API blueprints.
         :param flask_app - Flask app object
         """
         self.app = flask_app
+        self.journal_mode_set = set()  # database paths already switched
+        self.pools = ConnectionPools()
+        if flask_app is not None:
+            self.init_app(flask_app)
 
-    def connect_db(self):
+    def init_app(self, flask_app):
+        """
+            Binds the manager to an app. Nothing is opened here; the first
+            connection is made when a request first needs one.
+        :param flask_app - Flask app object
         """
-            Returns a sqlite connection object associated with the
-            application's database file.
+        flask_app.config.setdefault('DATABASE',
+                                    os.path.join(flask_app.root_path,
+                                                 'woodle.sqlite'))
+        # seconds a connection waits for another one's write lock before
+        # failing with "database is locked"
+        flask_app.config.setdefault('DATABASE_TIMEOUT', 10.0)
+        # WAL lets readers and the writer work at the same time
+        flask_app.config.setdefault('DATABASE_JOURNAL_MODE', 'WAL')
+        # idle connections kept per database file, and files kept open
+        self.pools.max_idle = int(flask_app.config.get('DATABASE_POOL_IDLE',
+                                                       4))
+        self.pools.max_databases = int(flask_app.config.get(
+            'DATABASE_POOL_DATABASES', 64))
+        flask_app.teardown_appcontext(self.close_db)
+        flask_app.extensions['db_manager'] = self
+
+    def connect_db(self, database=None):
+        """
+            Returns a new sqlite connection object associated with the
+            application's database file, or with database if given.
             """
 
-        conn = sqlite3.connect(self.app.config['DATABASE'], timeout=1)
+        database = database or self.database_path()
+        # pooled connections are handed from one request thread to another
+        conn = sqlite3.connect(
+            database, timeout=current_app.config.get('DATABASE_TIMEOUT', 10),
+            check_same_thread=False)
         conn.row_factory = sqlite3.Row
 
+        # the journal mode is stored in the file, so it is only set by the
+        # first connection each process makes to it. An empty file is left
+        # to init_db(): auto_vacuum can no longer change once it is in WAL
+        if database not in self.journal_mode_set and conn.execute(
+                'SELECT COUNT(*) FROM sqlite_master;').fetchone()[0]:
+            self.set_journal_mode(conn, database)
+
         return conn
 
+    def set_journal_mode(self, conn, database):
+        """
+            Switches the database of conn to the DATABASE_JOURNAL_MODE
+            setting, if there is one.
+            """
+        journal_mode = current_app.config.get('DATABASE_JOURNAL_MODE')
+        if journal_mode:
+            conn.execute('PRAGMA journal_mode = %s;' % journal_mode)
+        self.journal_mode_set.add(database)
+
+    def database_path(self):
+        """
+            Returns the database file of the current context: the one
+            chosen with use_tenant(), else the one project_tenants.py
+            routed the request to, else app.config['DATABASE'].
+            """
+        database = g.get('tenant_database')
+        if database is None and has_request_context():
+            database = request.environ.get('woodle.database')
+        return database or current_app.config['DATABASE']
+
+    def current_tenant(self):
+        """
+            Returns the name of the tenant whose database the current
+            context uses, or None for app.config['DATABASE'].
+            """
+        if 'tenant_database' in g:
+            return g.get('tenant')
+        if has_request_context():
+            return request.environ.get('woodle.tenant')
+        return None
+
+    def use_tenant(self, tenant, database):
+        """
+            Points the rest of the current app context at a tenant's
+            database, e.g. in a background job started by that tenant.
+
+            :param tenant: tenant name, or None for app.config['DATABASE']
+            :param database: the tenant's database file
+            """
+        self.close_db()
+        g.tenant = tenant
+        g.tenant_database = database
+
     def get_db(self):
         """
             Returns a database connection. If a connection has already been
-            created, the existing connection is used, otherwise it creates
-            a new connection.
+            created, the existing connection is used, otherwise an idle one
+            is taken from the pool or a new one is opened.
              """
 
         if not hasattr(g, 'sqlite_db'):
-            g.sqlite_db = self.connect_db()
+            database = self.database_path()
+            conn = self.pools.acquire(database)
+            g.sqlite_db = conn or self.connect_db(database)
+            g.sqlite_db_path = database
 
         return g.sqlite_db
 
+    def close_db(self, exception=None):
+        """
+            Hands the connection of the current app context back to the
+            pool, if one was opened. Registered as a teardown function by
+            init_app().
+            """
+
+        conn = g.pop('sqlite_db', None)
+        database = g.pop('sqlite_db_path', None)
+        if conn is not None:
+            self.pools.release(database, conn)
+
     def init_db(self, init_db_sql_file):
         """
         This function initializes an empty database for the app.
@@ -61,6 +406,7 @@ class DBManager:
 
         cur.executescript(db_creation_script)
         conn.commit()  # database should have all empty tables
+        self.set_journal_mode(conn, g.sqlite_db_path)
 
     def populate_db(self, populate_db_sql_file):
         """
@@ -78,6 +424,37 @@ class DBManager:
         cur.executescript(populate_db_script)
         conn.commit()  # database should no longer be empty
 
+    def migrate_db(self, migrations_directory):
+        """
+        Brings the database schema up to date by running, in order, every
+        NNN_description.sql script in migrations_directory whose number is
+        higher than the database's PRAGMA user_version. Each script runs in
+        its own transaction together with the user_version bump.
+
+        :param migrations_directory: folder holding the migration scripts
+        :return: list of the script names that were applied
+        """
+        conn = self.get_db()
+        cur = conn.cursor()
+
+        current_version = cur.execute('PRAGMA user_version;').fetchone()[0]
+        applied = []
+
+        scripts = sorted(glob.glob(os.path.join(migrations_directory,
+                                                '[0-9]*.sql')))
+        for script_path in scripts:
+            script_name = os.path.basename(script_path)
+            version = int(script_name.split('_', 1)[0])
+            if version <= current_version:
+                continue
+
+            script = self.read_sql_script(script_path)
+            cur.executescript('BEGIN;\n%s\nPRAGMA user_version = %d;\nCOMMIT;'
+                              % (script, version))
+            applied.append(script_name)
+
+        return applied
+
     def read_sql_script(self, filename):
         """
         This function will read in and then return an SQL script
@@ -98,64 +475,246 @@ class DBManager:
         except FileNotFoundError or FileExistsError:
             print('Could not find that .sql file')
 
-    def get_id(self):
+    def add_query_listener(self, flask_app, listener):
         """
-            Returns a list of students in the same class sorted by name.
-            """
+        Has listener(query, parameters, seconds, rows) called after every
+        statement flask_app runs (see execute()). Listeners are kept on the
+        app, not on the DBManager, which every create_app() shares, so
+        building another app does not add a second copy of each.
+        """
+        flask_app.extensions.setdefault('db_query_listeners', []).append(
+            listener)
+
+    def get_query_listeners(self):
+        """
+        :return: the query listeners of the current app
+        """
+        if not has_app_context():
+            return ()
+        return current_app.extensions.get('db_query_listeners', ())
+
+    def execute(self, cur, query, parameters=(), fetch=False):
+        """
+        Executes one statement on cur. Every query DBManager runs goes
+        through here so it can be timed; each query listener of the app is
+        called as listener(query, parameters, seconds, rows) afterwards,
+        where rows is the number of rows fetched or changed, or None if it
+        is not known yet.
+
+        :param cur: cursor to execute on
+        :param query: SQL statement
+        :param parameters: values bound to the statement's ? placeholders
+        :param fetch: if True, fetch every row inside the timing and return
+        the list of rows instead of the cursor
+        :return: cur, or the fetched rows
+        """
+        listeners = self.get_query_listeners()
+        if not listeners:
+            cur.execute(query, parameters)
+            return cur.fetchall() if fetch else cur
+
+        start = time.perf_counter()
+        cur.execute(query, parameters)
+        if fetch:
+            result = cur.fetchall()
+            rows = len(result)
+        else:
+            result = cur
+            rows = cur.rowcount if cur.rowcount >= 0 else None
+        seconds = time.perf_counter() - start
 
+        for listener in listeners:
+            listener(query, parameters, seconds, rows)
+        return result
+
+    def execute_many(self, cur, query, parameter_rows):
+        """
+        Executes one statement for every item of parameter_rows, timed as a
+        single statement for the query listeners.
+
+        :return: cur
+        """
+        start = time.perf_counter()
+        cur.executemany(query, parameter_rows)
+        seconds = time.perf_counter() - start
+
+        for listener in self.get_query_listeners():
+            listener(query, (), seconds, cur.rowcount)
+        return cur
+
+    @contextlib.contextmanager
+    def read_snapshot(self):
+        """
+        Runs the block in one read transaction on this context's connection,
+        so every read in it sees the database as it was at the first one,
+        whatever other connections commit meanwhile. Nothing may be written
+        in the block; the transaction is rolled back at the end.
+        """
+        conn = self.get_db()
+        self.execute(conn.cursor(), 'BEGIN;')
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+
+    def read_rows(self, query, parameters=()):
+        """
+        Executes a read query and returns its result as a RowSet. The cursor
+        has no row factory, so sqlite hands back plain tuples and nothing
+        else is allocated per row.
+
+        :param query: the SELECT statement to execute
+        :param parameters: values bound to the query's ? placeholders
+        :return: a RowSet with the query's columns and rows
+        """
+        conn = self.get_db()
+        cur = conn.cursor()
+        cur.row_factory = None  # plain tuples instead of sqlite3.Row
+
+        # fetchall() gets all the rows as a list of tuples
+        rows = self.execute(cur, query, parameters, fetch=True)
+        columns = tuple(description[0] for description in cur.description)
+
+        return RowSet(columns, rows)
+
+    def iter_rows(self, query, parameters=(), batch=ROW_BATCH):
+        """
+        Executes a read query lazily and yields its rows as Records,
+        fetching batch rows at a time, so a large result is never held in
+        memory at once. Nothing runs until the first row is asked for; the
+        statement keeps its read transaction open until the generator is
+        exhausted or closed.
+
+        :param query: the SELECT statement to execute
+        :param parameters: values bound to the query's ? placeholders
+        :param batch: rows fetched from sqlite per round
+        :return: a generator of Records
+        """
         conn = self.get_db()
         cur = conn.cursor()
+        cur.row_factory = None  # plain tuples instead of sqlite3.Row
+        try:
+            self.execute(cur, query, parameters)
+            index = {description[0]: i
+                     for i, description in enumerate(cur.description)}
+            rows = cur.fetchmany(batch)
+            while rows:
+                for values in rows:
+                    yield Record(index, values)
+                rows = cur.fetchmany(batch)
+        finally:
+            cur.close()
+
+    def get_id(self):
+        """
+            Returns a list of students in the same class sorted by name.
+            """
 
         query = '''
-            SELECT student.name as s_name, class.name as c_name, grade
+            SELECT student.name as s_name, class.name as c_name,
+            grade_scale.letter as grade
             FROM student, grade, class
+            LEFT JOIN grade_scale ON grade_scale.code = grade.grade_code
             WHERE student.class_id = class.class_id;
             '''
-        cur.execute(query)
-        # fetchall() gets all the rows as a list
-        all_rows_gotten = cur.fetchall()
-
-        results = []
-        for row in all_rows_gotten:
-            results.append(dict(row))
-
-        return results
+        return self.read_rows(query)
 
     def get_class_grade(self, username=None):
         """
             Returns the classes and grades for students.
             """
 
-        conn = self.get_db()
-        cur = conn.cursor()
-
         # if want names, classes and grades for a specific user
         if username is not None:
             query = '''
-                SELECT student.name as s_name, class.name as c_name, grade
+                SELECT student.name as s_name, class.name as c_name,
+                grade_scale.letter as grade
                 FROM student, grade, class
+                LEFT JOIN grade_scale ON grade_scale.code = grade.grade_code
                 WHERE student.class_id = class.class_id AND
                       student.username = ?;
                 '''
-            cur.execute(query, (username,))
+            return self.read_rows(query, (username,))
 
         # else, get names, classes and grades for everybody
         else:
             query = '''
-                SELECT student.name as s_name, class.name as c_name, grade
+                SELECT student.name as s_name, class.name as c_name,
+                grade_scale.letter as grade
                 FROM student, grade, class
+                LEFT JOIN grade_scale ON grade_scale.code = grade.grade_code
                 WHERE student.class_id = class.class_id;
                 '''
-            cur.execute(query)
+            return self.read_rows(query)
 
-        # fetchall() gets all the rows as a list
-        all_rows_gotten = cur.fetchall()
+    def iter_class_grade(self, username, after=0):
+        """
+            Yields the grades of the students with user name username one at
+            a time, in grade row order, for pages of a student's grades.
+            Each row carries the class_id and student_id of its grade, so
+            the page can find the row a pushed grade change belongs to.
+
+        :param after: only rows after this row_key
+        :return: a generator of Records of row_key, s_name, c_name, grade,
+        class_id and student_id
+        """
 
-        results = []
-        for row in all_rows_gotten:
-            results.append(dict(row))
+        query = '''
+            SELECT grade.rowid as row_key, student.name as s_name,
+            class.name as c_name, grade_scale.letter as grade,
+            grade.class_id as class_id, grade.student_id as student_id
+            FROM student, grade, class
+            LEFT JOIN grade_scale ON grade_scale.code = grade.grade_code
+            WHERE grade.student_id = student.student_id
+            AND grade.class_id = class.class_id
+            AND student.username = ? AND grade.rowid > ?
+            ORDER BY grade.rowid;
+            '''
+        return self.iter_rows(query, (username, after))
+
+    def read_class_grades(self, fields=None, filters=None):
+        """
+            One row per grade, with the student and the class it was given
+            in, narrowed down in SQL: only the columns in fields are
+            selected and the filters become WHERE conditions, so the work
+            done and the rows sent shrink with what the caller asks for.
+
+        :param fields: names from GRADE_FIELDS (default: s_name, c_name,
+        grade)
+        :param filters: dict of GRADE_FILTERS name -> list of values; a
+        row must match one of the values of every filter
+        :return: a RowSet with the fields as columns
+        :raise ValueError: for a field or filter that is not allowed
+        """
+        fields = list(dict.fromkeys(fields or DEFAULT_GRADE_FIELDS))
+        filters = filters or {}
+
+        unknown = [name for name in fields if name not in GRADE_FIELDS] + \
+            [name for name in filters if name not in GRADE_FILTERS]
+        if unknown:
+            raise ValueError('unknown field or filter: %s'
+                             % ', '.join(unknown))
+
+        conditions = ['grade.student_id = student.student_id',
+                      'grade.class_id = class.class_id']
+        parameters = []
+        for name, values in filters.items():
+            if len(values) == 1:
+                comparison = '= ?'
+            else:
+                comparison = 'IN (%s)' % ', '.join('?' * len(values))
+            conditions.append(GRADE_FILTERS[name] % comparison)
+            parameters.extend(values)
 
-        return results
+        query = '''
+            SELECT %s
+            FROM student, grade, class
+            LEFT JOIN grade_scale ON grade_scale.code = grade.grade_code
+            WHERE %s;
+            ''' % (', '.join('%s as %s' % (GRADE_FIELDS[name], name)
+                               for name in fields),
+                     ' AND '.join(conditions))
+        return self.read_rows(query, parameters)
 
     def get_name_of_user(self, username, table):
         """
@@ -172,7 +731,7 @@ class DBManager:
                     SELECT name FROM faculty WHERE username = ?;
                     '''
 
-            cur.execute(query, (username,))
+            self.execute(cur, query, (username,))
 
         # else want the name of a student given the username
         else:
@@ -180,7 +739,7 @@ class DBManager:
                     SELECT name FROM student WHERE username = ?;
                     '''
 
-            cur.execute(query, (username,))
+            self.execute(cur, query, (username,))
 
         name_gotten = cur.fetchone()
         return dict(name_gotten)
@@ -191,130 +750,145 @@ class DBManager:
             in that class, and what grade they have.
             """
 
-        conn = self.get_db()
-        cur = conn.cursor()
-
         if username is None:
             query = '''
                 SELECT faculty.name as f_name, class.name as c_name,
-                student.name as s_name, grade
+                student.name as s_name, grade_scale.letter as grade
                 FROM student, grade, class, faculty
+                LEFT JOIN grade_scale ON grade_scale.code = grade.grade_code
                 WHERE grade.faculty_id = faculty.faculty_id
                 AND grade.student_id = student.student_id
                 AND grade.class_id = class.class_id;
                 '''
-            cur.execute(query)
+            return self.read_rows(query)
 
         else:
             query = '''
                 SELECT faculty.name as f_name, class.name as c_name,
-                student.name as s_name, grade
+                student.name as s_name, grade_scale.letter as grade
                 FROM student, grade, class, faculty
+                LEFT JOIN grade_scale ON grade_scale.code = grade.grade_code
                 WHERE grade.faculty_id = faculty.faculty_id
                 AND grade.student_id = student.student_id
                 AND grade.class_id = class.class_id
                 AND faculty.username = ?;
                 '''
-            cur.execute(query, (username,))
+            return self.read_rows(query, (username,))
 
-        all_rows_gotten = cur.fetchall()
+    def iter_faculty(self, username, after=0):
+        """
+            Yields the rows of get_faculty(username) one at a time, in grade
+            row order, for pages of a large roster.
 
-        results = []
-        for row in all_rows_gotten:
-            results.append(dict(row))
+        :param after: only rows after this row_key
+        :return: a generator of Records of row_key, f_name, c_name, s_name
+        and grade
+        """
 
-        # fetchall() gets all the rows as a list
-        if results.__len__ == 0:
-            return None
-        return results
+        query = '''
+            SELECT grade.rowid as row_key, faculty.name as f_name,
+            class.name as c_name, student.name as s_name,
+            grade_scale.letter as grade
+            FROM student, grade, class, faculty
+            LEFT JOIN grade_scale ON grade_scale.code = grade.grade_code
+            WHERE grade.faculty_id = faculty.faculty_id
+            AND grade.student_id = student.student_id
+            AND grade.class_id = class.class_id
+            AND faculty.username = ? AND grade.rowid > ?
+            ORDER BY grade.rowid;
+            '''
+        return self.iter_rows(query, (username, after))
 
     def get_student_user(self):
         """
             Returns username and password of a student.
             """
 
-        conn = self.get_db()
-        cur = conn.cursor()
-
         query = '''
             SELECT username, password
             FROM student;
             '''
-
-        cur.execute(query)
-        # fetchall() gets all the rows as a list
-        all_rows_gotten = cur.fetchall()
-
-        results = []
-        for row in all_rows_gotten:
-            results.append(dict(row))
-
-        return results
+        return self.read_rows(query)
 
     def get_faculty_user(self):
         """
             Returns username and password of a teacher.
             """
 
-        conn = self.get_db()
-        cur = conn.cursor()
-
         query = '''
             SELECT username, password
             FROM faculty;
             '''
+        return self.read_rows(query)
 
-        cur.execute(query)
-        # fetchall() gets all the rows as a list
-        all_rows_gotten = cur.fetchall()
-
-        results = []
-        for row in all_rows_gotten:
-            results.append(dict(row))
-
-        return results
-
-    def query_login_info(self, username, password):
+    def get_user_by_id(self, table, user_id):
         """
-        Query the student table to see if the username and password pair
-        exists for some student entity in the student table. If not, then
-        check the same for a faculty entity
+        Looks up the login details of a student or faculty member by id.
 
-        :param username: candidate username
-        :param password: candidate password
-        :return: list of 1 dict with matching entity OR None
+        :param table: 'student' or 'faculty'
+        :param user_id: student_id or faculty_id
+        :return: dict with username and password, or None
         """
         conn = self.get_db()
         cur = conn.cursor()
 
-        # if the user is a student
-        student_query = '''
-                        SELECT username, password, student_id
-                        FROM student
-                        WHERE student.username = ? AND
-                              student.password = ?;
-                        '''
+        if table == 'faculty':
+            query = '''
+                    SELECT username, password FROM faculty
+                    WHERE faculty_id = ?;
+                    '''
+        else:
+            query = '''
+                    SELECT username, password FROM student
+                    WHERE student_id = ?;
+                    '''
 
-        cur.execute(student_query, (username, password))
+        self.execute(cur, query, (user_id,))
+        row = cur.fetchone()
+        return dict(row) if row is not None else None
 
-        student_result = cur.fetchone()
-        if student_result is not None:
-            return [dict(student_result)]
+    def get_login_candidates(self, username):
+        """
+        Returns every student and faculty member with username, students
+        first, with the stored password hash to check a login against.
 
-        # else the user is faculty
-        faculty_query = '''
-                        SELECT username, password, faculty_id
-                        FROM faculty
-                        WHERE faculty.username = ? AND
-                              faculty.password = ?;
-                        '''
-        cur.execute(faculty_query, (username, password))
+        :param username: username being logged in
+        :return: list of dicts with kind ('student' or 'faculty'), user_id,
+        username and password
+        """
+        query = '''
+                SELECT 'student' AS kind, student_id AS user_id, username,
+                password, 0 AS priority
+                FROM student WHERE username = ?
+                UNION ALL
+                SELECT 'faculty', faculty_id, username, password, 1
+                FROM faculty WHERE username = ?
+                ORDER BY priority, user_id;
+                '''
+        rows = self.execute(self.get_db().cursor(), query,
+                            (username, username), fetch=True)
+        return [{'kind': row['kind'], 'user_id': row['user_id'],
+                 'username': row['username'], 'password': row['password']}
+                for row in rows]
 
-        faculty_result = cur.fetchone()
-        if faculty_result is not None:
-            return [dict(faculty_result)]
-        else:
-            return None  # no faculty or student with that username passw pair
+    def set_password_hash(self, kind, user_id, old_hash, new_hash):
+        """
+        Replaces the stored password of a student or faculty member, unless
+        it changed since old_hash was read.
+
+        :param kind: 'student' or 'faculty'
+        :param user_id: student_id or faculty_id
+        :return: True if the row was updated
+        """
+        conn = self.get_db()
+        table, key = (('faculty', 'faculty_id') if kind == 'faculty'
+                      else ('student', 'student_id'))
+        cur = self.execute(conn.cursor(),
+                           'UPDATE %s SET password = ? '
+                           'WHERE %s = ? AND password = ?;' % (table, key),
+                           (new_hash, user_id, old_hash))
+        conn.commit()
+        return cur.rowcount == 1
 
     def insert_user(self, username, password, name, class_id, title=None):
         """
@@ -323,7 +897,8 @@ class DBManager:
         then the entity must be some faculty member.
 
         :param username: username of the entity to register
-        :param password: password for new entity
+        :param password: password hash to store for the new entity (see
+        project_passwords.py)
         :param name: full name of the actual person
         :param class_id: for faculty this is class taught; for students, it is
         the class enrolled in
@@ -331,7 +906,7 @@ class DBManager:
         :return: Nothing. User is entered into database.
         """
 
-        conn = self.connect_db()
+        conn = self.get_db()
         cur = conn.cursor()
 
         if title is None:
@@ -340,12 +915,11 @@ class DBManager:
                         username, password, name, class_id)
                         VALUES(?,?,?,?);
                         '''
-            cur.execute(insertion, (username, password, name, class_id))
+            self.execute(cur, insertion, (username, password, name, class_id))
             conn.commit()
             # just_inserted_row = self.query_by_id(cur.lastrowid, 'student')
             # return just_inserted_row  # list with 1 dict
             return [{'username': username,
-                    'password': password,
                     'name': name,
                     'class_id': class_id}]
 
@@ -355,10 +929,569 @@ class DBManager:
                         username, password, name, class_id, title)
                         VALUES(?,?,?,?,?);
                         '''
-            cur.execute(insertion, (username, password, name, class_id, title))
+            self.execute(cur, insertion,
+                         (username, password, name, class_id, title))
             conn.commit()
             return [{'username': username,
-                     'password': password,
                      'name': name,
                      'class_id': class_id,
                      'title': title}]
+
+    def save_class_grades(self, class_id, grades, faculty_id=None,
+                          replace=False):
+        """
+        Saves the grades of a whole class in one transaction.
+
+        Every student in grades must be enrolled in the class, i.e. be
+        registered in it (student.class_id) or already have a grade in it.
+        Enrollment is checked for the whole roster with one query; if any
+        student is not enrolled nothing is written. Likewise every grade
+        must be a letter of the grade scale, and a faculty_id given must be
+        one of the faculty members teaching the class.
+
+        :param class_id: class being graded
+        :param grades: list of (student_id, grade letter) pairs
+        :param faculty_id: faculty member giving the grades; defaults to
+        the faculty member teaching the class
+        :param replace: if True, grades in the class for students missing
+        from grades are deleted, so the class ends up with exactly grades
+        :return: None if there is no such class, otherwise a dict with
+        class_id, faculty_id, saved, removed, not_enrolled (a list of
+        student ids), unknown_grades (a list of letters) and not_teaching
+        (a list holding faculty_id if it does not teach the class); when
+        any list is not empty nothing was saved
+        """
+        conn = self.get_db()
+        cur = conn.cursor()
+        roster = json.dumps([student_id for student_id, _ in grades])
+
+        # take the write lock up front so the roster check and the writes
+        # see the same data
+        self.execute(cur, 'BEGIN IMMEDIATE;')
+        try:
+            self.execute(cur, 'SELECT class_id FROM class WHERE class_id = ?;',
+                         (class_id,))
+            if cur.fetchone() is None:
+                conn.rollback()
+                return None
+
+            not_teaching = []
+            if faculty_id is None:
+                self.execute(cur, '''
+                             SELECT faculty_id FROM faculty
+                             WHERE class_id = ?
+                             ORDER BY faculty_id LIMIT 1;
+                             ''', (class_id,))
+                teacher = cur.fetchone()
+                faculty_id = teacher[0] if teacher is not None else None
+            else:
+                self.execute(cur, '''
+                             SELECT faculty_id FROM faculty
+                             WHERE faculty_id = ? AND class_id = ?;
+                             ''', (faculty_id, class_id))
+                if cur.fetchone() is None:
+                    not_teaching.append(faculty_id)
+
+            not_enrolled_query = '''
+                SELECT roster.value FROM json_each(?) AS roster
+                WHERE NOT EXISTS (SELECT 1 FROM student
+                                  WHERE student.student_id = roster.value
+                                  AND student.class_id = ?)
+                AND NOT EXISTS (SELECT 1 FROM grade
+                                WHERE grade.student_id = roster.value
+                                AND grade.class_id = ?);
+                '''
+            not_enrolled = [row[0] for row in self.execute(
+                cur, not_enrolled_query, (roster, class_id, class_id),
+                fetch=True)]
+
+            unknown_grades_query = '''
+                SELECT DISTINCT letters.value FROM json_each(?) AS letters
+                WHERE letters.value NOT IN (SELECT letter FROM grade_scale)
+                ORDER BY letters.value;
+                '''
+            unknown_grades = [row[0] for row in self.execute(
+                cur, unknown_grades_query,
+                (json.dumps([grade for _, grade in grades]),), fetch=True)]
+
+            result = {'class_id': class_id, 'faculty_id': faculty_id,
+                      'saved': 0, 'removed': 0, 'not_enrolled': not_enrolled,
+                      'unknown_grades': unknown_grades,
+                      'not_teaching': not_teaching}
+            if not_enrolled or unknown_grades or not_teaching:
+                conn.rollback()
+                return result
+
+            if replace:
+                removal = '''
+                    DELETE FROM grade
+                    WHERE class_id = ?
+                    AND student_id NOT IN (SELECT value FROM json_each(?));
+                    '''
+                self.execute(cur, removal, (class_id, roster))
+                result['removed'] = cur.rowcount
+
+            upsert = '''
+                INSERT INTO grade(grade_code, class_id, student_id,
+                                  faculty_id)
+                VALUES((SELECT code FROM grade_scale WHERE letter = ?),
+                       ?,?,?)
+                ON CONFLICT(class_id, student_id) DO UPDATE
+                SET grade_code = excluded.grade_code,
+                faculty_id = excluded.faculty_id;
+                '''
+            self.execute_many(cur, upsert,
+                              [(grade, class_id, student_id, faculty_id)
+                               for student_id, grade in grades])
+            result['saved'] = len(grades)
+
+            conn.commit()
+            return result
+
+        except Exception:
+            conn.rollback()
+            raise
+
+    def insert_students(self, class_id, students):
+        """
+        Inserts many students into one class in a single transaction.
+
+        :param class_id: class the students are enrolled in
+        :param students: list of dicts with name, username and password
+        (the hash to store)
+        :return: the number of students inserted
+        """
+        conn = self.get_db()
+        cur = conn.cursor()
+
+        query = '''
+                INSERT INTO student(name, class_id, username, password)
+                VALUES(?,?,?,?);
+                '''
+        self.execute_many(cur, query,
+                          [(student['name'], class_id,
+                            student['username'], student['password'])
+                           for student in students])
+        conn.commit()
+        return len(students)
+
+    def get_gradebook(self, class_id=None):
+        """
+            Returns every grade given, with the class, student and faculty
+            names, one row per grade.
+            """
+
+        query = '''
+            SELECT class.class_id, class.name as c_name,
+            student.student_id, student.name as s_name,
+            faculty.name as f_name, grade_scale.letter as grade
+            FROM grade
+            JOIN class ON class.class_id = grade.class_id
+            JOIN student ON student.student_id = grade.student_id
+            LEFT JOIN faculty ON faculty.faculty_id = grade.faculty_id
+            LEFT JOIN grade_scale ON grade_scale.code = grade.grade_code
+            WHERE ? IS NULL OR grade.class_id = ?
+            ORDER BY class.class_id, student.name;
+            '''
+        return self.read_rows(query, (class_id, class_id))
+
+    def get_grade_distribution(self):
+        """
+            Returns how many of each grade every class gave, best grade
+            first. The counting is done on the grade codes; the letters are
+            only looked up for the counted rows.
+            """
+
+        query = '''
+            SELECT class.class_id, class.name as c_name,
+            grade_scale.letter as grade, counts.students
+            FROM (SELECT class_id, grade_code, COUNT(*) as students
+                  FROM grade GROUP BY class_id, grade_code) AS counts
+            JOIN class ON class.class_id = counts.class_id
+            LEFT JOIN grade_scale ON grade_scale.code = counts.grade_code
+            ORDER BY class.class_id, grade_scale.ordering;
+            '''
+        return self.read_rows(query)
+
+    def create_job(self, kind, parameters, worker_pid):
+        """
+        Records a new queued job.
+
+        :param kind: name of the job function
+        :param parameters: JSON-serializable keyword arguments of the job
+        :param worker_pid: process that will run the job
+        :return: the new job_id
+        """
+        conn = self.get_db()
+        cur = conn.cursor()
+
+        query = '''
+                INSERT INTO job(kind, parameters, worker_pid, created)
+                VALUES(?,?,?,?);
+                '''
+        self.execute(cur, query, (kind, json.dumps(parameters), worker_pid,
+                                  time.time()))
+        conn.commit()
+        return cur.lastrowid
+
+    def update_job(self, job_id, **fields):
+        """
+        Updates some columns of a job, e.g. update_job(7, progress=0.5).
+        Values for parameters and result are stored as JSON.
+
+        :param job_id: job to update
+        :param fields: column name -> new value
+        """
+        conn = self.get_db()
+        cur = conn.cursor()
+
+        for name in ('parameters', 'result'):
+            if name in fields:
+                fields[name] = json.dumps(fields[name])
+
+        # column names come from our own callers, never from a request
+        query = 'UPDATE job SET %s WHERE job_id = ?;' % ', '.join(
+            '%s = ?' % name for name in fields)
+        self.execute(cur, query, tuple(fields.values()) + (job_id,))
+        conn.commit()
+
+    def get_job(self, job_id):
+        """
+        :param job_id: job to look up
+        :return: dict of the job's columns with parameters and result
+        decoded, or None if there is no such job
+        """
+        conn = self.get_db()
+        cur = conn.cursor()
+
+        self.execute(cur, 'SELECT * FROM job WHERE job_id = ?;', (job_id,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+
+        job = dict(row)
+        for name in ('parameters', 'result'):
+            if job[name] is not None:
+                job[name] = json.loads(job[name])
+        return job
+
+    def get_student_id_ranges(self, partitions):
+        """
+            Splits the students into partitions groups of consecutive ids,
+            as even in size as possible.
+
+        :param partitions: number of groups wanted
+        :return: RowSet of first_id, last_id, students; fewer rows than
+        partitions if there are fewer students
+        """
+
+        query = '''
+            SELECT MIN(student_id) as first_id, MAX(student_id) as last_id,
+            COUNT(*) as students
+            FROM (SELECT student_id,
+                  NTILE(?) OVER (ORDER BY student_id) as part
+                  FROM student)
+            GROUP BY part
+            ORDER BY part;
+            '''
+        return self.read_rows(query, (partitions,))
+
+    def get_transcripts(self, first_id, last_id):
+        """
+            Returns the grades of every student whose id is in
+            first_id..last_id, ordered by student. Students without grades
+            get one row with c_name and grade set to NULL.
+            """
+
+        query = '''
+            SELECT student.student_id, student.username,
+            student.name as s_name, class.name as c_name,
+            grade_scale.letter as grade
+            FROM student
+            LEFT JOIN grade ON grade.student_id = student.student_id
+            LEFT JOIN class ON class.class_id = grade.class_id
+            LEFT JOIN grade_scale ON grade_scale.code = grade.grade_code
+            WHERE student.student_id BETWEEN ? AND ?
+            ORDER BY student.student_id, class.name;
+            '''
+        return self.read_rows(query, (first_id, last_id))
+
+    def get_data_version(self):
+        """
+        :return: PRAGMA data_version of this context's connection; it
+        changes whenever another connection commits to the database
+        """
+        conn = self.get_db()
+        cur = conn.cursor()
+        return self.execute(cur, 'PRAGMA data_version;', fetch=True)[0][0]
+
+    def get_changes(self, since, limit):
+        """
+            Returns the change log entries after sequence number since,
+            oldest first.
+
+        :param since: last seq the caller has already seen
+        :param limit: most entries to return
+        :return: RowSet of seq, table_name, row_id, operation, data (JSON
+        text) and changed
+        """
+
+        query = '''
+            SELECT seq, table_name, row_id, operation, data, changed
+            FROM change_log
+            WHERE seq > ?
+            ORDER BY seq
+            LIMIT ?;
+            '''
+        return self.read_rows(query, (since, limit))
+
+    def get_change_horizon(self):
+        """
+        :return: the highest seq compaction has dropped a delete entry for
+        """
+        conn = self.get_db()
+        cur = conn.cursor()
+        return self.execute(cur, 'SELECT seq FROM change_log_horizon;',
+                            fetch=True)[0][0]
+
+    def compact_change_log(self, before):
+        """
+        Shrinks the change log. Entries older than before are dropped if a
+        newer entry exists for the same row, and old delete entries are
+        dropped altogether, raising the horizon. What is left is enough to
+        rebuild every live row from seq 0, plus the full recent history.
+
+        :param before: unix time; newer entries are never touched
+        :return: dict with superseded and deletes (entries dropped) and
+        horizon
+        """
+        conn = self.get_db()
+        cur = conn.cursor()
+
+        superseded = '''
+            DELETE FROM change_log
+            WHERE changed < ?
+            AND EXISTS (SELECT 1 FROM change_log AS newer
+                        WHERE newer.table_name = change_log.table_name
+                        AND newer.row_id = change_log.row_id
+                        AND newer.seq > change_log.seq);
+            '''
+        raise_horizon = '''
+            UPDATE change_log_horizon
+            SET seq = MAX(seq, (SELECT COALESCE(MAX(seq), 0) FROM change_log
+                                WHERE operation = 'delete'
+                                AND changed < ?));
+            '''
+        deletes = '''
+            DELETE FROM change_log
+            WHERE operation = 'delete' AND changed < ?;
+            '''
+
+        self.execute(cur, 'BEGIN IMMEDIATE;')
+        try:
+            result = {'superseded': self.execute(cur, superseded,
+                                                 (before,)).rowcount}
+            self.execute(cur, raise_horizon, (before,))
+            result['deletes'] = self.execute(cur, deletes, (before,)).rowcount
+            result['horizon'] = self.execute(
+                cur, 'SELECT seq FROM change_log_horizon;', fetch=True)[0][0]
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        return result
+
+    def get_grade_changes(self, since, student_id=None, limit=1000):
+        """
+            Returns the grade entries of the change log after sequence
+            number since, with the class name looked up, oldest first.
+
+        :param since: last seq already seen
+        :param student_id: only this student's grades, or None for all
+        :param limit: most entries to return
+        :return: RowSet of seq, student_id, class_id, c_name, grade and
+        operation
+        """
+
+        query = '''
+            SELECT seq,
+            json_extract(data, '$.student_id') as student_id,
+            json_extract(data, '$.class_id') as class_id,
+            class.name as c_name,
+            json_extract(data, '$.grade') as grade,
+            operation
+            FROM change_log
+            LEFT JOIN class
+            ON class.class_id = json_extract(change_log.data, '$.class_id')
+            WHERE seq > ? AND table_name = 'grade'
+            AND (? IS NULL OR json_extract(data, '$.student_id') = ?)
+            ORDER BY seq
+            LIMIT ?;
+            '''
+        return self.read_rows(query, (since, student_id, student_id, limit))
+
+    def get_last_change(self):
+        """
+        :return: the highest seq in the change log, or 0
+        """
+        conn = self.get_db()
+        cur = conn.cursor()
+        return self.execute(cur, 'SELECT COALESCE(MAX(seq), 0) '
+                                 'FROM change_log;', fetch=True)[0][0]
+
+    def get_table_writes(self, tables):
+        """
+            Counts the change log entries of each table since the table was
+            last analyzed (its 'analyze:<table>' maintenance row).
+
+        :param tables: table names to count
+        :return: dict of table name -> writes, for every table in tables
+        """
+
+        query = '''
+            SELECT change_log.table_name, COUNT(*) as writes
+            FROM change_log
+            LEFT JOIN maintenance
+            ON maintenance.task = 'analyze:' || change_log.table_name
+            WHERE change_log.seq > COALESCE(maintenance.last_seq, 0)
+            GROUP BY change_log.table_name;
+            '''
+        writes = dict.fromkeys(tables, 0)
+        for table_name, count in self.read_rows(query):
+            if table_name in writes:
+                writes[table_name] = count
+        return writes
+
+    def get_change_time(self, back):
+        """
+        :param back: how many entries back from the newest to look
+        :return: the changed time of that change log entry, or None if the
+        log is shorter
+        """
+        conn = self.get_db()
+        cur = conn.cursor()
+        rows = self.execute(cur, 'SELECT changed FROM change_log '
+                                 'ORDER BY seq DESC LIMIT 1 OFFSET ?;',
+                            (back,), fetch=True)
+        return rows[0][0] if rows else None
+
+    def get_storage_stats(self):
+        """
+        :return: dict of page_size, page_count, freelist_count, auto_vacuum
+        (0 none, 1 full, 2 incremental) and journal_mode
+        """
+        conn = self.get_db()
+        cur = conn.cursor()
+        return {name: self.execute(cur, 'PRAGMA %s;' % name,
+                                   fetch=True)[0][0]
+                for name in ('page_size', 'page_count', 'freelist_count',
+                             'auto_vacuum', 'journal_mode')}
+
+    def claim_maintenance(self, task, interval):
+        """
+        Marks task as run now, unless it already ran in the last interval
+        seconds. The check and the update are one statement, so of several
+        processes claiming the same task at once only one gets it.
+
+        :return: True if the caller should run the task
+        """
+        conn = self.get_db()
+        cur = conn.cursor()
+
+        now = time.time()
+        query = '''
+                INSERT INTO maintenance(task, last_run) VALUES(?,?)
+                ON CONFLICT(task) DO UPDATE SET last_run = excluded.last_run
+                WHERE maintenance.last_run <= ?;
+                '''
+        claimed = self.execute(cur, query, (task, now,
+                                            now - interval)).rowcount
+        conn.commit()
+        return claimed == 1
+
+    def record_maintenance(self, task, last_seq=None, result=None):
+        """
+        Records that task has run, with its JSON-serializable result.
+
+        :param last_seq: change log position the task has dealt with
+        """
+        conn = self.get_db()
+        cur = conn.cursor()
+
+        query = '''
+                INSERT INTO maintenance(task, last_run, last_seq, result)
+                VALUES(?,?,COALESCE(?, 0),?)
+                ON CONFLICT(task) DO UPDATE SET
+                last_run = excluded.last_run,
+                last_seq = COALESCE(?, maintenance.last_seq),
+                result = excluded.result;
+                '''
+        self.execute(cur, query, (task, time.time(), last_seq,
+                                  json.dumps(result), last_seq))
+        conn.commit()
+
+    def analyze_tables(self, tables):
+        """
+        Refreshes the planner statistics of tables, then lets PRAGMA
+        optimize look after anything else that needs it.
+
+        :param tables: table names; only tables that exist are analyzed
+        """
+        conn = self.get_db()
+        cur = conn.cursor()
+
+        existing = {row[0] for row in self.execute(
+            cur, "SELECT name FROM sqlite_master WHERE type = 'table';",
+            fetch=True)}
+        for table in tables:
+            if table in existing:
+                self.execute(cur, 'ANALYZE "%s";' % table)
+        self.execute(cur, 'PRAGMA optimize;', fetch=True)
+        conn.commit()
+
+    def incremental_vacuum(self, pages):
+        """
+        Returns up to pages free pages to the file system. Only does
+        anything when auto_vacuum is incremental.
+
+        :return: the number of pages freed
+        """
+        conn = self.get_db()
+        cur = conn.cursor()
+
+        before = self.execute(cur, 'PRAGMA freelist_count;',
+                              fetch=True)[0][0]
+        # the pragma frees one page per step but reports no columns, so
+        # execute() would only step it once; executescript() runs it to
+        # the end
+        cur.executescript('PRAGMA incremental_vacuum(%d);' % int(pages))
+        return before - self.execute(cur, 'PRAGMA freelist_count;',
+                                     fetch=True)[0][0]
+
+    def vacuum(self, auto_vacuum='INCREMENTAL'):
+        """
+        Rebuilds the whole database file, switching its auto_vacuum mode.
+        Locks the database for as long as it takes.
+        """
+        conn = self.get_db()
+        cur = conn.cursor()
+        self.execute(cur, 'PRAGMA auto_vacuum = %s;' % auto_vacuum)
+        self.execute(cur, 'VACUUM;')
+
+    def checkpoint_wal(self):
+        """
+        Copies the write-ahead log back into the database and truncates it.
+
+        :return: dict of busy, log and checkpointed (pages)
+        """
+        conn = self.get_db()
+        cur = conn.cursor()
+        busy, log, checkpointed = self.execute(
+            cur, 'PRAGMA wal_checkpoint(TRUNCATE);', fetch=True)[0]
+        return {'busy': busy, 'log': log, 'checkpointed': checkpointed}
+
+
+# the DBManager shared by the site and the API blueprints; create_app() in
+# main_app.py binds it to the app
+db = DBManager()
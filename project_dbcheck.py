@@ -0,0 +1,571 @@
+"""
+Differential check of the DBManager read methods.
+
+Every read method of DBManager is paired with a reference implementation:
+a frozen copy of the SQL it ran when the check was written, or plain Python
+over the raw tables where that is simpler to trust. Both are run against
+generated databases and must return the same rows, compared as multisets
+(row order is not part of the check). When a query in project_db.py is
+rewritten for speed, the reference stays as it is and proves the rewrite
+returns what the old query did.
+
+The check also times each read method (median of --repeats runs) and
+compares it with a stored baseline; a method more than --max-regression
+percent slower, or missing from the baseline, fails the run:
+
+    python3 project_dbcheck.py --baseline benchmarks/dbcheck_baseline.json
+
+    python3 project_dbcheck.py --baseline benchmarks/dbcheck_baseline.json \\
+        --update-baseline
+
+Timings depend on the machine, so the baseline should be recorded on the
+machine that runs the check. test_project_dbcheck.py runs the row
+comparison (not the timing) with the other tests.
+"""
+import argparse
+import collections
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from flask import Flask
+
+from project_db import DBManager
+from project_streaming import RowPage
+
+# first names are drawn from a short list so students share names
+FIRST_NAMES = ('Alex', 'Bo', 'Chris', 'Dana', 'Eli', 'Fran', 'Gus', 'Hana')
+
+# timing differences below this many milliseconds are never a regression
+NOISE_MS = 0.1
+
+
+def build_database(path, students, seed=1):
+    """
+    Creates a database with the full schema and fills it with generated
+    data: students // 25 classes, one of them without a teacher, faculty
+    usernames shared between two classes, students with the same name,
+    students without grades, grades in classes other than the student's
+    own and grades given by nobody. Some grades are then changed and some
+    deleted, so the change log holds every kind of entry.
+
+    :param path: database file to create
+    :param students: number of students
+    :param seed: seed of the random data
+    """
+    app = Flask(__name__)
+    app.config['DATABASE'] = path
+    manager = DBManager(app)
+    with app.app_context():
+        manager.init_db('init_db.sql')
+        manager.migrate_db('migrations')
+
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    classes = max(3, students // 25)
+    conn.executemany('INSERT INTO class(name) VALUES(?);',
+                     [('Class-%d' % class_id,)
+                      for class_id in range(1, classes + 1)])
+
+    # the last class has no teacher; two classes share a username
+    conn.executemany('INSERT INTO faculty(name, title, username, password, '
+                     'class_id) VALUES(?,?,?,?,?);',
+                     [('Prof %d' % (class_id // 2), 'Prof',
+                       'prof%d' % (class_id // 2), 'pw', class_id)
+                      for class_id in range(1, classes)])
+
+    conn.executemany('INSERT INTO student(name, username, password, '
+                     'class_id) VALUES(?,?,?,?);',
+                     [('%s %d' % (rng.choice(FIRST_NAMES),
+                                  rng.randrange(students // 4 + 1)),
+                       'student%d' % number, 'pw',
+                       rng.randrange(1, classes + 1))
+                      for number in range(students)])
+
+    codes = [row[0] for row in conn.execute('SELECT code FROM grade_scale;')]
+    grades = []
+    for student_id, class_id in conn.execute('SELECT student_id, class_id '
+                                             'FROM student;').fetchall():
+        graded = set()
+        if rng.random() < 0.8:
+            graded.add(class_id)
+        if rng.random() < 0.3:
+            graded.add(rng.randrange(1, classes + 1))
+        for graded_class in graded:
+            faculty_id = graded_class if graded_class < classes else None
+            if rng.random() < 0.05:
+                faculty_id = None
+            grades.append((rng.choice(codes), graded_class, student_id,
+                           faculty_id))
+    conn.executemany('INSERT INTO grade(grade_code, class_id, student_id, '
+                     'faculty_id) VALUES(?,?,?,?);', grades)
+    conn.commit()
+
+    rowids = [row[0] for row in conn.execute('SELECT rowid FROM grade;')]
+    conn.executemany('UPDATE grade SET grade_code = ? WHERE rowid = ?;',
+                     [(rng.choice(codes), rowid)
+                      for rowid in rng.sample(rowids, len(rowids) // 10)])
+    conn.executemany('DELETE FROM grade WHERE rowid = ?;',
+                     [(rowid,) for rowid in rng.sample(rowids,
+                                                       len(rowids) // 20)])
+    conn.commit()
+    conn.close()
+
+
+def rows_of(result):
+    """
+    :return: result of a read method as a list of tuples
+    """
+    if result is None:
+        return []
+    if isinstance(result, dict):
+        return [tuple(result.values())]
+    if hasattr(result, 'rows'):
+        return [tuple(row) for row in result.rows]
+    return [tuple(row.values()) if isinstance(row, dict) else tuple(row)
+            for row in result]
+
+
+def paged(read_rows, username, size=7):
+    """
+    Walks every page of a paged reader (DBManager.iter_faculty or
+    iter_class_grade) the way the site's Next page links do.
+
+    :return: the rows of all pages, without their row_key
+    """
+    rows, after = [], 0
+    while True:
+        page = RowPage(read_rows(username, after), size, after, None)
+        rows.extend(tuple(row)[1:] for row in page)
+        if not page.has_next:
+            return rows
+        after = page.last_key
+
+
+def sample(conn, query, count=3):
+    """
+    :return: up to count values of the first column of query, spread over
+    its result, plus one value that matches nothing
+    """
+    values = [row[0] for row in conn.execute(query)]
+    step = max(1, len(values) // count)
+    return values[::step][:count]
+
+
+# reference implementations -------------------------------------------------
+
+GRADE_ROWS = '''
+    SELECT student.name, class.name, grade_scale.letter, student.username,
+    student.student_id, class.class_id, grade.faculty_id
+    FROM grade
+    JOIN student ON student.student_id = grade.student_id
+    JOIN class ON class.class_id = grade.class_id
+    LEFT JOIN grade_scale ON grade_scale.code = grade.grade_code;
+    '''
+GRADE_COLUMNS = ('s_name', 'c_name', 'grade', 'username', 'student_id',
+                 'class_id')
+
+
+def reference_class_grades(conn, fields, filters):
+    faculty = dict(conn.execute('SELECT faculty_id, username FROM faculty;'))
+    rows = []
+    for row in conn.execute(GRADE_ROWS):
+        record = dict(zip(GRADE_COLUMNS, row))
+        record['faculty'] = faculty.get(row[6])
+        record['grade_filter'] = record['grade']
+        if all(record['grade_filter' if name == 'grade' else name]
+               in values for name, values in filters.items()):
+            rows.append(tuple(record[name] for name in fields))
+    return rows
+
+
+def reference_class_grade(conn, username):
+    query = '''
+        SELECT student.name, class.name, grade_scale.letter
+        FROM student, grade, class
+        LEFT JOIN grade_scale ON grade_scale.code = grade.grade_code
+        WHERE student.class_id = class.class_id
+        AND (? IS NULL OR student.username = ?);
+        '''
+    return conn.execute(query, (username, username)).fetchall()
+
+
+def reference_student_grades(conn, username):
+    query = '''
+        SELECT student.name, class.name, grade_scale.letter, grade.class_id,
+        grade.student_id
+        FROM grade
+        JOIN student ON student.student_id = grade.student_id
+        JOIN class ON class.class_id = grade.class_id
+        LEFT JOIN grade_scale ON grade_scale.code = grade.grade_code
+        WHERE student.username = ?;
+        '''
+    return conn.execute(query, (username,)).fetchall()
+
+
+def reference_faculty(conn, username):
+    query = '''
+        SELECT faculty.name, class.name, student.name, grade_scale.letter
+        FROM grade
+        JOIN faculty ON faculty.faculty_id = grade.faculty_id
+        JOIN student ON student.student_id = grade.student_id
+        JOIN class ON class.class_id = grade.class_id
+        LEFT JOIN grade_scale ON grade_scale.code = grade.grade_code
+        WHERE ? IS NULL OR faculty.username = ?;
+        '''
+    return conn.execute(query, (username, username)).fetchall()
+
+
+def reference_gradebook(conn, class_id):
+    query = '''
+        SELECT class.class_id, class.name, student.student_id, student.name,
+        faculty.name, grade_scale.letter
+        FROM grade
+        JOIN class ON class.class_id = grade.class_id
+        JOIN student ON student.student_id = grade.student_id
+        LEFT JOIN faculty ON faculty.faculty_id = grade.faculty_id
+        LEFT JOIN grade_scale ON grade_scale.code = grade.grade_code;
+        '''
+    return [row for row in conn.execute(query)
+            if class_id is None or row[0] == class_id]
+
+
+def reference_grade_distribution(conn):
+    counts = collections.Counter(conn.execute('''
+        SELECT class.class_id, class.name, grade_scale.letter
+        FROM grade JOIN class ON class.class_id = grade.class_id
+        LEFT JOIN grade_scale ON grade_scale.code = grade.grade_code;
+        '''))
+    return [key + (count,) for key, count in counts.items()]
+
+
+def reference_transcripts(conn, first_id, last_id):
+    grades = collections.defaultdict(list)
+    for row in conn.execute('''
+            SELECT grade.student_id, class.name, grade_scale.letter
+            FROM grade
+            LEFT JOIN class ON class.class_id = grade.class_id
+            LEFT JOIN grade_scale ON grade_scale.code = grade.grade_code;
+            '''):
+        grades[row[0]].append(row[1:])
+
+    rows = []
+    for student_id, username, name in conn.execute(
+            'SELECT student_id, username, name FROM student;'):
+        if first_id <= student_id <= last_id:
+            for c_name, letter in grades[student_id] or [(None, None)]:
+                rows.append((student_id, username, name, c_name, letter))
+    return rows
+
+
+def reference_id_ranges(conn, partitions):
+    ids = sorted(row[0] for row in conn.execute('SELECT student_id '
+                                                'FROM student;'))
+    size, bigger = divmod(len(ids), partitions)
+    rows, start = [], 0
+    for part in range(min(partitions, len(ids))):
+        end = start + size + (1 if part < bigger else 0)
+        rows.append((ids[start], ids[end - 1], end - start))
+        start = end
+    return rows
+
+
+def reference_changes(conn, since, limit):
+    entries = sorted(conn.execute('SELECT seq, table_name, row_id, '
+                                  'operation, data, changed '
+                                  'FROM change_log;'))
+    return [entry for entry in entries if entry[0] > since][:limit]
+
+
+def reference_grade_changes(conn, since, student_id):
+    classes = dict(conn.execute('SELECT class_id, name FROM class;'))
+    rows = []
+    for seq, operation, data in sorted(conn.execute(
+            "SELECT seq, operation, data FROM change_log "
+            "WHERE table_name = 'grade';")):
+        data = json.loads(data)
+        if seq > since and student_id in (None, data['student_id']):
+            rows.append((seq, data['student_id'], data['class_id'],
+                         classes.get(data['class_id']), data['grade'],
+                         operation))
+    return rows[:1000]
+
+
+def reference_user_by_id(conn, table, user_id):
+    column = 'faculty_id' if table == 'faculty' else 'student_id'
+    return [(username, password) for username, password, row_id
+            in conn.execute('SELECT username, password, %s FROM %s;'
+                            % (column, table)) if row_id == user_id]
+
+
+def cases(conn):
+    """
+    The read methods to check, each with the arguments to call it with.
+
+    :param conn: connection to the generated database, used to pick
+    arguments that match something
+    :return: list of (name, method, reference) where method(db) runs the
+    DBManager method and reference(conn) the reference implementation
+    """
+    usernames = sample(conn, 'SELECT username FROM student ORDER BY 1;')
+    faculty = sample(conn, 'SELECT DISTINCT username FROM faculty '
+                           'ORDER BY 1;')
+    class_ids = sample(conn, 'SELECT class_id FROM class ORDER BY 1;')
+    student_ids = sample(conn, 'SELECT student_id FROM student ORDER BY 1;')
+    last_seq = conn.execute('SELECT MAX(seq) FROM change_log;').fetchone()[0]
+
+    found = [
+        ('get_id', lambda db: db.get_id(),
+         lambda conn: reference_class_grade(conn, None)),
+        ('get_class_grade', lambda db: db.get_class_grade(),
+         lambda conn: reference_class_grade(conn, None)),
+        ('get_faculty', lambda db: db.get_faculty(),
+         lambda conn: reference_faculty(conn, None)),
+        ('get_gradebook', lambda db: db.get_gradebook(),
+         lambda conn: reference_gradebook(conn, None)),
+        ('get_grade_distribution', lambda db: db.get_grade_distribution(),
+         reference_grade_distribution),
+        ('read_class_grades', lambda db: db.read_class_grades(),
+         lambda conn: reference_class_grades(
+             conn, ('s_name', 'c_name', 'grade'), {})),
+    ]
+
+    def add(name, method, reference):
+        found.append((name, method, reference))
+
+    for username in usernames + ['nobody']:
+        add('get_class_grade(%s)' % username,
+            lambda db, u=username: db.get_class_grade(u),
+            lambda conn, u=username: reference_class_grade(conn, u))
+        add('iter_class_grade(%s) pages' % username,
+            lambda db, u=username: paged(db.iter_class_grade, u),
+            lambda conn, u=username: reference_student_grades(conn, u))
+        add('read_class_grades(username=%s)' % username,
+            lambda db, u=username: db.read_class_grades(
+                ['c_name', 'grade'], {'username': [u]}),
+            lambda conn, u=username: reference_class_grades(
+                conn, ('c_name', 'grade'), {'username': [u]}))
+    for username in faculty + ['nobody']:
+        add('get_faculty(%s)' % username,
+            lambda db, u=username: db.get_faculty(u),
+            lambda conn, u=username: reference_faculty(conn, u))
+        add('iter_faculty(%s) pages' % username,
+            lambda db, u=username: paged(db.iter_faculty, u),
+            lambda conn, u=username: reference_faculty(conn, u))
+        add('read_class_grades(faculty=%s)' % username,
+            lambda db, u=username: db.read_class_grades(
+                GRADE_COLUMNS, {'faculty': [u]}),
+            lambda conn, u=username: reference_class_grades(
+                conn, GRADE_COLUMNS, {'faculty': [u]}))
+    for class_id in class_ids:
+        add('get_gradebook(%d)' % class_id,
+            lambda db, c=class_id: db.get_gradebook(c),
+            lambda conn, c=class_id: reference_gradebook(conn, c))
+        add('read_class_grades(class_id=%d, grade=A,B+,P)' % class_id,
+            lambda db, c=class_id: db.read_class_grades(
+                ['username', 'grade'],
+                {'class_id': [c], 'grade': ['A', 'B+', 'P']}),
+            lambda conn, c=class_id: reference_class_grades(
+                conn, ('username', 'grade'),
+                {'class_id': [c], 'grade': ['A', 'B+', 'P']}))
+    for first_id, last_id in ((1, 1), (1, 40), (student_ids[-1], 10 ** 6)):
+        add('get_transcripts(%d, %d)' % (first_id, last_id),
+            lambda db, f=first_id, l=last_id: db.get_transcripts(f, l),
+            lambda conn, f=first_id, l=last_id: reference_transcripts(
+                conn, f, l))
+    for partitions in (1, 7, 10 ** 6):
+        add('get_student_id_ranges(%d)' % partitions,
+            lambda db, p=partitions: db.get_student_id_ranges(p),
+            lambda conn, p=partitions: reference_id_ranges(conn, p))
+    for since in (0, last_seq // 2, last_seq):
+        add('get_changes(%d)' % since,
+            lambda db, s=since: db.get_changes(s, 500),
+            lambda conn, s=since: reference_changes(conn, s, 500))
+        add('get_grade_changes(%d)' % since,
+            lambda db, s=since: db.get_grade_changes(s),
+            lambda conn, s=since: reference_grade_changes(conn, s, None))
+        add('get_grade_changes(%d, %d)' % (since, student_ids[0]),
+            lambda db, s=since: db.get_grade_changes(s, student_ids[0]),
+            lambda conn, s=since: reference_grade_changes(
+                conn, s, student_ids[0]))
+    for table in ('student', 'faculty'):
+        for user_id in (1, 10 ** 6):
+            add('get_user_by_id(%s, %d)' % (table, user_id),
+                lambda db, t=table, i=user_id: db.get_user_by_id(t, i),
+                lambda conn, t=table, i=user_id: reference_user_by_id(
+                    conn, t, i))
+    return found
+
+
+# running the check ----------------------------------------------------------
+
+def compare(path):
+    """
+    Runs every case against the database at path.
+
+    :return: list of (name, missing, unexpected) for the cases whose rows
+    differ: rows the reference returned that the method did not, and the
+    other way round, each as a Counter
+    """
+    app = Flask(__name__)
+    app.config['DATABASE'] = path
+    db = DBManager(app)
+    conn = sqlite3.connect(path)
+
+    mismatches = []
+    with app.app_context():
+        for name, method, reference in cases(conn):
+            expected = collections.Counter(rows_of(reference(conn)))
+            actual = collections.Counter(rows_of(method(db)))
+            if actual != expected:
+                mismatches.append((name, expected - actual,
+                                   actual - expected))
+    conn.close()
+    return mismatches
+
+
+def time_cases(path, repeats):
+    """
+    :return: dict of case name -> median milliseconds of the DBManager
+    method, each run once untimed first to warm the caches
+    """
+    app = Flask(__name__)
+    app.config['DATABASE'] = path
+    db = DBManager(app)
+    conn = sqlite3.connect(path)
+
+    timings = {}
+    with app.app_context():
+        for name, method, _ in cases(conn):
+            method(db)
+            runs = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                method(db)
+                runs.append(time.perf_counter() - start)
+            timings[name] = statistics.median(runs) * 1000
+    conn.close()
+    return timings
+
+
+def regressions(timings, baseline, max_regression):
+    """
+    :param timings: case name -> median ms now
+    :param baseline: case name -> median ms in the baseline
+    :param max_regression: percentage slowdown allowed
+    :return: list of (name, baseline ms, ms now) of the cases that are
+    slower than allowed; cases missing from the baseline are skipped
+    """
+    slower = []
+    for name, milliseconds in timings.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if milliseconds > before * (1 + max_regression / 100.0) \
+                and milliseconds - before > NOISE_MS:
+            slower.append((name, before, milliseconds))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Check the DBManager read methods against reference '
+                    'implementations and a latency baseline.')
+    parser.add_argument('--students', type=int, default=300,
+                        help='students in the generated database '
+                             '(default 300)')
+    parser.add_argument('--seeds', type=int, default=3,
+                        help='generated databases to compare rows on '
+                             '(default 3)')
+    parser.add_argument('--repeats', type=int, default=7,
+                        help='timed runs per method (default 7)')
+    parser.add_argument('--baseline',
+                        help='JSON file of median milliseconds per method')
+    parser.add_argument('--max-regression', type=float, default=25.0,
+                        help='percent slower than the baseline allowed '
+                             '(default 25)')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='write the timings to --baseline instead of '
+                             'checking them')
+    args = parser.parse_args(argv)
+
+    failed = False
+    directory = tempfile.mkdtemp()
+    try:
+        paths = []
+        for seed in range(1, args.seeds + 1):
+            path = os.path.join(directory, 'check%d.sqlite' % seed)
+            build_database(path, args.students, seed)
+            paths.append(path)
+
+            mismatches = compare(path)
+            for name, missing, unexpected in mismatches:
+                failed = True
+                print('MISMATCH %s (seed %d): %d rows missing, %d unexpected'
+                      % (name, seed, sum(missing.values()),
+                         sum(unexpected.values())))
+                for row in list(missing)[:3]:
+                    print('    missing    %r' % (row,))
+                for row in list(unexpected)[:3]:
+                    print('    unexpected %r' % (row,))
+        print('Compared rows on %d generated databases of %d students'
+              % (args.seeds, args.students))
+
+        timings = time_cases(paths[0], args.repeats)
+        baseline = {}
+        if args.baseline and os.path.exists(args.baseline) \
+                and not args.update_baseline:
+            with open(args.baseline) as baseline_file:
+                stored = json.load(baseline_file)
+            if stored['students'] == args.students:
+                baseline = stored['median_ms']
+            else:
+                print('The baseline was recorded with %d students; '
+                      'timings are not compared' % stored['students'])
+
+        slower = regressions(timings, baseline, args.max_regression)
+        slower_names = {name for name, _, _ in slower}
+        # a case the baseline does not know is not gated at all, so it
+        # fails the check until the baseline is updated
+        unknown = set(timings) - set(baseline) if baseline else set()
+        for name, milliseconds in sorted(timings.items()):
+            before = baseline.get(name)
+            print('%-48s %9.3f ms %s%s' % (
+                name, milliseconds,
+                '(baseline %.3f ms)' % before if before is not None else '',
+                '  REGRESSED' if name in slower_names else
+                '  NOT IN BASELINE' if name in unknown else ''))
+        if slower:
+            failed = True
+            print('%d methods are more than %.0f%% slower than the baseline'
+                  % (len(slower), args.max_regression))
+        if unknown:
+            failed = True
+            print('%d methods are not in the baseline; record them with '
+                  '--update-baseline' % len(unknown))
+
+        if args.update_baseline and args.baseline:
+            with open(args.baseline, 'w') as baseline_file:
+                json.dump({'students': args.students,
+                           'repeats': args.repeats,
+                           'median_ms': {name: round(milliseconds, 4)
+                                         for name, milliseconds
+                                         in sorted(timings.items())}},
+                          baseline_file, indent=1)
+                baseline_file.write('\n')
+            print('Wrote the baseline to %s' % args.baseline)
+    finally:
+        for name in os.listdir(directory):
+            os.unlink(os.path.join(directory, name))
+        os.rmdir(directory)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,375 @@
+"""
+Background jobs.
+
+Work that takes seconds or minutes (bulk roster imports, gradebook exports,
+grade statistics) is handed to a JobRunner instead of being done inside a
+request. The request records a job in the job table and returns its id
+straight away; a small pool of threads in the same process runs the job
+and writes its progress and result back to the table, where
+GET /api/jobs/<id> reads them.
+
+Settings:
+
+JOB_WORKERS      - threads running jobs in each process (default 2)
+JOB_MAX_PENDING  - jobs a process accepts before submit() raises
+                   JobQueueFull (default 100)
+JOB_ADMIN_TOKEN  - secret admins send in the X-Woodle-Jobs header to start
+                   the admin-only kinds (backup, maintenance) from the API;
+                   without it they can only be started from the command
+                   line
+
+Job functions are registered with @job_kind('name') and are called as
+fn(job, **parameters) inside an app context, where job.progress() reports
+how far along they are. Their return value must be JSON-serializable; it
+is stored as the job's result.
+
+Jobs live in the process that accepted them. If that process exits first
+(e.g. a 'flask serve' worker is restarted), the job is reported as failed
+the next time its status is read.
+"""
+import hmac
+import inspect
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import request
+
+from project_backup import backup_database, backup_settings, prune_backups
+from project_passwords import hash_password
+
+# kind name -> job function
+JOB_KINDS = {}
+
+JOB_ADMIN_HEADER = 'X-Woodle-Jobs'
+
+# rows inserted per transaction by import_roster
+IMPORT_CHUNK_SIZE = 500
+
+
+class JobQueueFull(Exception):
+    """
+    Raised by JobRunner.submit() when the process already has
+    JOB_MAX_PENDING jobs queued or running.
+    """
+
+
+def job_kind(name, recorded=None, admin_only=False):
+    """
+    Decorator registering a function as the job kind called name.
+
+    :param recorded: optional function(parameters) returning the copy of
+    the parameters stored in the job table, e.g. without passwords; the
+    job itself still gets the parameters as submitted
+    :param admin_only: if True, API clients need JOB_ADMIN_TOKEN to start
+    the job
+    """
+    def register(function):
+        JOB_KINDS[name] = function
+        function.recorded_parameters = recorded
+        function.admin_only = admin_only
+        return function
+    return register
+
+
+class Job:
+    """
+    Handle given to a running job function.
+    """
+
+    # seconds between progress writes, so a tight loop calling progress()
+    # does not turn into a stream of UPDATEs
+    PROGRESS_INTERVAL = 0.5
+
+    def __init__(self, runner, job_id):
+        self.runner = runner
+        self.job_id = job_id
+        self.last_progress = 0.0
+
+    def progress(self, fraction, message=None):
+        """
+        Records how much of the job is done.
+
+        :param fraction: 0.0 to 1.0
+        :param message: optional short description of the current step
+        """
+        now = time.monotonic()
+        if now - self.last_progress < self.PROGRESS_INTERVAL:
+            return
+        self.last_progress = now
+        self.runner.db.update_job(self.job_id,
+                                  progress=round(min(fraction, 1.0), 4),
+                                  message=message)
+
+
+class JobRunner:
+    """
+    Flask extension running registered job functions on a bounded thread
+    pool, with their state kept in the job table.
+    """
+
+    def __init__(self, app=None, db=None):
+        """
+        :param app: Flask app to install on; init_app() can be called later
+        :param db: DBManager holding the job table
+        """
+        self.app = None
+        self.db = db
+        self.workers = 2
+        self.max_pending = 100
+        self.token = None
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.executor = None
+        self.executor_pid = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = int(app.config.get('JOB_WORKERS', 2))
+        self.max_pending = int(app.config.get('JOB_MAX_PENDING', 100))
+        self.token = app.config.get('JOB_ADMIN_TOKEN')
+        app.extensions['job_runner'] = self
+
+    def requested_by_admin(self):
+        sent = request.headers.get(JOB_ADMIN_HEADER)
+        return bool(self.token and sent
+                    and hmac.compare_digest(sent, self.token))
+
+    def submit(self, kind, parameters=None):
+        """
+        Records a job and queues it. Must be called inside an app context.
+
+        :param kind: name of a registered job kind
+        :param parameters: dict of keyword arguments for the job function
+        :return: the job_id
+        :raise ValueError: if kind is unknown or parameters do not fit it
+        :raise JobQueueFull: if this process has too many jobs already
+        """
+        parameters = parameters or {}
+        function = JOB_KINDS.get(kind)
+        if function is None:
+            raise ValueError('unknown job kind %r' % kind)
+        try:
+            inspect.signature(function).bind(None, **parameters)
+        except TypeError as error:
+            raise ValueError('bad parameters for %s: %s' % (kind, error))
+
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise JobQueueFull()
+            self.pending += 1
+
+        recorded = parameters
+        if function.recorded_parameters is not None:
+            recorded = function.recorded_parameters(parameters)
+
+        try:
+            job_id = self.db.create_job(kind, recorded, os.getpid())
+            # the job runs against the database of the tenant submitting it
+            tenant = (self.db.current_tenant(), self.db.database_path())
+            self.get_executor().submit(self.run, job_id, function,
+                                       parameters, tenant)
+        except Exception:
+            with self.lock:
+                self.pending -= 1
+            raise
+        return job_id
+
+    def get_executor(self):
+        """
+        :return: this process's thread pool; a process forked from one that
+        had a pool gets its own, since threads do not survive a fork
+        """
+        with self.lock:
+            if self.executor is None or self.executor_pid != os.getpid():
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix='job')
+                self.executor_pid = os.getpid()
+            return self.executor
+
+    def run(self, job_id, function, parameters, tenant=(None, None)):
+        """
+        Runs one job in a pool thread, in its own app context and so on its
+        own database connection.
+
+        :param tenant: (tenant name, database file) the job was submitted
+        for; see project_tenants.py
+        """
+        try:
+            with self.app.app_context():
+                if tenant[1] is not None:
+                    self.db.use_tenant(*tenant)
+                self.db.update_job(job_id, status='running',
+                                   started=time.time())
+                try:
+                    result = function(Job(self, job_id), **parameters)
+                except Exception as error:
+                    self.app.logger.exception('job %d failed', job_id)
+                    self.db.update_job(job_id, status='failed',
+                                       error='%s: %s' % (
+                                           type(error).__name__, error),
+                                       finished=time.time())
+                else:
+                    self.db.update_job(job_id, status='done', progress=1.0,
+                                       message=None, result=result,
+                                       finished=time.time())
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def status(self, job_id, record=True):
+        """
+        :param record: whether a job whose process has exited is marked
+        failed in the job table, or only in the returned dict (a read that
+        must not commit, e.g. inside a batch's read snapshot)
+        :return: the job as a dict (see DBManager.get_job), or None
+        """
+        job = self.db.get_job(job_id)
+        if job is None or job['status'] not in ('queued', 'running'):
+            return job
+
+        if job['worker_pid'] != os.getpid() \
+                and not _process_alive(job['worker_pid']):
+            job.update(status='failed', finished=time.time(),
+                       error='the process running the job exited')
+            if record:
+                self.db.update_job(job_id, status=job['status'],
+                                   error=job['error'],
+                                   finished=job['finished'])
+        return job
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # exists, but belongs to someone else
+    return True
+
+
+def roster_without_passwords(parameters):
+    """
+    :return: import_roster parameters with the passwords left out, so
+    plain passwords never reach the job table
+    """
+    students = parameters.get('students')
+    if not isinstance(students, list):
+        return parameters  # the job fails on it without storing anything
+    return dict(parameters, students=[
+        {key: value for key, value in student.items() if key != 'password'}
+        if isinstance(student, dict) else student for student in students])
+
+
+@job_kind('import_roster', recorded=roster_without_passwords)
+def import_roster(job, class_id, students):
+    """
+    Enrolls a list of new students in a class.
+
+    :param class_id: class to enroll them in
+    :param students: list of {"name", "username", "password"} objects
+    :return: {"class_id": .., "imported": number of students}
+    """
+    for student in students:
+        if not isinstance(student, dict) or not all(
+                isinstance(student.get(field), str)
+                for field in ('name', 'username', 'password')):
+            raise ValueError('every student needs a name, username and '
+                             'password')
+
+    # passwords are hashed here on the job's thread rather than on the
+    # login pool, which a large roster would keep busy for minutes
+    hasher = job.runner.app.extensions.get('password_hasher')
+
+    imported = 0
+    for start in range(0, len(students), IMPORT_CHUNK_SIZE):
+        chunk = students[start:start + IMPORT_CHUNK_SIZE]
+        if hasher is not None:
+            chunk = [dict(student, password=hash_password(
+                student['password'], hasher.algorithm, hasher.cost))
+                for student in chunk]
+        imported += job.runner.db.insert_students(class_id, chunk)
+        job.progress(imported / len(students),
+                     'imported %d of %d' % (imported, len(students)))
+
+    return {'class_id': class_id, 'imported': imported}
+
+
+@job_kind('export_gradebook')
+def export_gradebook(job, class_id=None):
+    """
+    Exports every grade, or every grade of one class.
+
+    :return: {"columns": [...], "rows": [[...], ...]}
+    """
+    gradebook = job.runner.db.get_gradebook(class_id)
+    return {'columns': list(gradebook.columns), 'rows': gradebook.rows}
+
+
+@job_kind('grade_statistics')
+def grade_statistics(job):
+    """
+    Counts how many of each grade every class gave.
+
+    :return: list of {"class_id", "c_name", "grades": {grade: count}}
+    """
+    classes = {}
+    for row in job.runner.db.get_grade_distribution():
+        entry = classes.setdefault(row['class_id'], {
+            'class_id': row['class_id'], 'c_name': row['c_name'],
+            'grades': {}})
+        entry['grades'][row['grade']] = row['students']
+    return list(classes.values())
+
+
+@job_kind('compact_change_log')
+def compact_change_log(job, retention=None):
+    """
+    Compacts the change log behind GET /api/changes.
+
+    :param retention: seconds of full history to keep (default
+    CHANGES_RETENTION)
+    :return: {"superseded", "deletes", "horizon"}
+    """
+    return job.runner.app.extensions['change_feed'].compact(retention)
+
+
+@job_kind('backup', admin_only=True)
+def backup(job, keep=None):
+    """
+    Backs up the live database and prunes old backups; see
+    project_backup.py.
+
+    :param keep: backups to keep (default BACKUP_KEEP)
+    :return: {"path", "pages", "bytes", "seconds", "mb_per_second",
+    "restarts", "single_step", "check", "removed"}
+    """
+    app = job.runner.app
+    settings = backup_settings(app)
+    tenant = job.runner.db.current_tenant()
+    if tenant is not None:  # each tenant's backups are pruned on their own
+        settings['directory'] = os.path.join(settings['directory'], tenant)
+    result = backup_database(
+        job.runner.db.database_path(), settings['directory'],
+        settings['pages'], settings['pause'], settings['max_restarts'],
+        lambda copied, total: job.progress(copied / total if total else 1.0,
+                                           'copied %d of %d pages'
+                                           % (copied, total)))
+    result['removed'] = prune_backups(
+        settings['directory'], keep if keep is not None else settings['keep'])
+    return result
+
+
+@job_kind('maintenance', admin_only=True)
+def maintenance(job, force=False):
+    """
+    Runs a database maintenance round; see project_maintenance.py.
+
+    :param force: run every task, whatever the thresholds say
+    :return: {"tasks", "before", "after"}
+    """
+    return job.runner.app.extensions['maintenance'].run(force)
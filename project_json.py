@@ -0,0 +1,132 @@
+"""
+JSON encoding for the Flask apps.
+
+DBManager read methods return RowSet objects (a column tuple plus a list of
+row tuples). RowSetJSONProvider teaches jsonify() to encode a RowSet
+straight to bytes without turning every row into a dictionary first.
+
+Two output shapes are supported:
+
+records (default) - the list of objects the API has always returned:
+    [{"s_name": "Micheas", "c_name": "CS-232", "grade": "A"}, ...]
+
+columns - sent when the request has ?format=columns; the column names are
+written once and each row is a plain array:
+    {"columns": ["s_name", "c_name", "grade"], "rows": [["Micheas", ...]]}
+
+A RowSet response is always compact, also in debug mode; set
+app.json.compact = False to have records indented instead.
+
+orjson is used when it is installed. Without it, the standard library json
+module is used and the records shape is built from a per-RowSet template
+so the column names are only encoded once.
+"""
+import json
+from flask import has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from project_db import Record, RowSet
+
+try:
+    import orjson
+except ImportError:  # orjson is optional
+    orjson = None
+
+
+ROWSET_FORMATS = ('records', 'columns')
+
+# C accelerated value encoder used by the standard library fallback
+_encode_value = json.JSONEncoder(ensure_ascii=False,
+                                 separators=(',', ':')).encode
+
+
+def encode_rowset(rowset, rowset_format='records'):
+    """
+    Encodes a RowSet as UTF-8 JSON bytes.
+
+    :param rowset: the RowSet to encode
+    :param rowset_format: 'records' for a list of objects, 'columns' for a
+    column list plus an array of row arrays
+    :return: the encoded bytes
+    """
+    columns = rowset.columns
+    rows = rowset.rows
+
+    if rowset_format == 'columns':
+        if orjson is not None:
+            return orjson.dumps({'columns': columns, 'rows': rows})
+        return json.dumps({'columns': columns, 'rows': rows},
+                          ensure_ascii=False,
+                          separators=(',', ':')).encode('utf-8')
+
+    if orjson is not None:
+        # orjson encodes the short-lived dicts in C faster than any
+        # template we can splice together in Python
+        return orjson.dumps([dict(zip(columns, values)) for values in rows])
+
+    # one template per RowSet, e.g. '{"s_name":%s,"c_name":%s}', so the keys
+    # are encoded once and only the values are encoded per row
+    template = '{' + ','.join(_encode_value(name).replace('%', '%%') + ':%s'
+                              for name in columns) + '}'
+    body = ','.join(template % tuple(map(_encode_value, values))
+                    for values in rows)
+    return ('[' + body + ']').encode('utf-8')
+
+
+class RowSetJSONProvider(DefaultJSONProvider):
+    """
+    A Flask JSON provider that understands RowSet and Record objects.
+
+    Install it on an app with:
+        app.json = RowSetJSONProvider(app)
+    """
+
+    @staticmethod
+    def default(o):
+        """
+        Fallback for objects json cannot encode on its own. A RowSet nested
+        inside some other structure ends up here.
+        """
+        if isinstance(o, RowSet):
+            return o.as_dicts()
+        if isinstance(o, Record):
+            return dict(o)
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        """
+        Serialize data as JSON to a string. RowSets are encoded directly.
+        """
+        if isinstance(obj, RowSet) and not kwargs.get('indent'):
+            return encode_rowset(obj, self._rowset_format()).decode('utf-8')
+        return super().dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        """
+        Builds a JSON response. A lone RowSet is encoded straight to bytes;
+        anything else goes through the default provider.
+        """
+        obj = self._prepare_response_obj(args, kwargs)
+
+        if not isinstance(obj, RowSet):
+            return super().response(*args, **kwargs)
+
+        # RowSets are sent compact even in debug mode, which create_app()
+        # turns on; indented records are only built when an app opts in
+        # with app.json.compact = False
+        rowset_format = self._rowset_format()
+        if self.compact is False and rowset_format == 'records':
+            return super().response(*args, **kwargs)
+
+        body = encode_rowset(obj, rowset_format)
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
+
+    @staticmethod
+    def _rowset_format():
+        """
+        :return: the RowSet shape asked for by the current request
+        """
+        if has_request_context():
+            requested = request.args.get('format', 'records')
+            if requested in ROWSET_FORMATS:
+                return requested
+        return 'records'
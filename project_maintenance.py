@@ -0,0 +1,247 @@
+"""
+Automatic database maintenance.
+
+Bulk registrations and grade loads leave the planner statistics stale and
+free pages behind, and nothing else ever refreshes or reclaims them. A
+Maintenance extension does, off the request path:
+
+- ANALYZE, then PRAGMA optimize, for every table written to more than
+  MAINTENANCE_ANALYZE_WRITES times since it was last analyzed. Writes are
+  counted from the change log (see project_changes.py), so the count covers
+  every process and survives restarts.
+- PRAGMA incremental_vacuum when free pages make up more than
+  MAINTENANCE_VACUUM_FRACTION of the file. This needs auto_vacuum to be
+  incremental; init_db.sql sets it for new databases, and 'flask maintain
+  --vacuum' converts an existing one.
+- PRAGMA wal_checkpoint(TRUNCATE) when the database is in WAL mode and the
+  log has grown past MAINTENANCE_WAL_BYTES, or pages were vacuumed (they
+  only leave the file once checkpointed).
+- Change log compaction every MAINTENANCE_COMPACT_INTERVAL seconds.
+
+Every worker process runs a scheduler thread that wakes up every
+MAINTENANCE_INTERVAL seconds, but a round is claimed in the maintenance
+table first, so only one process runs it. A round only starts when the
+site is quiet: fewer than MAINTENANCE_QUIET_WRITES writes in the last
+minute and, if MAINTENANCE_HOURS is set, within those hours.
+
+Each round measures the file size, free pages and the time a few reporting
+queries take before and after, and stores them in the maintenance table
+('flask maintain' prints them).
+
+Settings:
+
+MAINTENANCE_INTERVAL          - seconds between rounds; 0 turns the
+                                scheduler off (default 600; off when
+                                TESTING)
+MAINTENANCE_HOURS             - (first, last) local hours rounds may start
+                                in, e.g. (1, 5); None for any time
+                                (default None)
+MAINTENANCE_QUIET_WRITES      - writes in the last minute above which a
+                                round waits (default 20)
+MAINTENANCE_ANALYZE_WRITES    - writes to a table before it is analyzed
+                                again (default 1000)
+MAINTENANCE_VACUUM_FRACTION   - share of free pages that triggers an
+                                incremental vacuum (default 0.1)
+MAINTENANCE_VACUUM_STEP       - pages freed per transaction (default 2000)
+MAINTENANCE_WAL_BYTES         - WAL size that triggers a checkpoint
+                                (default 16 MB)
+MAINTENANCE_COMPACT_INTERVAL  - seconds between change log compactions
+                                (default 3600)
+"""
+import datetime
+import os
+import sqlite3
+import threading
+import time
+
+# tables whose writes are counted in the change log
+MAINTAINED_TABLES = ('class', 'student', 'faculty', 'grade')
+
+# reporting queries timed before and after a round, by name
+PROBES = {
+    'grade_distribution': lambda db: db.get_grade_distribution(),
+    'gradebook': lambda db: db.get_gradebook(),
+    'transcripts': lambda db: db.get_transcripts(1, 100),
+}
+
+
+class Maintenance:
+    """
+    Flask extension running database maintenance in the background.
+    """
+
+    def __init__(self, app=None, db=None):
+        """
+        :param app: Flask app to read the settings from
+        :param db: DBManager of the database to maintain
+        """
+        self.app = None
+        self.db = db
+        self.interval = 600.0
+        self.hours = None
+        self.quiet_writes = 20
+        self.analyze_writes = 1000
+        self.vacuum_fraction = 0.1
+        self.vacuum_step = 2000
+        self.wal_bytes = 16 * 1024 * 1024
+        self.compact_interval = 3600.0
+        self.lock = threading.Lock()
+        self.scheduler_pid = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = float(app.config.get(
+            'MAINTENANCE_INTERVAL', 0 if app.testing else 600))
+        self.hours = app.config.get('MAINTENANCE_HOURS')
+        self.quiet_writes = int(app.config.get('MAINTENANCE_QUIET_WRITES',
+                                               20))
+        self.analyze_writes = int(app.config.get(
+            'MAINTENANCE_ANALYZE_WRITES', 1000))
+        self.vacuum_fraction = float(app.config.get(
+            'MAINTENANCE_VACUUM_FRACTION', 0.1))
+        self.vacuum_step = int(app.config.get('MAINTENANCE_VACUUM_STEP',
+                                              2000))
+        self.wal_bytes = int(app.config.get('MAINTENANCE_WAL_BYTES',
+                                            16 * 1024 * 1024))
+        self.compact_interval = float(app.config.get(
+            'MAINTENANCE_COMPACT_INTERVAL', 3600))
+        if self.interval > 0:
+            app.before_request(self.start_scheduler)
+        app.extensions['maintenance'] = self
+
+    def start_scheduler(self):
+        """
+        Starts this process's scheduler thread, on the first request it
+        serves; threads do not survive a fork, so every worker starts one.
+        """
+        if self.scheduler_pid == os.getpid():
+            return
+        with self.lock:
+            if self.scheduler_pid != os.getpid():
+                self.scheduler_pid = os.getpid()
+                threading.Thread(target=self.schedule, daemon=True,
+                                 name='maintenance').start()
+
+    def schedule(self):
+        """
+        Body of the scheduler thread. Never returns.
+        """
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    if self.in_window() and self.is_quiet() and \
+                            self.db.claim_maintenance('round',
+                                                      self.interval * 0.9):
+                        self.run()
+            except sqlite3.Error:
+                # e.g. a long write holding the lock; try next time
+                self.app.logger.warning('maintenance round failed',
+                                        exc_info=True)
+
+    def in_window(self):
+        """
+        :return: True if the local time is within MAINTENANCE_HOURS
+        """
+        if not self.hours:
+            return True
+        first, last = self.hours
+        hour = datetime.datetime.now().hour
+        if first <= last:
+            return first <= hour <= last
+        return hour >= first or hour <= last  # e.g. (22, 4)
+
+    def is_quiet(self):
+        """
+        :return: True if the last minute saw fewer than
+        MAINTENANCE_QUIET_WRITES writes. Must be called inside an app
+        context.
+        """
+        changed = self.db.get_change_time(self.quiet_writes)
+        return changed is None or changed < time.time() - 60
+
+    def run(self, force=False):
+        """
+        Runs the maintenance tasks that are due. Must be called inside an
+        app context.
+
+        :param force: run every task whatever the thresholds say
+        :return: dict with tasks (what was done) and before and after (see
+        measure())
+        """
+        before = self.measure()
+        storage = before['storage']
+        tasks = {}
+
+        last_seq = self.db.get_last_change()
+        writes = self.db.get_table_writes(MAINTAINED_TABLES)
+        stale = [table for table, count in writes.items()
+                 if force or count >= self.analyze_writes]
+        if stale:
+            self.db.analyze_tables(stale)
+            for table in stale:
+                self.db.record_maintenance('analyze:' + table, last_seq,
+                                           {'writes': writes[table]})
+            tasks['analyze'] = {table: writes[table] for table in stale}
+
+        free = storage['freelist_count']
+        if free and (force or free >= self.vacuum_fraction
+                     * storage['page_count']):
+            if storage['auto_vacuum'] == 2:
+                freed = 0
+                while True:
+                    step = self.db.incremental_vacuum(self.vacuum_step)
+                    freed += step
+                    if step < self.vacuum_step:
+                        break
+                tasks['vacuum'] = {'freed_pages': freed}
+            else:
+                tasks['vacuum'] = {'skipped': 'auto_vacuum is not '
+                                              'incremental; run flask '
+                                              'maintain --vacuum'}
+
+        # in WAL mode the file only shrinks when the vacuum is checkpointed
+        if storage['journal_mode'] == 'wal' and (
+                force or before['wal_bytes'] >= self.wal_bytes
+                or tasks.get('vacuum', {}).get('freed_pages')):
+            tasks['checkpoint'] = self.db.checkpoint_wal()
+
+        if self.db.claim_maintenance('compact_changes',
+                                     0 if force else self.compact_interval):
+            tasks['compact_changes'] = \
+                self.app.extensions['change_feed'].compact()
+
+        result = {'tasks': tasks, 'before': before, 'after': self.measure()}
+        self.db.record_maintenance('round', result=result)
+        return result
+
+    def measure(self):
+        """
+        :return: dict of storage (see DBManager.get_storage_stats),
+        file_bytes, wal_bytes and probes (query name -> best of three
+        timings in ms)
+        """
+        database = self.db.database_path()
+        probes = {}
+        for name, probe in PROBES.items():
+            timings = []
+            for _ in range(3):
+                start = time.perf_counter()
+                probe(self.db)
+                timings.append(time.perf_counter() - start)
+            probes[name] = round(min(timings) * 1000, 3)
+
+        return {'storage': self.db.get_storage_stats(),
+                'file_bytes': _file_size(database),
+                'wal_bytes': _file_size(database + '-wal'),
+                'probes': probes}
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
@@ -0,0 +1,264 @@
+"""
+Memory instrumentation with tracemalloc.
+
+Off unless one of these is configured:
+
+MEMORY_TOKEN         - secret admins send in the X-Woodle-Memory header to
+                       use GET /api/admin/memory and
+                       POST/DELETE /api/admin/memory/snapshots
+MEMORY_SAMPLE_RATE   - fraction of requests whose peak allocation is
+                       recorded per route (default 0)
+
+Settings:
+
+MEMORY_FRAMES        - frames kept per traced allocation while snapshots
+                       are being taken (default 10); more frames show who
+                       called the allocating line, at more overhead
+MEMORY_TOP           - allocation sites listed per report (default 25)
+
+Finding a leak: take a snapshot, let the worker serve traffic for a while,
+take another. The second report lists the allocation sites that grew in
+between, largest first. Tracing slows every allocation of the process, so
+delete the snapshots (which stops tracing) when done:
+
+    curl -X POST -H 'X-Woodle-Memory: <MEMORY_TOKEN>' \\
+        http://host/api/admin/memory/snapshots
+    curl -X POST -H 'X-Woodle-Memory: <MEMORY_TOKEN>' \\
+        'http://host/api/admin/memory/snapshots?group_by=traceback'
+    curl -X DELETE -H 'X-Woodle-Memory: <MEMORY_TOKEN>' \\
+        http://host/api/admin/memory/snapshots
+
+Sampled requests are traced (with one frame, unless snapshots are being
+taken) only while they run. tracemalloc traces the whole process, so
+allocations of other threads during the request count towards it too, and
+only one request is measured at a time. The peak is the most memory the
+request had allocated at once; what it kept is what was still allocated
+when it finished, e.g. cached users or results. A route whose kept bytes
+stay above zero request after request is growing the worker.
+
+Each worker process traces its own memory; the reports come from whichever
+worker served the admin request.
+"""
+import hmac
+import os
+import random
+import sys
+import threading
+import tracemalloc
+from flask import g, request
+
+MEMORY_HEADER = 'X-Woodle-Memory'
+
+# groupings of allocation sites a report can use
+GROUP_BY = ('lineno', 'traceback', 'filename')
+
+# allocations made by the tracing itself or while importing
+IGNORED_FILES = (tracemalloc.__file__, __file__,
+                 '<frozen importlib._bootstrap>',
+                 '<frozen importlib._bootstrap_external>', '<unknown>')
+
+
+class MemoryProfiler:
+    """
+    Flask extension that takes and compares tracemalloc snapshots on
+    demand and records the peak allocation of sampled requests per route.
+    """
+
+    def __init__(self, app=None):
+        """
+        :param app: Flask app to install on; init_app() can be called later
+        """
+        self.token = None
+        self.sample_rate = 0.0
+        self.frames = 10
+        self.top = 25
+        self.baseline = None
+        self.previous = None
+        self.routes = {}
+
+        # tracemalloc is process wide: starting, stopping and resetting its
+        # peak is done by one request or admin call at a time
+        self.lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.token = app.config.get('MEMORY_TOKEN')
+        self.sample_rate = float(app.config.get('MEMORY_SAMPLE_RATE', 0))
+        self.frames = int(app.config.get('MEMORY_FRAMES', 10))
+        self.top = int(app.config.get('MEMORY_TOP', 25))
+
+        app.extensions['memory_profiler'] = self
+        if self.sample_rate > 0:
+            app.before_request(self.start_measure)
+            app.teardown_request(self.finish_measure)
+
+    def requested_by_admin(self):
+        sent = request.headers.get(MEMORY_HEADER)
+        return bool(self.token and sent
+                    and hmac.compare_digest(sent, self.token))
+
+    def start_measure(self):
+        """
+        before_request hook; starts measuring if this request is sampled.
+        """
+        if random.random() >= self.sample_rate \
+                or not self.lock.acquire(blocking=False):
+            return
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(1)
+        tracemalloc.reset_peak()
+        g.memory_measure = {'request': request._get_current_object(),
+                            'started_tracing': started_tracing,
+                            'start_bytes': tracemalloc.get_traced_memory()[0]}
+
+    def finish_measure(self, exception=None):
+        """
+        teardown hook; records the peak and kept bytes of a sampled request.
+        """
+        # requests dispatched inside this one (POST /api/batch) share g
+        measure = g.get('memory_measure')
+        if measure is None \
+                or measure['request'] is not request._get_current_object():
+            return
+        g.pop('memory_measure')
+
+        current, peak = tracemalloc.get_traced_memory()
+        if measure['started_tracing']:
+            tracemalloc.stop()
+        self.lock.release()
+
+        route = '%s %s' % (request.method, request.url_rule.rule
+                           if request.url_rule else '<unmatched>')
+        stats = self.routes.setdefault(route, {
+            'route': route, 'requests': 0, 'peak_bytes': 0,
+            'max_peak_bytes': 0, 'kept_bytes': 0})
+        stats['requests'] += 1
+        stats['peak_bytes'] += peak - measure['start_bytes']
+        stats['max_peak_bytes'] = max(stats['max_peak_bytes'],
+                                      peak - measure['start_bytes'])
+        stats['kept_bytes'] += current - measure['start_bytes']
+
+    def route_stats(self):
+        """
+        :return: list of dicts, one per sampled route, largest peak first:
+        route, requests, mean_peak_kib, max_peak_kib, mean_kept_kib
+        """
+        rows = [{'route': stats['route'], 'requests': stats['requests'],
+                 'mean_peak_kib': round(stats['peak_bytes']
+                                        / stats['requests'] / 1024, 1),
+                 'max_peak_kib': round(stats['max_peak_bytes'] / 1024, 1),
+                 'mean_kept_kib': round(stats['kept_bytes']
+                                        / stats['requests'] / 1024, 1)}
+                for stats in list(self.routes.values())]
+        rows.sort(key=lambda row: row['max_peak_kib'], reverse=True)
+        return rows
+
+    def status(self):
+        """
+        :return: dict describing the tracing and the memory of this worker
+        """
+        tracing = tracemalloc.is_tracing()
+        traced, peak = tracemalloc.get_traced_memory()
+        return {'pid': os.getpid(),
+                'rss_kib': _rss_kib(),
+                'tracing': tracing,
+                'frames': tracemalloc.get_traceback_limit()
+                if tracing else None,
+                'traced_kib': round(traced / 1024, 1),
+                'traced_peak_kib': round(peak / 1024, 1),
+                'tracing_overhead_kib': round(
+                    tracemalloc.get_tracemalloc_memory() / 1024, 1),
+                'snapshots': self.baseline is not None,
+                'routes': self.route_stats()}
+
+    def snapshot(self, group_by='lineno', top=None, frames=None):
+        """
+        Takes a snapshot, starting tracing first if it is off; the first
+        snapshot after that is the baseline of the later ones.
+
+        :param group_by: one of GROUP_BY
+        :param top: allocation sites to list (default MEMORY_TOP)
+        :param frames: frames kept per allocation if tracing is started
+        :return: dict with the largest allocation sites now ('top') and
+        the sites that changed most since the previous snapshot
+        ('since_previous') and since the first ('since_baseline')
+        """
+        if group_by not in GROUP_BY:
+            raise ValueError('group_by must be one of %s'
+                             % ', '.join(GROUP_BY))
+        top = top or self.top
+
+        with self.lock:
+            # a sampled request traces only while it holds the lock, so
+            # tracing is either off here or kept on by earlier snapshots
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames or self.frames)
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, name) for name in IGNORED_FILES])
+
+        report = {'status': self.status(),
+                  'top': [_statistic(statistic) for statistic in
+                          snapshot.statistics(group_by)[:top]]}
+        for name, before in (('since_previous', self.previous),
+                             ('since_baseline', self.baseline)):
+            if before is not None:
+                report[name] = [_statistic(statistic) for statistic in
+                                snapshot.compare_to(before, group_by)[:top]]
+
+        if self.baseline is None:
+            self.baseline = snapshot
+        self.previous = snapshot
+        report['status']['snapshots'] = True
+        return report
+
+    def stop(self):
+        """
+        Stops tracing and drops the snapshots.
+        """
+        with self.lock:
+            tracemalloc.stop()
+            self.baseline = self.previous = None
+
+
+def _statistic(statistic):
+    """
+    :return: a tracemalloc Statistic or StatisticDiff as a dict
+    """
+    frames = [_frame(frame) for frame in statistic.traceback]
+    entry = {'site': frames[0], 'kib': round(statistic.size / 1024, 1),
+             'count': statistic.count}
+    if len(frames) > 1:
+        entry['traceback'] = frames
+    if isinstance(statistic, tracemalloc.StatisticDiff):
+        entry['kib_diff'] = round(statistic.size_diff / 1024, 1)
+        entry['count_diff'] = statistic.count_diff
+    return entry
+
+
+def _frame(frame):
+    """
+    :return: 'file:line' with the file relative to its sys.path entry
+    """
+    filename = frame.filename
+    for directory in sorted(sys.path, key=len, reverse=True):
+        if directory and filename.startswith(directory + os.sep):
+            filename = filename[len(directory) + 1:]
+            break
+    return '%s:%d' % (filename, frame.lineno)
+
+
+def _rss_kib():
+    """
+    :return: resident memory of this process in KiB, or None where
+    /proc is not available
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') // 1024
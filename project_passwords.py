@@ -0,0 +1,295 @@
+"""
+Password hashing.
+
+Passwords are stored as salted PBKDF2-SHA256 or scrypt hashes:
+
+    pbkdf2_sha256$<iterations>$<salt>$<hash>
+    scrypt$<n>$<salt>$<hash>
+
+with the salt and hash in unpadded base64 (scrypt uses r=8 and p=1). Rows
+written before hashing hold the password itself; they are still accepted,
+and hashed the first time their user logs in. So is any hash made with a
+cost well below the current one, or with the other algorithm.
+
+The cost is picked when the app starts: a short calibration run measures
+this machine and chooses the cost at which one verification takes about
+PASSWORD_VERIFY_SECONDS. The cost is stored in each hash, so hashes made on
+other machines or with an older cost keep working.
+
+Hashing and verifying run on a small thread pool, not on the request
+thread. hashlib releases the GIL while it works, so the pool uses up to
+PASSWORD_WORKERS cores; a login storm queues for the pool while page
+requests carry on. When PASSWORD_MAX_PENDING logins are already waiting,
+PasswordPoolFull is raised and the login gets a 503.
+
+Settings:
+
+PASSWORD_ALGORITHM       - pbkdf2_sha256 (default) or scrypt
+PASSWORD_VERIFY_SECONDS  - target time of one verification (default 0.05)
+PASSWORD_COST            - iterations (pbkdf2_sha256) or n (scrypt) to use
+                           instead of calibrating, e.g. low in tests
+PASSWORD_WORKERS         - pool threads per process (default 2); 0 hashes
+                           on the calling thread
+PASSWORD_MAX_PENDING     - hashes queued or running before PasswordPoolFull
+                           (default 32)
+"""
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ALGORITHMS = ('pbkdf2_sha256', 'scrypt')
+
+# costs calibration never goes below, whatever the machine
+MIN_COST = {'pbkdf2_sha256': 100000, 'scrypt': 2 ** 14}
+
+# costs the calibration run measures at
+PROBE_COST = {'pbkdf2_sha256': 10000, 'scrypt': 2 ** 12}
+
+# block size and parallelism of scrypt; memory use is 128 * r * n bytes
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+# a stored hash is redone at login when its cost is below this fraction of
+# the current cost; slack so workers calibrating a little differently do
+# not keep rehashing each other's hashes
+REHASH_BELOW = 0.8
+
+
+class PasswordPoolFull(Exception):
+    """
+    Raised by PasswordHasher when PASSWORD_MAX_PENDING hashes are already
+    queued or running in this process.
+    """
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii').rstrip('=')
+
+
+def _unb64(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def _derive(algorithm, password, salt, cost):
+    """
+    :return: the hash of password as bytes
+    """
+    if algorithm == 'scrypt':
+        return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=cost,
+                              r=SCRYPT_R, p=SCRYPT_P,
+                              maxmem=256 * SCRYPT_R * cost, dklen=32)
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt,
+                               cost)
+
+
+def hash_password(password, algorithm='pbkdf2_sha256', cost=None):
+    """
+    Hashes password with a new random salt, on the calling thread.
+
+    :param cost: iterations or scrypt n (default MIN_COST of algorithm)
+    :return: the string to store
+    """
+    if algorithm not in ALGORITHMS:
+        raise ValueError('algorithm must be one of %s'
+                         % ', '.join(ALGORITHMS))
+    cost = cost or MIN_COST[algorithm]
+    salt = os.urandom(16)
+    return '%s$%d$%s$%s' % (algorithm, cost, _b64(salt),
+                            _b64(_derive(algorithm, password, salt, cost)))
+
+
+def parse_hash(stored):
+    """
+    :return: (algorithm, cost) of a stored hash, or None if stored is not a
+    hash (a password from before hashing)
+    """
+    parts = stored.split('$') if isinstance(stored, str) else []
+    if len(parts) != 4 or parts[0] not in ALGORITHMS \
+            or not parts[1].isdigit():
+        return None
+    return parts[0], int(parts[1])
+
+
+def check_password(password, stored):
+    """
+    Checks password against a stored hash or legacy plain password, on the
+    calling thread, in constant time for a given stored value.
+
+    :return: True if it matches
+    """
+    if stored is None:
+        return False
+    if parse_hash(stored) is None:
+        return hmac.compare_digest(password.encode('utf-8'),
+                                   str(stored).encode('utf-8'))
+
+    algorithm, cost, salt, digest = stored.split('$')
+    try:
+        expected = _unb64(digest)
+        actual = _derive(algorithm, password, _unb64(salt), int(cost))
+    except ValueError:
+        return False
+    return hmac.compare_digest(actual, expected)
+
+
+def calibrate(algorithm, target_seconds):
+    """
+    Measures how long a hash takes on this machine.
+
+    :return: the cost at which one hash takes about target_seconds, never
+    below MIN_COST; rounded down to two significant digits (to a power of
+    two for scrypt) so processes on one machine mostly agree
+    """
+    probe = PROBE_COST[algorithm]
+    seconds = min(_time_hash(algorithm, probe) for _ in range(3))
+    cost = int(probe * target_seconds / max(seconds, 1e-9))
+
+    if algorithm == 'scrypt':
+        cost = 2 ** max(cost.bit_length() - 1, 1)
+    else:
+        digits = len(str(cost)) - 2
+        cost = cost // 10 ** digits * 10 ** digits if digits > 0 else cost
+    return max(cost, MIN_COST[algorithm])
+
+
+def _time_hash(algorithm, cost):
+    start = time.perf_counter()
+    _derive(algorithm, 'calibration', b'calibration salt', cost)
+    return time.perf_counter() - start
+
+
+class PasswordHasher:
+    """
+    Flask extension hashing and checking passwords on a bounded thread
+    pool, and logging users in against the student and faculty tables.
+    """
+
+    def __init__(self, app=None, db=None):
+        """
+        :param app: Flask app to install on; init_app() can be called later
+        :param db: DBManager holding the users
+        """
+        self.db = db
+        self.algorithm = 'pbkdf2_sha256'
+        self.cost = MIN_COST[self.algorithm]
+        self.workers = 2
+        self.max_pending = 32
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.executor = None
+        self.executor_pid = None
+        self.dummy_hash = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.algorithm = app.config.get('PASSWORD_ALGORITHM',
+                                        'pbkdf2_sha256')
+        if self.algorithm not in ALGORITHMS:
+            raise ValueError('PASSWORD_ALGORITHM must be one of %s'
+                             % ', '.join(ALGORITHMS))
+        self.workers = int(app.config.get('PASSWORD_WORKERS', 2))
+        self.max_pending = int(app.config.get('PASSWORD_MAX_PENDING', 32))
+
+        self.cost = app.config.get('PASSWORD_COST')
+        if not self.cost:
+            self.cost = calibrate(self.algorithm, float(
+                app.config.get('PASSWORD_VERIFY_SECONDS', 0.05)))
+        app.extensions['password_hasher'] = self
+
+    def get_executor(self):
+        """
+        :return: this process's thread pool; a process forked from one that
+        had a pool gets its own, since threads do not survive a fork
+        """
+        with self.lock:
+            if self.executor is None or self.executor_pid != os.getpid():
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix='password')
+                self.executor_pid = os.getpid()
+            return self.executor
+
+    def call(self, function, *args):
+        """
+        Runs function(*args) on the pool and waits for its result.
+
+        :raise PasswordPoolFull: if too many calls are waiting already
+        """
+        if self.workers <= 0:
+            return function(*args)
+
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise PasswordPoolFull()
+            self.pending += 1
+        try:
+            return self.get_executor().submit(function, *args).result()
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def hash(self, password):
+        """
+        :return: the string to store for password, hashed on the pool
+        """
+        return self.call(hash_password, password, self.algorithm, self.cost)
+
+    def needs_rehash(self, stored):
+        """
+        :return: True if stored is not a hash, or was made with the other
+        algorithm or a much lower cost than the current one
+        """
+        parsed = parse_hash(stored)
+        return parsed is None or parsed[0] != self.algorithm \
+            or parsed[1] < self.cost * REHASH_BELOW
+
+    def verify(self, password, stored):
+        """
+        Checks password on the pool, hashing it again if the stored value
+        needs it.
+
+        :return: (True if it matches, new string to store or None)
+        """
+        return self.call(self._verify, password, stored)
+
+    def _verify(self, password, stored):
+        if not check_password(password, stored):
+            return False, None
+        if self.needs_rehash(stored):
+            return True, hash_password(password, self.algorithm, self.cost)
+        return True, None
+
+    def login(self, username, password):
+        """
+        Finds the student or faculty member with username and password,
+        students first. A matching row holding a plain password or an
+        outdated hash is updated with a new hash. Must be called inside an
+        app context.
+
+        :return: list of 1 dict with username and student_id or faculty_id,
+        or None if nobody matches
+        :raise PasswordPoolFull: if too many logins are waiting already
+        """
+        candidates = self.db.get_login_candidates(username)
+        for row in candidates:
+            matches, new_hash = self.verify(password, row['password'])
+            if not matches:
+                continue
+            if new_hash is not None:
+                self.db.set_password_hash(row['kind'], row['user_id'],
+                                          row['password'], new_hash)
+            return [{'username': row['username'],
+                     '%s_id' % row['kind']: row['user_id']}]
+
+        if not candidates:
+            # an unknown username costs as much as a wrong password, so
+            # response times do not tell which usernames exist
+            if self.dummy_hash is None:
+                self.dummy_hash = hash_password('', self.algorithm, self.cost)
+            self.verify(password, self.dummy_hash)
+        return None
@@ -0,0 +1,244 @@
+"""
+On-demand request profiling.
+
+Profiling is off unless one of these is configured:
+
+PROFILE_TOKEN        - secret admins send in the X-Woodle-Profile header to
+                       profile that one request with cProfile
+PROFILE_SAMPLE_RATE  - fraction of all requests to profile with the low
+                       overhead stack sampler (default 0)
+
+Settings:
+
+PROFILE_DIR          - where profiles are written (default: the app's
+                       instance folder, in a 'profiles' subfolder)
+PROFILE_INTERVAL     - seconds between stack samples (default 0.005)
+
+Every profiled request writes files named
+<time>-<endpoint>-<pid>-<n>.<extension> to PROFILE_DIR:
+
+.pstats     - cProfile output for header requests; open it with
+              python3 -m pstats <file> or snakeviz
+.collapsed  - sampled stacks, one 'frame;frame;frame count' per line, the
+              input format of flamegraph.pl and speedscope
+.json       - the method, path, route, status and duration of the request
+              and the DBManager queries it ran, with their timings
+
+For example, to profile one slow faculty page:
+
+    curl -H 'X-Woodle-Profile: <PROFILE_TOKEN>' http://host/faculty/Sommer
+"""
+import cProfile
+import hmac
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from flask import g, has_app_context, request
+
+PROFILE_HEADER = 'X-Woodle-Profile'
+
+
+class StackSampler:
+    """
+    Samples the stack of one thread from a background thread. Cheap enough
+    to leave running on a fraction of live traffic.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True,
+                                       name='stack-sampler')
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            self.stacks[_collapse(frame)] += 1
+
+    def stop(self):
+        """
+        :return: Counter of collapsed stack -> number of samples
+        """
+        self.stopping.set()
+        self.thread.join()
+        return self.stacks
+
+
+def _collapse(frame):
+    """
+    :return: the stack ending in frame as 'outer;...;inner'
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('%s (%s:%d)' % (code.co_name,
+                                     os.path.basename(code.co_filename),
+                                     code.co_firstlineno))
+        frame = frame.f_back
+    names.reverse()
+    return ';'.join(names)
+
+
+class RequestProfiler:
+    """
+    Flask extension that profiles selected requests and writes the results
+    to PROFILE_DIR.
+    """
+
+    def __init__(self, app=None, db=None):
+        """
+        :param app: Flask app to install on; init_app() can be called later
+        :param db: DBManager whose queries are listed in each profile
+        """
+        self.token = None
+        self.sample_rate = 0.0
+        self.directory = None
+        self.interval = 0.005
+        self.counter = itertools.count()
+        self.db = db
+
+        # only one cProfile.Profile can be enabled at a time per process
+        self.cprofile_lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.token = app.config.get('PROFILE_TOKEN')
+        self.sample_rate = float(app.config.get('PROFILE_SAMPLE_RATE', 0))
+        self.interval = float(app.config.get('PROFILE_INTERVAL', 0.005))
+        self.directory = app.config.get('PROFILE_DIR') or os.path.join(
+            app.instance_path, 'profiles')
+
+        app.extensions['profiler'] = self
+        if self.token or self.sample_rate > 0:
+            if self.db is not None:
+                self.db.add_query_listener(app, self.record_query)
+            app.before_request(self.start_profile)
+            app.after_request(self.finish_profile)
+            app.teardown_request(self.abandon_profile)
+
+    def requested_by_admin(self):
+        sent = request.headers.get(PROFILE_HEADER)
+        return bool(self.token and sent
+                    and hmac.compare_digest(sent, self.token))
+
+    def start_profile(self):
+        """
+        before_request hook; starts profiling if this request is selected.
+        """
+        use_cprofile = self.requested_by_admin()
+        if not use_cprofile and random.random() >= self.sample_rate:
+            return
+
+        profile = {'started': time.perf_counter(), 'queries': [],
+                   'cprofile': None, 'status': None,
+                   'request': request._get_current_object(),
+                   'method': request.method, 'path': request.path,
+                   'route': request.url_rule.rule if request.url_rule
+                   else None,
+                   'endpoint': request.endpoint}
+        if use_cprofile and self.cprofile_lock.acquire(blocking=False):
+            profile['cprofile'] = cProfile.Profile()
+
+        profile['sampler'] = StackSampler(threading.get_ident(),
+                                          self.interval)
+        g.profile = profile
+        profile['sampler'].start()
+        if profile['cprofile'] is not None:
+            profile['cprofile'].enable()
+
+    def record_query(self, query, parameters, seconds, rows):
+        """
+        DBManager query listener; notes queries run by a profiled request.
+        """
+        if has_app_context():
+            profile = g.get('profile')
+            if profile is not None:
+                profile['queries'].append(
+                    {'sql': ' '.join(query.split()),
+                     'ms': round(seconds * 1000, 3),
+                     'rows': rows})
+
+    def own_profile(self):
+        """
+        :return: the profile started by the current request, or None; g is
+        shared with requests dispatched inside this one (see POST
+        /api/batch), and only the request that started a profile ends it
+        """
+        profile = g.get('profile')
+        if profile is not None \
+                and profile['request'] is request._get_current_object():
+            return profile
+        return None
+
+    def finish_profile(self, response):
+        """
+        after_request hook; the profile is written when the response is
+        closed, so a streamed body is profiled up to its last byte.
+        """
+        profile = self.own_profile()
+        if profile is not None:
+            profile['status'] = response.status_code
+            response.call_on_close(lambda: self.write(profile))
+        return response
+
+    def abandon_profile(self, exception=None):
+        """
+        teardown hook; writes the profile of a request that raised.
+        """
+        profile = self.own_profile()
+        if profile is not None and profile['status'] is None:
+            g.pop('profile')
+            profile['status'] = 500
+            self.write(profile)
+
+    def write(self, profile):
+        """
+        Stops profile and writes its files. Runs after the request context
+        is gone for a response that is not streamed, so it only uses what
+        start_profile() noted down.
+        """
+        duration = time.perf_counter() - profile['started']
+        cprofile = profile['cprofile']
+        if cprofile is not None:
+            cprofile.disable()
+            self.cprofile_lock.release()
+        stacks = profile['sampler'].stop()
+
+        os.makedirs(self.directory, exist_ok=True)
+        endpoint = re.sub(r'[^\w.-]', '_', profile['endpoint'] or 'unknown')
+        base = os.path.join(self.directory, '%s-%s-%d-%d' % (
+            time.strftime('%Y%m%d-%H%M%S'), endpoint, os.getpid(),
+            next(self.counter)))
+
+        if cprofile is not None:
+            cprofile.dump_stats(base + '.pstats')
+
+        with open(base + '.collapsed', 'w') as collapsed:
+            for stack, count in stacks.most_common():
+                collapsed.write('%s %d\n' % (stack, count))
+
+        metadata = {'method': profile['method'],
+                    'path': profile['path'],
+                    'route': profile['route'],
+                    'status': profile['status'],
+                    'ms': round(duration * 1000, 3),
+                    'profiler': 'cprofile' if cprofile else 'sampling',
+                    'samples': sum(stacks.values()),
+                    'queries': profile['queries']}
+        with open(base + '.json', 'w') as metadata_file:
+            json.dump(metadata, metadata_file, indent=2)
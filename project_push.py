@@ -0,0 +1,246 @@
+"""
+Server-Sent Events push of grade changes to the student page.
+
+/student/<username>/events is an event stream a logged-in student's page
+keeps open. When a grade of that student changes, the changed row is sent
+as a 'grade' event and the script in student.html patches the table in
+place, so nobody has to reload the page to see a new grade.
+
+One broadcaster thread per process watches the change log (see
+project_changes.py) of every database with open streams (one per tenant,
+see project_tenants.py): it checks the log's last seq and only reads the
+entries after the one it saw last. It hands each new grade entry to the
+streams of the student it belongs to, so an idle stream costs no database
+work of its own, only a parked thread and a heartbeat comment every
+PUSH_HEARTBEAT seconds. 'flask serve' moves event
+streams off its request thread pool onto threads of their own, so
+thousands of them can be open in one process.
+
+Each event carries the change log seq as its id. A browser that reconnects
+sends it back as Last-Event-ID and gets the grade changes it missed; if
+those have been compacted away it is sent a 'reload' event instead. The
+page itself holds the change log seq it was rendered at (the stream's
+?since= argument), so a grade saved between rendering the page and opening
+the stream is sent as well.
+
+Settings:
+
+PUSH_POLL_INTERVAL  - seconds between change log checks (default 0.5)
+PUSH_HEARTBEAT      - seconds between keep-alive comments (default 15)
+PUSH_MAX_STREAMS    - open streams allowed per process (default 5000)
+"""
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+
+class Subscription:
+    """
+    One open event stream, waiting for the grade changes of one student.
+    """
+    __slots__ = ('key', 'events')
+
+    def __init__(self, key):
+        self.key = key  # (database file, student_id)
+        self.events = queue.SimpleQueue()
+
+    def wait(self, timeout):
+        """
+        :return: list of events, empty if none arrived within timeout
+        """
+        try:
+            events = [self.events.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while not self.events.empty():
+            events.append(self.events.get_nowait())
+        return events
+
+
+class GradePush:
+    """
+    Flask extension fanning grade changes out to the open event streams.
+    """
+
+    def __init__(self, app=None, db=None):
+        """
+        :param app: Flask app to read the settings from
+        :param db: DBManager holding the change log
+        """
+        self.app = None
+        self.db = db
+        self.poll_interval = 0.5
+        self.heartbeat = 15.0
+        self.max_streams = 5000
+        # (database file, student_id) -> set of Subscriptions
+        self.subscriptions = {}
+        # database file -> seq its first change log check starts after
+        self.starts = {}
+        self.streams = 0
+        self.lock = threading.Lock()
+        self.broadcaster_pid = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.poll_interval = float(app.config.get('PUSH_POLL_INTERVAL', 0.5))
+        self.heartbeat = float(app.config.get('PUSH_HEARTBEAT', 15))
+        self.max_streams = int(app.config.get('PUSH_MAX_STREAMS', 5000))
+        app.extensions['grade_push'] = self
+
+    def subscribe(self, student_id, since=None):
+        """
+        Must be called inside an app context, whose database the student
+        belongs to.
+
+        :param since: change log seq the stream is up to date with, or None
+        :return: a new Subscription, or None if this process already has
+        PUSH_MAX_STREAMS streams open
+        """
+        key = (self.db.database_path(), student_id)
+        with self.lock:
+            if self.streams >= self.max_streams:
+                return None
+            subscription = Subscription(key)
+            self.subscriptions.setdefault(key, set()).add(subscription)
+            self.streams += 1
+            if since is not None:
+                # if the broadcaster has not looked at this database yet,
+                # its first look must not skip the changes after since
+                self.starts[key[0]] = min(since,
+                                          self.starts.get(key[0], since))
+
+            # started on first use, and again in a forked worker, since
+            # threads do not survive a fork
+            if self.broadcaster_pid != os.getpid():
+                self.broadcaster_pid = os.getpid()
+                threading.Thread(target=self.broadcast, daemon=True,
+                                 name='grade-push').start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.subscriptions.get(subscription.key)
+            if subscribers is not None and subscription in subscribers:
+                subscribers.discard(subscription)
+                self.streams -= 1
+                if not subscribers:
+                    del self.subscriptions[subscription.key]
+
+    def broadcast(self):
+        """
+        Body of the broadcaster thread. Never returns.
+        """
+        last_seqs = {}  # database file -> last seq handed out
+        with self.app.app_context():
+            while True:
+                with self.lock:
+                    databases = {key[0] for key in self.subscriptions}
+                    starts, self.starts = self.starts, {}
+                for database in list(last_seqs):
+                    if database not in databases:
+                        del last_seqs[database]
+                for database in databases:
+                    last_seq = last_seqs.get(database, starts.get(database))
+                    try:
+                        self.db.use_tenant(None, database)
+                        last_seqs[database] = self.poll(database, last_seq)
+                    except sqlite3.Error:
+                        # e.g. locked for longer than the connection's
+                        # timeout; nothing is lost, the next round reads
+                        # from the last seq
+                        if last_seq is not None:
+                            last_seqs[database] = last_seq
+                        self.app.logger.warning(
+                            'grade push: could not read the change log of '
+                            '%s', database, exc_info=True)
+                self.db.close_db()
+                time.sleep(self.poll_interval)
+
+    def poll(self, database, last_seq):
+        """
+        Hands the grade changes of database after last_seq to their
+        streams.
+
+        :param last_seq: last seq handed out (on the first look, the seq
+        the streams are up to date with), or None to start at the newest
+        change
+        :return: the new last seq
+        """
+        current = self.db.get_last_change()
+        if last_seq is None or current <= last_seq:
+            return current
+
+        changes = self.db.get_grade_changes(last_seq)
+        while changes:
+            last_seq = changes.rows[-1][0]
+            self.dispatch(database, changes.rows)
+            changes = self.db.get_grade_changes(last_seq)
+        # every change up to current was committed when it was read, so
+        # the non-grade ones after the last grade need not be read again
+        return max(last_seq, current)
+
+    def dispatch(self, database, rows):
+        """
+        Hands grade change rows of database to the streams of their
+        students.
+        """
+        with self.lock:
+            for row in rows:
+                for subscription in self.subscriptions.get(
+                        (database, row[1]), ()):
+                    subscription.events.put(row)
+
+    def missed(self, student_id, last_event_id):
+        """
+        Must be called inside an app context.
+
+        :return: the rows of the student's grade changes after
+        last_event_id, or None if some have been compacted away
+        """
+        if last_event_id < self.db.get_change_horizon():
+            return None
+        return self.db.get_grade_changes(last_event_id, student_id).rows
+
+    def stream(self, subscription, missed):
+        """
+        The body of an event stream response.
+
+        :param subscription: Subscription returned by subscribe()
+        :param missed: rows returned by missed(), or None to make the page
+        reload itself
+        """
+        yield 'retry: 5000\n\n'
+        if missed is None:
+            yield 'event: reload\ndata: {}\n\n'
+            return
+
+        sent = 0
+        for row in missed:
+            sent = row[0]
+            yield format_event(row)
+
+        while True:
+            events = subscription.wait(self.heartbeat)
+            if not events:
+                yield ': keep-alive\n\n'
+            for row in events:
+                if row[0] > sent:  # missed() may have sent it already
+                    sent = row[0]
+                    yield format_event(row)
+
+
+def format_event(row):
+    """
+    :param row: (seq, student_id, class_id, c_name, grade, operation)
+    :return: the row as a 'grade' server-sent event
+    """
+    seq, student_id, class_id, c_name, grade, operation = row
+    return 'id: %d\nevent: grade\ndata: %s\n\n' % (seq, json.dumps(
+        {'class_id': class_id, 'student_id': student_id, 'c_name': c_name,
+         'grade': grade, 'operation': operation}))
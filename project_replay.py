@@ -0,0 +1,322 @@
+"""
+Replays a JSONL request log against the site or the API and reports
+throughput, error rates and latency percentiles per route.
+
+Each line of the log is one request:
+
+    {"method": "POST", "path": "/login",
+     "form": {"username": "micheas", "password": "micheas"},
+     "think_time": 0.5}
+
+Only path is required. method defaults to GET, form to no form data and
+think_time (seconds a user waits after the request) to 0. A line may also
+carry "route", e.g. "/student/<username>", to group its timings; otherwise
+the path without its query string is used. Lines without a path are skipped.
+
+Requests run either in process through the Flask test client:
+
+    python3 project_replay.py traffic.jsonl --app main_app:create_app
+
+or against a running server:
+
+    python3 project_replay.py traffic.jsonl --url http://127.0.0.1:5000
+
+Without a log argument the capture file of project_capture.py is replayed:
+$WOODLE_CAPTURE_FILE if it is set, otherwise traffic.jsonl.
+
+Closed loop (the default): --workers simulated users each replay the log in
+order, honouring think_time. Open loop: --rate requests per second arrive
+on a Poisson schedule no matter how slowly the server answers, and latency
+is measured from the scheduled arrival time so queueing shows up in it.
+"""
+import argparse
+import importlib
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# log replayed when none is named: the one project_capture.py records
+DEFAULT_LOG = os.environ.get('WOODLE_CAPTURE_FILE') or 'traffic.jsonl'
+
+
+def load_requests(path):
+    """
+    Reads a JSONL request log.
+
+    :param path: name of the log file
+    :return: list of request dictionaries; lines without a path are skipped
+    """
+    entries = []
+    with open(path, 'r') as log:
+        for line in log:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if 'path' in entry:
+                entries.append(entry)
+    return entries
+
+
+def route_of(entry):
+    """
+    :return: the name timings for entry are grouped under
+    """
+    return '%s %s' % (entry.get('method', 'GET').upper(),
+                      entry.get('route') or entry['path'].split('?')[0])
+
+
+class InProcessTarget:
+    """
+    Sends requests to a Flask app through its test client. Each worker
+    thread gets its own client so login cookies stay per simulated user.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def send(self, entry):
+        """
+        :return: (status code, response size in bytes)
+        """
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+
+        response = client.open(entry['path'],
+                               method=entry.get('method', 'GET').upper(),
+                               data=entry.get('form'))
+        return response.status_code, len(response.get_data())
+
+
+class HTTPTarget:
+    """
+    Sends requests to a running server with urllib. Redirects are not
+    followed, so a redirect counts as one request like it does in process.
+    """
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(_NoRedirect)
+
+    def send(self, entry):
+        """
+        :return: (status code, response size in bytes)
+        """
+        form = entry.get('form')
+        data = urllib.parse.urlencode(form).encode() if form else None
+        request = urllib.request.Request(self.base_url + entry['path'],
+                                         data=data,
+                                         method=entry.get('method',
+                                                          'GET').upper())
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                return response.status, len(response.read())
+        except urllib.error.HTTPError as error:
+            return error.code, len(error.read())
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Report:
+    """
+    Collects the outcome of every replayed request. Thread safe.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}  # route -> list of (seconds, status, size)
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def record(self, route, seconds, status, size):
+        """
+        :param status: HTTP status code, or None if the request raised
+        """
+        with self.lock:
+            self.routes.setdefault(route, []).append((seconds, status, size))
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    def summary(self):
+        """
+        :return: dict of route -> statistics, plus an 'ALL' entry
+        """
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        results = {}
+        everything = []
+        for route, samples in sorted(self.routes.items()):
+            results[route] = _statistics(samples, elapsed)
+            everything.extend(samples)
+        results['ALL'] = _statistics(everything, elapsed)
+        return results
+
+    def format(self):
+        """
+        :return: the summary as a printable table
+        """
+        lines = ['%-40s %7s %8s %7s %8s %8s %8s %8s' % (
+            'route', 'count', 'req/s', 'errors', 'p50 ms', 'p90 ms',
+            'p99 ms', 'max ms')]
+        for route, stats in self.summary().items():
+            lines.append('%-40s %7d %8.1f %6.1f%% %8.2f %8.2f %8.2f %8.2f' % (
+                route[:40], stats['count'], stats['throughput'],
+                stats['error_rate'] * 100, stats['p50'] * 1000,
+                stats['p90'] * 1000, stats['p99'] * 1000,
+                stats['max'] * 1000))
+        return '\n'.join(lines)
+
+
+def _statistics(samples, elapsed):
+    latencies = sorted(sample[0] for sample in samples)
+    errors = sum(1 for sample in samples
+                 if sample[1] is None or sample[1] >= 400)
+    count = len(samples)
+    return {'count': count,
+            'throughput': count / elapsed if elapsed > 0 else 0.0,
+            'error_rate': errors / count if count else 0.0,
+            'bytes': sum(sample[2] for sample in samples),
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': latencies[-1] if latencies else 0.0}
+
+
+def percentile(sorted_values, percent):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(percent / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def _send(target, entry, report, scheduled):
+    """
+    Sends one request and records it. Latency is measured from scheduled,
+    the moment the request was supposed to start.
+    """
+    try:
+        status, size = target.send(entry)
+    except Exception:
+        status, size = None, 0
+    report.record(route_of(entry), time.perf_counter() - scheduled,
+                  status, size)
+
+
+def replay_closed_loop(entries, target, workers=1, repeat=1):
+    """
+    Every worker replays the whole log repeat times, sleeping each entry's
+    think_time after its response arrives.
+
+    :return: the finished Report
+    """
+    report = Report()
+
+    def user():
+        for _ in range(repeat):
+            for entry in entries:
+                _send(target, entry, report, time.perf_counter())
+                think_time = entry.get('think_time', 0)
+                if think_time:
+                    time.sleep(think_time)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for _ in range(workers):
+            pool.submit(user)
+
+    report.finish()
+    return report
+
+
+def replay_open_loop(entries, target, rate, workers=8, repeat=1, seed=None):
+    """
+    Starts requests on a Poisson arrival schedule of rate per second,
+    cycling through the log repeat times. think_time is ignored because
+    arrivals do not wait for earlier responses.
+
+    :return: the finished Report
+    """
+    report = Report()
+    arrivals = random.Random(seed)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        scheduled = time.perf_counter()
+        for _ in range(repeat):
+            for entry in entries:
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(_send, target, entry, report, scheduled)
+                scheduled += arrivals.expovariate(rate)
+
+    report.finish()
+    return report
+
+
+def load_app(spec):
+    """
+    Imports a Flask app given as 'module:attribute'. If the attribute is a
+    factory function it is called.
+    """
+    module_name, _, attribute = spec.partition(':')
+    app = getattr(importlib.import_module(module_name), attribute or 'app')
+    if callable(app) and not hasattr(app, 'test_client'):
+        app = app()
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a JSONL request log.')
+    parser.add_argument('log', nargs='?', default=DEFAULT_LOG,
+                        help='JSONL request log (default: %s, the capture '
+                             'file)' % DEFAULT_LOG)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--app', default='main_app:create_app',
+                        help='module:attribute of the Flask app or app '
+                             'factory to replay against in process '
+                             '(default: main_app:create_app)')
+    target.add_argument('--url', help='base URL of a running server')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='concurrent workers (default: 4)')
+    parser.add_argument('--rate', type=float,
+                        help='open-loop arrival rate in requests per second')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='times to replay the log (default: 1)')
+    parser.add_argument('--seed', type=int, help='seed for open-loop arrivals')
+    args = parser.parse_args(argv)
+
+    entries = load_requests(args.log)
+    if not entries:
+        parser.exit(1, 'No requests with a path found in %s\n' % args.log)
+
+    if args.url:
+        sender = HTTPTarget(args.url)
+    else:
+        sender = InProcessTarget(load_app(args.app))
+
+    if args.rate:
+        report = replay_open_loop(entries, sender, args.rate, args.workers,
+                                  args.repeat, args.seed)
+    else:
+        report = replay_closed_loop(entries, sender, args.workers,
+                                    args.repeat)
+
+    print(report.format())
+
+
+if __name__ == '__main__':
+    main()
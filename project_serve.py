@@ -0,0 +1,428 @@
+"""
+Pre-fork server used by the 'flask serve' command.
+
+The master process opens the listening socket once and forks --workers
+worker processes that all accept from it. Each worker builds its own app
+with create_app() after the fork, so every worker opens its own database
+connections, and serves requests on a pool of --threads threads.
+
+Signals sent to the master:
+
+SIGINT, SIGTERM - stop: workers finish the requests they are handling,
+                  then the master prints the combined stats and exits
+SIGHUP          - reload: workers are stopped gracefully and the master
+                  re-executes itself on the same listening socket, so new
+                  code and config are picked up without refusing
+                  connections (they wait in the listen backlog)
+SIGUSR1         - print the combined stats of all workers
+
+With --reload the master also watches the app's .py, .sql and template
+files and reloads when one changes.
+
+Server-sent event streams (paths ending in /events, see project_push.py)
+get a thread of their own instead of one of the --threads pool threads.
+
+Every worker writes its request counters to <stats dir>/<pid>.json every
+few seconds and when it exits; the master adds them up.
+"""
+import glob
+import json
+import os
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+LISTEN_FD_ENV = 'WOODLE_SERVE_FD'
+STATS_DIR_ENV = 'WOODLE_SERVE_STATS'
+STATS_INTERVAL = 5.0
+# app.extensions entries with a close() that writes out buffered data
+BUFFERED_EXTENSIONS = ('capture',)
+
+
+class PooledRequestHandler(WSGIRequestHandler):
+    """
+    One request per connection, so an idle keep-alive client can not hold
+    on to one of the worker's few pool threads.
+    """
+    protocol_version = 'HTTP/1.0'
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    Werkzeug WSGI server that hands accepted connections to a fixed size
+    thread pool instead of starting a thread per request.
+
+    Event streams (GET requests for a path ending in /events) stay open for
+    as long as the browser is on the page, so they would soon take every
+    pool thread. They are handed to a thread of their own instead, up to
+    max_streams at a time.
+    """
+    multithread = True
+
+    def __init__(self, host, port, app, threads, fd, max_streams=5000):
+        # created first: the base class calls server_close() while it
+        # swaps its own socket for fd
+        self.pool = ThreadPoolExecutor(max_workers=threads,
+                                       thread_name_prefix='request')
+        self.streams = threading.BoundedSemaphore(max_streams)
+        super().__init__(host, port, app, handler=PooledRequestHandler,
+                         fd=fd)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_in_pool, request,
+                         client_address)
+
+    def process_request_in_pool(self, request, client_address):
+        if is_event_stream(request) and self.streams.acquire(blocking=False):
+            threading.Thread(target=self.process_stream,
+                             args=(request, client_address),
+                             daemon=True, name='stream').start()
+            return
+
+        self.handle_connection(request, client_address)
+
+    def process_stream(self, request, client_address):
+        try:
+            self.handle_connection(request, client_address)
+        finally:
+            self.streams.release()
+
+    def handle_connection(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def shutdown(self):
+        super().shutdown()
+        self.pool.shutdown(wait=True)  # let in-flight requests finish
+
+
+def is_event_stream(request):
+    """
+    Peeks at the request line of a new connection without consuming it.
+
+    :return: True if it is a GET for a path ending in /events
+    """
+    try:
+        start = request.recv(1024, socket.MSG_PEEK)
+    except OSError:
+        return False
+    parts = start.split(b'\r\n', 1)[0].split(b' ')
+    return len(parts) == 3 and parts[0] == b'GET' \
+        and parts[1].split(b'?', 1)[0].endswith(b'/events')
+
+
+class WorkerStats:
+    """
+    WSGI middleware counting the requests a worker served and how long
+    they took.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    def __call__(self, environ, start_response):
+        status = []
+
+        def record_status(status_line, headers, exc_info=None):
+            status.append(status_line)
+            return start_response(status_line, headers, exc_info)
+
+        start = time.perf_counter()
+        try:
+            return self.wsgi_app(environ, record_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            failed = not status or status[0][:1] == '5'
+            with self.lock:
+                self.requests += 1
+                self.errors += failed
+                self.seconds += elapsed
+
+    def snapshot(self):
+        with self.lock:
+            return {'pid': os.getpid(),
+                    'started': self.started,
+                    'requests': self.requests,
+                    'errors': self.errors,
+                    'seconds': self.seconds}
+
+
+def write_stats(stats_dir, snapshot):
+    """
+    Atomically writes one worker's counters to <stats_dir>/<pid>.json
+    """
+    path = os.path.join(stats_dir, '%d.json' % snapshot['pid'])
+    with open(path + '.tmp', 'w') as stats_file:
+        json.dump(snapshot, stats_file)
+    os.replace(path + '.tmp', path)
+
+
+def collect_stats(stats_dir):
+    """
+    Adds up the counters written by every worker, current and past.
+
+    :return: dict with totals and a 'workers' list of per-worker counters
+    """
+    workers = []
+    for path in sorted(glob.glob(os.path.join(stats_dir, '*.json'))):
+        try:
+            with open(path) as stats_file:
+                workers.append(json.load(stats_file))
+        except (OSError, ValueError):
+            continue  # being replaced right now
+
+    requests = sum(worker['requests'] for worker in workers)
+    seconds = sum(worker['seconds'] for worker in workers)
+    return {'requests': requests,
+            'errors': sum(worker['errors'] for worker in workers),
+            'mean_ms': seconds / requests * 1000 if requests else 0.0,
+            'workers': workers}
+
+
+def format_stats(stats):
+    lines = ['%8s %10s %8s %10s' % ('pid', 'requests', 'errors', 'mean ms')]
+    for worker in stats['workers']:
+        mean = worker['seconds'] / worker['requests'] * 1000 \
+            if worker['requests'] else 0.0
+        lines.append('%8d %10d %8d %10.2f' % (worker['pid'],
+                                              worker['requests'],
+                                              worker['errors'], mean))
+    lines.append('%8s %10d %8d %10.2f' % ('total', stats['requests'],
+                                          stats['errors'], stats['mean_ms']))
+    return '\n'.join(lines)
+
+
+def run_worker(listener, app_factory, host, port, threads, stats_dir):
+    """
+    Body of a forked worker. Never returns.
+    """
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    # ^C, reloads and stats requests are the master's business
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+
+    status = 0
+    app = None
+    try:
+        # the app, and with it every database connection, is created after
+        # the fork so workers share nothing
+        app = app_factory()
+        stats = WorkerStats(app.wsgi_app)
+        app.wsgi_app = stats
+
+        server = PooledWSGIServer(host, port, app, threads,
+                                  fd=listener.fileno())
+        serving = threading.Thread(target=server.serve_forever,
+                                   kwargs={'poll_interval': 0.2},
+                                   daemon=True)
+        serving.start()
+
+        while not stopping.wait(STATS_INTERVAL):
+            write_stats(stats_dir, stats.snapshot())
+
+        server.shutdown()
+        server.server_close()
+        write_stats(stats_dir, stats.snapshot())
+    except Exception:
+        import traceback
+        traceback.print_exc()
+        status = 1
+    finally:
+        if app is not None:
+            close_buffers(app)
+        os._exit(status)
+
+
+def close_buffers(app):
+    """
+    Flushes the extensions of app that hold data in memory. A worker leaves
+    through os._exit(), which skips their atexit handlers.
+    """
+    for name in BUFFERED_EXTENSIONS:
+        extension = app.extensions.get(name)
+        if extension is not None:
+            try:
+                extension.close()
+            except Exception:
+                import traceback
+                traceback.print_exc()
+
+
+class Master:
+    """
+    Forks the workers, replaces any that die, and handles the signals
+    described at the top of this module.
+    """
+
+    def __init__(self, app_factory, host, port, workers, threads,
+                 reload_paths=None):
+        self.app_factory = app_factory
+        self.host = host
+        self.port = port
+        self.number_of_workers = workers
+        self.threads = threads
+        self.reload_paths = reload_paths or []
+        self.workers = {}  # pid -> time.monotonic() when forked
+        self.stopping = False
+        self.reloading = False
+        self.print_stats = False
+
+        inherited_fd = os.environ.pop(LISTEN_FD_ENV, None)
+        if inherited_fd is not None:
+            self.listener = socket.socket(fileno=int(inherited_fd))
+        else:
+            self.listener = socket.create_server((host, port), backlog=1024)
+
+        self.stats_dir = os.environ.get(STATS_DIR_ENV) or tempfile.mkdtemp(
+            prefix='woodle-serve-')
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.on_stop)
+        signal.signal(signal.SIGTERM, self.on_stop)
+        signal.signal(signal.SIGHUP, self.on_reload)
+        signal.signal(signal.SIGUSR1, self.on_stats)
+
+        print('Serving on http://%s:%d with %d workers x %d threads '
+              '(master pid %d)' % (self.host, self.listener.getsockname()[1],
+                                   self.number_of_workers, self.threads,
+                                   os.getpid()))
+        mtimes = self.snapshot_mtimes()
+
+        while not (self.stopping or self.reloading):
+            self.reap_workers()
+            while len(self.workers) < self.number_of_workers \
+                    and not self.stopping:
+                self.spawn_worker()
+
+            if self.print_stats:
+                self.print_stats = False
+                print(format_stats(collect_stats(self.stats_dir)))
+
+            if self.reload_paths:
+                current = self.snapshot_mtimes()
+                if current != mtimes:
+                    print('Change detected, reloading')
+                    self.reloading = True
+            time.sleep(0.5)
+
+        self.stop_workers()
+        if self.reloading:
+            self.exec_new_master()
+
+        print(format_stats(collect_stats(self.stats_dir)))
+        self.listener.close()
+
+    def spawn_worker(self):
+        pid = os.fork()
+        if pid == 0:
+            run_worker(self.listener, self.app_factory, self.host, self.port,
+                       self.threads, self.stats_dir)
+        self.workers[pid] = time.monotonic()
+
+    def reap_workers(self):
+        """
+        Forgets workers that have exited so the loop starts replacements.
+        A worker that dies within a second of starting (e.g. a broken
+        import) delays its replacement by a second instead of fork-looping.
+        """
+        while self.workers:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.workers.clear()
+                return
+            if pid == 0:
+                return
+            forked = self.workers.pop(pid, None)
+            if forked is not None and time.monotonic() - forked < 1.0 \
+                    and not self.stopping:
+                time.sleep(1.0)
+
+    def stop_workers(self, timeout=30):
+        """
+        Asks every worker to finish its in-flight requests and exit.
+        """
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        deadline = time.monotonic() + timeout
+        while self.workers and time.monotonic() < deadline:
+            self.reap_workers()
+            time.sleep(0.1)
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass  # exited since the last reap
+        self.workers.clear()
+
+    def exec_new_master(self):
+        """
+        Replaces this process with a fresh copy of the same command, handing
+        it the listening socket, so new code is imported from scratch.
+        """
+        os.set_inheritable(self.listener.fileno(), True)
+        os.environ[LISTEN_FD_ENV] = str(self.listener.fileno())
+        os.environ[STATS_DIR_ENV] = self.stats_dir
+        argv = getattr(sys, 'orig_argv', None) or [sys.executable] + sys.argv
+        sys.stdout.flush()
+        os.execv(sys.executable, [sys.executable] + argv[1:])
+
+    def snapshot_mtimes(self):
+        mtimes = {}
+        for pattern in self.reload_paths:
+            for path in glob.glob(pattern, recursive=True):
+                try:
+                    mtimes[path] = os.stat(path).st_mtime
+                except OSError:
+                    pass
+        return mtimes
+
+    def on_stop(self, signum, frame):
+        self.stopping = True
+
+    def on_reload(self, signum, frame):
+        self.reloading = True
+
+    def on_stats(self, signum, frame):
+        self.print_stats = True
+
+
+def serve(app_factory, host='127.0.0.1', port=5000, workers=None, threads=4,
+          reload_root=None):
+    """
+    Runs the pre-fork server until it is stopped.
+
+    :param app_factory: function returning a new Flask app; called once in
+    each worker after the fork
+    :param workers: number of worker processes (default: one per CPU)
+    :param threads: request threads per worker
+    :param reload_root: directory to watch for changes, or None
+    """
+    reload_paths = []
+    if reload_root is not None:
+        reload_paths = [os.path.join(reload_root, '*.py'),
+                        os.path.join(reload_root, '*.sql'),
+                        os.path.join(reload_root, 'templates', '**', '*')]
+
+    Master(app_factory, host, port, workers or os.cpu_count() or 1, threads,
+           reload_paths).run()
@@ -0,0 +1,178 @@
+"""
+Slow-query log for DBManager.
+
+Every statement DBManager runs is timed (see DBManager.execute). Statements
+slower than app.config['SLOW_QUERY_MS'] milliseconds (default 100; set it
+to None to turn the log off) are appended to the JSONL file
+app.config['SLOW_QUERY_LOG'] (default: slow_queries.jsonl in the app's
+instance folder, or no log at all when TESTING), one line per slow
+execution:
+
+    {"at": 1760000000.1, "fingerprint": "3f0c9a1be2d4",
+     "sql": "SELECT ... WHERE student.username = ?",
+     "parameters": ["str"], "rows": 12000, "ms": 240.5,
+     "plan": ["SCAN student", "SCAN grade", "SCAN class"]}
+
+Bound values are never logged, only their types. The plan is the output of
+EXPLAIN QUERY PLAN, taken the first time a fingerprint is seen in a process.
+The fingerprint is the statement with whitespace collapsed and literals
+replaced by ?, so the same query with different values is counted together.
+
+'flask slow-queries' reads the log, which every worker process appends to,
+and prints the statements grouped by fingerprint, worst total time first.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from flask import has_app_context
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+
+
+def fingerprint(query):
+    """
+    Normalizes a statement so executions that only differ in literal values
+    or layout compare equal.
+
+    :return: (fingerprint id, normalized SQL)
+    """
+    normalized = _STRING_LITERAL.sub('?', query)
+    normalized = _NUMBER_LITERAL.sub('?', normalized)
+    normalized = ' '.join(normalized.split()).rstrip(';').strip()
+    digest = hashlib.sha1(normalized.lower().encode('utf-8')).hexdigest()
+    return digest[:12], normalized
+
+
+def parameter_shapes(parameters):
+    """
+    :return: the type names of the bound values, never the values
+    """
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__
+                for name, value in parameters.items()}
+    return [type(value).__name__ for value in parameters]
+
+
+class SlowQueryLog:
+    """
+    DBManager query listener that writes slow statements to a JSONL log and
+    keeps per-fingerprint totals for this process.
+    """
+
+    def __init__(self, app=None, db=None):
+        """
+        :param app: Flask app to read the settings from
+        :param db: DBManager to listen to
+        """
+        self.db = db
+        self.threshold = None
+        self.path = None
+        self.plans = {}  # fingerprint -> EXPLAIN QUERY PLAN lines
+        self.aggregates = {}  # fingerprint -> totals for this process
+        self.lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        threshold = app.config.get('SLOW_QUERY_MS', 100)
+        if threshold is None:
+            return
+        if app.testing and not app.config.get('SLOW_QUERY_LOG'):
+            return  # tests only log to a file they name
+
+        self.threshold = float(threshold) / 1000
+        self.path = app.config.get('SLOW_QUERY_LOG') or os.path.join(
+            app.instance_path, 'slow_queries.jsonl')
+        app.extensions['slow_query_log'] = self
+        self.db.add_query_listener(app, self.record_query)
+
+    def record_query(self, query, parameters, seconds, rows):
+        """
+        DBManager query listener.
+        """
+        if seconds < self.threshold:
+            return
+
+        query_id, normalized = fingerprint(query)
+        entry = {'at': round(time.time(), 3),
+                 'fingerprint': query_id,
+                 'sql': normalized,
+                 'parameters': parameter_shapes(parameters),
+                 'rows': rows,
+                 'ms': round(seconds * 1000, 3),
+                 'plan': self.explain(query_id, query, parameters)}
+
+        with self.lock:
+            totals = self.aggregates.setdefault(
+                query_id, {'sql': normalized, 'count': 0, 'total_ms': 0.0,
+                           'max_ms': 0.0})
+            totals['count'] += 1
+            totals['total_ms'] += entry['ms']
+            totals['max_ms'] = max(totals['max_ms'], entry['ms'])
+
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a') as log:
+                log.write(json.dumps(entry) + '\n')
+
+    def explain(self, query_id, query, parameters):
+        """
+        Runs EXPLAIN QUERY PLAN for a statement once per fingerprint, on the
+        request's own connection so it sees the same schema.
+
+        :return: list of plan lines, or None if it could not be explained
+        """
+        if query_id in self.plans:
+            return self.plans[query_id]
+        if not has_app_context():
+            return None
+
+        try:
+            cur = self.db.get_db().execute('EXPLAIN QUERY PLAN ' + query,
+                                           parameters)
+            plan = [row[-1] for row in cur.fetchall()]
+        except Exception:
+            plan = None
+
+        self.plans[query_id] = plan
+        return plan
+
+    def summary(self):
+        """
+        :return: this process's totals, worst total time first
+        """
+        with self.lock:
+            return sorted(({'fingerprint': query_id, **totals}
+                           for query_id, totals in self.aggregates.items()),
+                          key=lambda totals: totals['total_ms'], reverse=True)
+
+
+def summarize_log(path):
+    """
+    Groups every entry of a slow-query log by fingerprint.
+
+    :return: list of dicts with fingerprint, sql, count, total_ms, max_ms,
+    rows (largest seen) and plan, worst total time first
+    """
+    groups = {}
+    with open(path) as log:
+        for line in log:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            group = groups.setdefault(entry['fingerprint'], {
+                'fingerprint': entry['fingerprint'], 'sql': entry['sql'],
+                'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': None,
+                'plan': entry.get('plan')})
+            group['count'] += 1
+            group['total_ms'] += entry['ms']
+            group['max_ms'] = max(group['max_ms'], entry['ms'])
+            if entry.get('rows') is not None:
+                group['rows'] = max(group['rows'] or 0, entry['rows'])
+
+    return sorted(groups.values(), key=lambda group: group['total_ms'],
+                  reverse=True)
@@ -0,0 +1,87 @@
+"""
+Streamed HTML pages over row generators.
+
+render_template() builds the whole page in memory before the first byte is
+sent, which for a faculty member with a few large lectures is megabytes of
+HTML and a long wait for a blank screen. stream_page() renders the template
+while the response is being sent instead: the head of the page goes out
+straight away, and the rows are read from sqlite (see
+DBManager.iter_rows) and written a small batch at a time, so memory use
+stays flat however long the roster is.
+
+RowPage cuts the rows into pages of ROSTER_PAGE_SIZE rows (0 turns paging
+off), with links to the next and the first page. Pages are found by row
+key (?after=<last row_key of the previous page>) rather than by offset, so
+a deep page costs as little as the first and rows added meanwhile do not
+shift later pages.
+
+The streamed response keeps the request context, and with it the request's
+database connection and read transaction, until the last row is sent.
+"""
+from flask import Response, current_app, stream_with_context
+
+# template events (text between tags and expressions) joined into one
+# chunk before it is written, so a row is not sent in a dozen pieces
+STREAM_BUFFER = 64
+
+
+class RowPage:
+    """
+    One page of a row generator, for a template to loop over. Once the loop
+    is done, has_next tells whether another page follows.
+    """
+
+    def __init__(self, rows, size, after, url):
+        """
+        :param rows: generator of Records ordered by their row_key
+        :param size: rows per page, or 0 for all rows on one page
+        :param after: row_key the page starts after (0 for the first page)
+        :param url: function(after=None) returning the URL of the page
+        starting after a row_key, or of the first page
+        """
+        self.rows = rows
+        self.size = size
+        self.after = after
+        self.url = url
+        self.last_key = after
+        self.count = 0
+        self.has_next = False
+
+    def __iter__(self):
+        """
+        Yields the rows of the page. A page only ends between two row keys,
+        so rows sharing a key are never split over two pages.
+        """
+        try:
+            for row in self.rows:
+                if self.size and self.count >= self.size \
+                        and row['row_key'] != self.last_key:
+                    self.has_next = True
+                    break
+                self.count += 1
+                self.last_key = row['row_key']
+                yield row
+        finally:
+            # ends the statement, even when the loop stopped early; at most
+            # one batch of rows past the page was fetched
+            self.rows.close()
+
+    def next_url(self):
+        return self.url(self.last_key)
+
+    def first_url(self):
+        return self.url()
+
+
+def stream_page(template_name, **context):
+    """
+    Renders a template into a streamed response, with the request context
+    kept for the rows the template reads while it is sent.
+
+    :return: a text/html Response
+    """
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(STREAM_BUFFER)
+    return Response(stream_with_context(stream), mimetype='text/html')
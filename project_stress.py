@@ -0,0 +1,404 @@
+"""
+Concurrency stress test for the site, the API and DBManager.
+
+Runs the whole app (create_app) in several processes, each with several
+threads, all on one database file, the way a multi-worker server does.
+Every thread loops over a mix of operations until the time is up:
+
+login     - POST /login as one of the populated users
+page      - GET /student/<username> or /faculty/<username>
+register  - POST /register of a new student (DBManager.insert_user)
+grades    - POST /api/classes/<class_id>/grades for students only this
+            thread grades (DBManager.save_class_grades)
+
+Each run is repeated at every concurrency level (total threads, spread
+over --processes processes). After each level the database is checked for
+lost writes: every registration and every grade the app acknowledged must
+be there, with the last grade acknowledged for each student. The run fails
+if a write was lost, if any operation failed with "database is locked" or
+if any failed otherwise; it reports throughput and latency percentiles per
+level, so it also shows how the app scales as concurrency rises:
+
+    python3 project_stress.py --levels 1,4,16,32 --processes 4 --seconds 5
+
+    python3 project_stress.py --mix login=1,page=6,register=1,grades=2
+
+test_project_stress.py runs one short level with the other tests.
+"""
+import argparse
+import collections
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+OPERATIONS = ('login', 'page', 'register', 'grades')
+DEFAULT_MIX = {'login': 2, 'page': 5, 'register': 1, 'grades': 2}
+
+# users from populate_db.sql that log in and whose pages are loaded
+USERS = (('micheas', 'micheas', 'student'), ('Sommer', 'Sommer', 'faculty'),
+         ('Hartman', 'Hartman', 'faculty'))
+
+# students each thread grades; nobody else writes their grades
+STUDENTS_PER_THREAD = 5
+LETTERS = ('A', 'A-', 'B+', 'B', 'B-', 'C+', 'C', 'D', 'F')
+
+
+def stress_config(path):
+    """
+    :return: create_app() settings for a stress run on the database at path;
+    admission control is off so nothing is shed, and errors propagate so
+    they can be told apart; the run writes nothing to the instance folder
+    (no template cache, no slow-query log)
+    """
+    return {'DATABASE': path, 'PROPAGATE_EXCEPTIONS': True,
+            'ADMISSION_LIMITS': {}, 'MAINTENANCE_INTERVAL': 0,
+            'TEMPLATE_CACHE_DIR': False, 'SLOW_QUERY_MS': None}
+
+
+def prepare_database(path):
+    """
+    Creates the schema and the populated data in the database at path.
+    """
+    from main_app import MIGRATIONS_DIRECTORY, create_app
+
+    app = create_app(stress_config(path))
+    manager = app.extensions['db_manager']
+    with app.app_context():
+        manager.init_db('init_db.sql')
+        manager.migrate_db(MIGRATIONS_DIRECTORY)
+        manager.populate_db('populate_db.sql')
+
+
+def assign_students(path, level, processes, threads):
+    """
+    Registers the students each thread of a level grades.
+
+    :return: list per process of list per thread of (class_id, student ids)
+    """
+    conn = sqlite3.connect(path, timeout=30)
+    classes = [row[0] for row in conn.execute('SELECT class_id FROM class '
+                                              'ORDER BY class_id;')]
+    assignments = []
+    for process in range(processes):
+        assignments.append([])
+        for thread in range(threads):
+            class_id = classes[(process * threads + thread) % len(classes)]
+            student_ids = []
+            for number in range(STUDENTS_PER_THREAD):
+                cursor = conn.execute(
+                    'INSERT INTO student(name, class_id, username, '
+                    'password) VALUES(?,?,?,?);',
+                    ('Stress %d' % number, class_id,
+                     'graded-%d-%d-%d-%d' % (level, process, thread, number),
+                     'x'))
+                student_ids.append(cursor.lastrowid)
+            assignments[-1].append((class_id, student_ids))
+    conn.commit()
+    conn.close()
+    return assignments
+
+
+class Worker:
+    """
+    One simulated user: a test client of the process's app that runs the
+    operation mix and notes latencies, failures and acknowledged writes.
+    """
+
+    def __init__(self, app, name, class_id, student_ids, mix, seed):
+        self.client = app.test_client()
+        self.name = name
+        self.class_id = class_id
+        self.student_ids = student_ids
+        self.random = random.Random(seed)
+        self.operations = list(mix)
+        self.weights = [mix[operation] for operation in self.operations]
+        self.latencies = collections.defaultdict(list)
+        self.failures = collections.Counter()
+        self.registered = []
+        self.graded = {}
+        self.registrations = 0
+
+    def run(self, deadline):
+        while time.monotonic() < deadline:
+            operation = self.random.choices(self.operations,
+                                            self.weights)[0]
+            start = time.perf_counter()
+            try:
+                failure = getattr(self, operation)()
+            except Exception as error:
+                failure = '%s: %s' % (type(error).__name__, error)
+            self.latencies[operation].append(time.perf_counter() - start)
+            if failure:
+                self.failures['%s %s' % (operation, failure)] += 1
+
+    def login(self):
+        username, password, _ = self.random.choice(USERS)
+        response = self.client.post('/login', data={'username': username,
+                                                    'password': password})
+        if response.status_code != 302 \
+                or '/register' in response.headers['Location']:
+            return 'status %d' % response.status_code
+
+    def page(self):
+        username, _, kind = self.random.choice(USERS)
+        response = self.client.get('/%s/%s' % (kind, username))
+        if response.status_code != 200:
+            return 'status %d' % response.status_code
+
+    def register(self):
+        self.registrations += 1
+        username = 'registered-%s-%d' % (self.name, self.registrations)
+        response = self.client.post('/register', data={
+            'username': username, 'password': 'x', 'is_student': 'Y',
+            'name': 'Registered', 'title': '', 'class_id': self.class_id})
+        if response.status_code != 302:
+            return 'status %d' % response.status_code
+        self.registered.append(username)
+
+    def grades(self):
+        roster = [(student_id, self.random.choice(LETTERS)) for student_id
+                  in self.random.sample(self.student_ids,
+                                        self.random.randint(1, 3))]
+        response = self.client.post('/api/classes/%d/grades' % self.class_id,
+                                    json={'grades': roster})
+        if response.status_code != 200:
+            return 'status %d' % response.status_code
+        for student_id, letter in roster:
+            self.graded[(self.class_id, student_id)] = letter
+
+
+def run_process(path, name, assignments, mix, seconds, seed,
+                barrier=None, results=None):
+    """
+    Runs one thread per assignment in this process on its own app, all
+    starting together (after every process is ready, if barrier is given).
+
+    :return: dict of latencies (operation -> list of seconds), failures
+    (Counter), registered (usernames) and grades ((class_id, student_id) ->
+    letter); also put on results if given
+    """
+    from main_app import create_app
+
+    app = create_app(stress_config(path))
+    workers = [Worker(app, '%s-%d' % (name, thread), class_id, student_ids,
+                      mix, seed * 1000 + thread)
+               for thread, (class_id, student_ids) in enumerate(assignments)]
+
+    # every worker starts once the slowest process has its app ready
+    if barrier is not None:
+        barrier.wait()
+    deadline = time.monotonic() + seconds
+    threads = [threading.Thread(target=worker.run, args=(deadline,))
+               for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    result = {'latencies': collections.defaultdict(list),
+              'failures': collections.Counter(), 'registered': [],
+              'grades': {}}
+    for worker in workers:
+        for operation, latencies in worker.latencies.items():
+            result['latencies'][operation].extend(latencies)
+        result['failures'].update(worker.failures)
+        result['registered'].extend(worker.registered)
+        result['grades'].update(worker.graded)
+    if results is not None:
+        results.put(result)
+    return result
+
+
+def run_level(path, level, processes, mix, seconds):
+    """
+    Runs level threads spread over up to processes processes.
+
+    :return: dict of workers, processes, seconds, latencies, failures,
+    registered and grades, merged over the processes
+    """
+    processes = max(1, min(processes, level))
+    threads = [level // processes + (1 if process < level % processes
+                                     else 0)
+               for process in range(processes)]
+    assignments = assign_students(path, level, processes, max(threads))
+
+    start = time.perf_counter()
+    if processes == 1:
+        parts = [run_process(path, 'L%d-P0' % level,
+                             assignments[0][:threads[0]], mix, seconds,
+                             level)]
+    else:
+        # spawned, not forked: the parent may hold database handles and
+        # threads a forked child would inherit
+        context = multiprocessing.get_context('spawn')
+        barrier = context.Barrier(processes)
+        results = context.Queue()
+        children = [context.Process(
+            target=run_process,
+            args=(path, 'L%d-P%d' % (level, process),
+                  assignments[process][:threads[process]], mix, seconds,
+                  level * 100 + process, barrier, results))
+            for process in range(processes)]
+        for child in children:
+            child.start()
+        # results are read before joining so a full pipe cannot block
+        parts = [results.get() for _ in children]
+        for child in children:
+            child.join()
+    elapsed = time.perf_counter() - start
+
+    merged = {'workers': level, 'processes': processes, 'seconds': seconds,
+              'elapsed': elapsed, 'latencies': collections.defaultdict(list),
+              'failures': collections.Counter(), 'registered': [],
+              'grades': {}}
+    for part in parts:
+        for operation, latencies in part['latencies'].items():
+            merged['latencies'][operation].extend(latencies)
+        merged['failures'].update(part['failures'])
+        merged['registered'].extend(part['registered'])
+        merged['grades'].update(part['grades'])
+    return merged
+
+
+def lost_writes(path, result):
+    """
+    :return: list of the acknowledged writes of a level that are not in
+    the database, as descriptions
+    """
+    conn = sqlite3.connect(path, timeout=30)
+    usernames = {row[0] for row in conn.execute('SELECT username '
+                                                'FROM student;')}
+    lost = ['registration of %s' % username
+            for username in result['registered'] if username not in usernames]
+
+    stored = dict(((class_id, student_id), letter)
+                  for class_id, student_id, letter in conn.execute('''
+                      SELECT grade.class_id, grade.student_id,
+                      grade_scale.letter
+                      FROM grade JOIN grade_scale
+                      ON grade_scale.code = grade.grade_code;
+                      '''))
+    conn.close()
+    for key, letter in sorted(result['grades'].items()):
+        if stored.get(key) != letter:
+            lost.append('grade %s of student %d in class %d (found %s)'
+                        % (letter, key[1], key[0], stored.get(key)))
+    return lost
+
+
+def percentile(values, fraction):
+    """
+    :return: the value below which fraction of the sorted values fall
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(result):
+    """
+    :return: dict of workers, processes, operations, per_second, the
+    p50/p95/p99/max latency in ms over all operations, p99 ms per
+    operation, locked (failures with "database is locked") and failed
+    (every failure)
+    """
+    every = sorted(latency for latencies in result['latencies'].values()
+                   for latency in latencies)
+    locked = sum(count for failure, count in result['failures'].items()
+                 if 'database is locked' in failure)
+    return {'workers': result['workers'],
+            'processes': result['processes'],
+            'operations': len(every),
+            'per_second': len(every) / result['seconds'],
+            'p50_ms': percentile(every, 0.5) * 1000,
+            'p95_ms': percentile(every, 0.95) * 1000,
+            'p99_ms': percentile(every, 0.99) * 1000,
+            'max_ms': every[-1] * 1000 if every else 0.0,
+            'p99_ms_by_operation': {
+                operation: percentile(sorted(latencies), 0.99) * 1000
+                for operation, latencies in result['latencies'].items()},
+            'locked': locked,
+            'failed': sum(result['failures'].values())}
+
+
+def parse_mix(text):
+    """
+    :return: dict of operation -> weight from 'login=2,page=5,...'
+    """
+    mix = {}
+    for part in text.split(','):
+        operation, _, weight = part.partition('=')
+        if operation not in OPERATIONS:
+            raise argparse.ArgumentTypeError(
+                'operations are %s' % ', '.join(OPERATIONS))
+        mix[operation] = float(weight or 1)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Stress the app from many threads and processes and '
+                    'check that no write is lost.')
+    parser.add_argument('--levels', default='1,4,16,32',
+                        help='comma separated total threads per run '
+                             '(default 1,4,16,32)')
+    parser.add_argument('--processes', type=int, default=4,
+                        help='most processes the threads are spread over '
+                             '(default 4)')
+    parser.add_argument('--seconds', type=float, default=5,
+                        help='length of each run (default 5)')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='operation weights (default '
+                             'login=2,page=5,register=1,grades=2)')
+    parser.add_argument('--database',
+                        help='database file to create and use (default: '
+                             'a temporary file)')
+    args = parser.parse_args(argv)
+
+    directory = None
+    path = args.database
+    if path is None:
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'stress.sqlite')
+    prepare_database(path)
+
+    failed = False
+    print('%7s %9s %10s %9s %9s %9s %9s %7s %7s %5s' % (
+        'threads', 'processes', 'ops/s', 'p50 ms', 'p95 ms', 'p99 ms',
+        'max ms', 'locked', 'failed', 'lost'))
+    try:
+        for level in [int(level) for level in args.levels.split(',')]:
+            result = run_level(path, level, args.processes, args.mix,
+                               args.seconds)
+            summary = summarize(result)
+            lost = lost_writes(path, result)
+            print('%7d %9d %10.0f %9.1f %9.1f %9.1f %9.1f %7d %7d %5d' % (
+                summary['workers'], summary['processes'],
+                summary['per_second'], summary['p50_ms'], summary['p95_ms'],
+                summary['p99_ms'], summary['max_ms'], summary['locked'],
+                summary['failed'], len(lost)))
+            print('%17s p99 ms: %s' % ('', ', '.join(
+                '%s %.1f' % (operation, milliseconds) for operation,
+                milliseconds in sorted(
+                    summary['p99_ms_by_operation'].items()))))
+            for failure, count in result['failures'].most_common(5):
+                print('%17s %d x %s' % ('', count, failure))
+            for write in lost[:5]:
+                print('%17s lost %s' % ('', write))
+            failed = failed or bool(summary['failed'] or lost)
+    finally:
+        if directory is not None:
+            for name in os.listdir(directory):
+                os.unlink(os.path.join(directory, name))
+            os.rmdir(directory)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+Compiled template cache.
+
+Jinja compiles a template to Python code the first time it is rendered,
+and every 'flask serve' worker does that again for itself. TemplateCache
+stores the compiled code in a FileSystemBytecodeCache shared by every
+process, so only the first process after a template changes compiles it;
+the rest load it from disk. Entries are keyed by the template's source, so
+an edited template is recompiled without clearing anything.
+
+With TEMPLATE_WARMUP on (the default), create_app() also loads and renders
+every template once, so the first request a new worker serves does not
+pay for it.
+
+Settings:
+
+TEMPLATE_CACHE_DIR  - folder for the compiled templates (default: the app's
+                      instance folder, in a 'jinja_cache' subfolder, or
+                      none when TESTING); False turns the disk cache off
+TEMPLATE_WARMUP     - warm the templates up in create_app() (default True)
+
+'flask compile-templates' fills the cache ahead of time, e.g. during a
+deploy, before any worker starts.
+"""
+import os
+import time
+from jinja2 import FileSystemBytecodeCache
+
+# rendered with every template during the warm-up; enough for the site's
+# templates to run their loops without a database
+WARMUP_CONTEXT = {'grade': [], 'full_name': {'name': ''}}
+
+
+class TemplateCache:
+    """
+    Flask extension installing the shared bytecode cache and warming the
+    app's templates up.
+    """
+
+    def __init__(self, app=None):
+        self.directory = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        directory = app.config.get('TEMPLATE_CACHE_DIR')
+        if directory is None and app.testing:
+            directory = False  # tests leave the instance folder alone
+        if directory is not False:
+            self.directory = directory or os.path.join(app.instance_path,
+                                                       'jinja_cache')
+            os.makedirs(self.directory, exist_ok=True)
+            app.jinja_env.bytecode_cache = FileSystemBytecodeCache(
+                self.directory)
+
+        app.extensions['template_cache'] = self
+        if app.config.get('TEMPLATE_WARMUP', True):
+            self.warm_up(app)
+
+    def warm_up(self, app):
+        """
+        Loads every HTML template, compiling it or reading it from the
+        bytecode cache, and renders it once with WARMUP_CONTEXT.
+
+        :return: dict of template name -> milliseconds it took
+        """
+        timings = {}
+        with app.app_context():
+            for name in app.jinja_env.list_templates(extensions=['html']):
+                start = time.perf_counter()
+                try:
+                    app.jinja_env.get_template(name).render(WARMUP_CONTEXT)
+                except Exception:
+                    # a template needing more than WARMUP_CONTEXT is still
+                    # compiled and cached; it just is not rendered
+                    app.logger.debug('could not warm up %s', name,
+                                     exc_info=True)
+                timings[name] = (time.perf_counter() - start) * 1000
+        return timings
@@ -0,0 +1,246 @@
+"""
+Multi-tenant routing: one SQLite file per school.
+
+Off unless TENANT_MODE is set. Each request is then routed to a tenant,
+and every database call it makes goes to that tenant's file:
+
+  host  - the tenant is the part of the host name before TENANT_DOMAIN,
+          e.g. lincoln.woodle.example is the tenant 'lincoln'
+  path  - the tenant is the path segment after TENANT_PATH_PREFIX, e.g.
+          /t/lincoln/student/ann is /student/ann of the tenant 'lincoln';
+          the prefix and name become the request's SCRIPT_NAME, so
+          url_for() links stay inside the tenant
+
+A request naming no tenant (another host, or a path outside the prefix)
+uses app.config['DATABASE'] as before. A tenant whose database file does
+not exist gets a 404; 'flask tenant-init <name>' creates one.
+
+Settings:
+
+TENANT_MODE          - None (default), 'host' or 'path'
+TENANT_DOMAIN        - domain the tenant host names end in (host mode)
+TENANT_PATH_PREFIX   - path the tenant paths start with (default '/t')
+TENANT_DIRECTORY     - directory of the tenant files, <name>.sqlite
+                       (default instance/tenants)
+TENANTS              - optional dict of tenant name -> database file, for
+                       files kept elsewhere
+TENANT_ADMIN_TOKEN   - secret admins send in the X-Woodle-Tenants header
+                       to use GET /api/admin/tenants
+
+Connections are pooled per file (see ConnectionPools in project_db.py):
+DATABASE_POOL_DATABASES files keep idle connections at once, the least
+recently used ones are closed, so hundreds of tenants can be served without
+running out of file descriptors. GET /api/admin/tenants reports, for each
+tenant this worker served, its requests, server errors, request time,
+queries and query time, and how often its connections were opened, reused
+and evicted.
+
+Background jobs run against the tenant that submitted them, and grade
+event streams follow the tenant's change log. Session user ids include the
+tenant, so a session from one tenant is not a login at another.
+"""
+import hmac
+import os
+import re
+import threading
+import time
+from flask import current_app, request
+from werkzeug.exceptions import NotFound
+
+TENANT_HEADER = 'X-Woodle-Tenants'
+
+TENANT_MODES = ('host', 'path')
+
+# tenant names: also their file names and URL segments
+TENANT_NAME = re.compile(r'^[a-z0-9][a-z0-9_-]{0,62}$')
+
+
+class TenantRouter:
+    """
+    Flask extension routing requests to per-tenant database files, and
+    counting each tenant's traffic.
+    """
+
+    def __init__(self, app=None, db=None):
+        """
+        :param app: Flask app to install on; init_app() can be called later
+        :param db: DBManager the tenants' files are opened with
+        """
+        self.db = db
+        self.mode = None
+        self.domain = None
+        self.path_prefix = '/t'
+        self.directory = None
+        self.tenants = {}
+        self.token = None
+        self.metrics = {}  # tenant name or None -> dict of counters
+        self.lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Wraps the app's WSGI callable if TENANT_MODE is configured.
+        """
+        self.mode = app.config.get('TENANT_MODE')
+        if not self.mode:
+            return
+        if self.mode not in TENANT_MODES:
+            raise ValueError('TENANT_MODE must be one of %s'
+                             % ', '.join(TENANT_MODES))
+
+        self.domain = (app.config.get('TENANT_DOMAIN') or '').lower()
+        if self.mode == 'host' and not self.domain:
+            raise ValueError('TENANT_MODE host needs a TENANT_DOMAIN')
+        self.path_prefix = '/' + app.config.get(
+            'TENANT_PATH_PREFIX', '/t').strip('/')
+        self.directory = app.config.get('TENANT_DIRECTORY') or os.path.join(
+            app.instance_path, 'tenants')
+        self.tenants = dict(app.config.get('TENANTS') or {})
+        self.token = app.config.get('TENANT_ADMIN_TOKEN')
+
+        app.extensions['tenant_router'] = self
+        app.wsgi_app = self.wrap(app.wsgi_app)
+        self.db.add_query_listener(app, self.record_query)
+
+    def database_of(self, tenant):
+        """
+        :return: the database file of tenant, whether it exists or not
+        :raise ValueError: if tenant is not a valid tenant name
+        """
+        if not TENANT_NAME.match(tenant):
+            raise ValueError('tenant names are lowercase letters, digits, '
+                             '_ and -, at most 63 long')
+        return self.tenants.get(tenant) or os.path.join(
+            self.directory, tenant + '.sqlite')
+
+    def resolve(self, environ):
+        """
+        Finds the tenant of a request, and for path routing moves the
+        tenant prefix from PATH_INFO to SCRIPT_NAME.
+
+        :return: the tenant name, None if the request names no tenant, or
+        '' if it names something that cannot be a tenant
+        """
+        if self.mode == 'host':
+            host = environ.get('HTTP_HOST') or environ.get('SERVER_NAME', '')
+            host = host.rsplit(':', 1)[0].lower()
+            if not host.endswith('.' + self.domain):
+                return None
+            tenant = host[:-len(self.domain) - 1]
+            return tenant if TENANT_NAME.match(tenant) else ''
+
+        path = environ.get('PATH_INFO', '')
+        if not path.startswith(self.path_prefix + '/'):
+            return None
+        tenant, slash, rest = path[len(self.path_prefix) + 1:].partition('/')
+        if not TENANT_NAME.match(tenant):
+            return ''
+        environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') \
+            + self.path_prefix + '/' + tenant
+        environ['PATH_INFO'] = slash + rest
+        return tenant
+
+    def wrap(self, wsgi_app):
+        """
+        :return: a WSGI callable resolving the tenant, then calling
+        wsgi_app with woodle.tenant and woodle.database in the environ
+        """
+        def tenant_app(environ, start_response):
+            tenant = self.resolve(environ)
+            if tenant is not None:
+                database = self.database_of(tenant) if tenant else None
+                if database is None or not os.path.isfile(database):
+                    return NotFound('no such school')(environ,
+                                                      start_response)
+                environ['woodle.tenant'] = tenant
+                environ['woodle.database'] = database
+
+            status = []
+
+            def tenant_start_response(code, headers, exc_info=None):
+                status.append(code)
+                return start_response(code, headers, exc_info)
+
+            start = time.perf_counter()
+            try:
+                return wsgi_app(environ, tenant_start_response)
+            finally:
+                # a streamed response is counted up to its first byte
+                self.record_request(tenant, status[-1] if status else '500',
+                                    time.perf_counter() - start)
+        return tenant_app
+
+    def counters(self, tenant):
+        """
+        :return: the metrics of tenant; called with the lock held
+        """
+        counters = self.metrics.get(tenant)
+        if counters is None:
+            counters = self.metrics[tenant] = {
+                'requests': 0, 'server_errors': 0, 'request_seconds': 0.0,
+                'queries': 0, 'query_seconds': 0.0}
+        return counters
+
+    def record_request(self, tenant, status, seconds):
+        with self.lock:
+            counters = self.counters(tenant)
+            counters['requests'] += 1
+            counters['request_seconds'] += seconds
+            if status.startswith('5'):
+                counters['server_errors'] += 1
+
+    def record_query(self, query, parameters, seconds, rows):
+        """
+        Query listener counting each statement towards its tenant.
+        """
+        tenant = self.db.current_tenant()
+        with self.lock:
+            counters = self.counters(tenant)
+            counters['queries'] += 1
+            counters['query_seconds'] += seconds
+
+    def requested_by_admin(self):
+        sent = request.headers.get(TENANT_HEADER)
+        return bool(self.token and sent
+                    and hmac.compare_digest(sent, self.token))
+
+    def stats(self):
+        """
+        :return: dict of pool (the pool limits and idle connections open
+        now) and tenants, a list of dicts of each tenant's counters and
+        connection counters (see ConnectionPools.stats), busiest first;
+        the tenant None is app.config['DATABASE']
+        """
+        pools = self.db.pools.stats()
+        with self.lock:
+            metrics = {tenant: dict(counters)
+                       for tenant, counters in self.metrics.items()}
+
+        tenants = []
+        for tenant, counters in metrics.items():
+            database = current_app.config['DATABASE'] if tenant is None \
+                else self.database_of(tenant)
+            requests = counters['requests']
+            tenants.append({
+                'tenant': tenant,
+                'database': database,
+                'requests': requests,
+                'server_errors': counters['server_errors'],
+                'mean_request_ms': round(
+                    counters['request_seconds'] * 1000 / requests, 3)
+                if requests else None,
+                'queries': counters['queries'],
+                'query_ms': round(counters['query_seconds'] * 1000, 3),
+                'connections': pools.get(database, {})})
+        tenants.sort(key=lambda entry: entry['requests'], reverse=True)
+
+        return {'pid': os.getpid(),
+                'pool': {'max_databases': self.db.pools.max_databases,
+                         'max_idle': self.db.pools.max_idle,
+                         'databases': sum(1 for counts in pools.values()
+                                          if counts['idle']),
+                         'idle': sum(counts['idle']
+                                     for counts in pools.values())},
+                'tenants': tenants}
@@ -0,0 +1,114 @@
+"""
+Transcript generation for every student, used by 'flask transcripts'.
+
+The students are split into ranges of consecutive ids and the ranges are
+handed to a pool of processes. Each process builds its own app with the
+app factory, so it has its own read-only database connection and its own
+Jinja environment, and for every range runs one query for all of the
+range's grades and renders templates/transcript.html once per student.
+
+There are several ranges per process, so a process that finishes early
+picks up more work instead of sitting idle at the end.
+
+Every transcript is written to <output directory>/<student_id>-<username>.html
+"""
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from flask import render_template
+
+# ranges handed out per worker process; more ranges balance the load
+# better, fewer mean fewer queries
+RANGES_PER_WORKER = 4
+
+# set in each worker process by _start_worker()
+_worker = {}
+
+
+def _start_worker(app_factory, database):
+    """
+    ProcessPoolExecutor initializer. Builds this process's app and keeps
+    an app context pushed for the life of the process, so the DBManager
+    keeps reusing one connection.
+    """
+    from project_db import db
+
+    app = app_factory({'DATABASE': database})
+    context = app.app_context()
+    context.push()
+    db.get_db().execute('PRAGMA query_only = ON;')
+
+    _worker.update(app=app, context=context, db=db)
+
+
+def _render_range(id_range, output_directory, generated):
+    """
+    Renders and writes the transcripts of the students in one id range.
+
+    :param id_range: (first_id, last_id)
+    :return: number of transcripts written
+    """
+    first_id, last_id = id_range
+    rows = _worker['db'].get_transcripts(first_id, last_id)
+
+    written = 0
+    start = 0
+    # rows are ordered by student; render each student's run of rows
+    while start < len(rows):
+        student_id = rows.rows[start][0]
+        end = start
+        while end < len(rows) and rows.rows[end][0] == student_id:
+            end += 1
+
+        student_rows = rows[start:end]
+        first = student_rows[0]
+        grades = [row for row in student_rows if row['c_name'] is not None]
+
+        html = render_template('transcript.html',
+                               grade=grades,
+                               full_name={'name': first['s_name']},
+                               student_id=student_id,
+                               generated=generated)
+
+        filename = '%d-%s.html' % (student_id, re.sub(r'[^\w.-]', '_',
+                                                      first['username']))
+        with open(os.path.join(output_directory, filename), 'w',
+                  encoding='utf-8') as transcript:
+            transcript.write(html)
+
+        written += 1
+        start = end
+
+    return written
+
+
+def generate_transcripts(app_factory, database, output_directory, workers,
+                         id_ranges):
+    """
+    Renders every transcript across a pool of worker processes.
+
+    :param app_factory: create_app, called once in every worker
+    :param database: path of the sqlite database to read
+    :param output_directory: folder the transcripts are written to
+    :param workers: number of worker processes
+    :param id_ranges: list of (first_id, last_id) to hand out
+    :return: dict with transcripts, seconds, per_second and workers
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    generated = time.strftime('%Y-%m-%d')
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_start_worker,
+                             initargs=(app_factory, database)) as pool:
+        futures = [pool.submit(_render_range, id_range, output_directory,
+                               generated)
+                   for id_range in id_ranges]
+        transcripts = sum(future.result() for future in futures)
+    seconds = time.perf_counter() - start
+
+    return {'transcripts': transcripts,
+            'seconds': seconds,
+            'per_second': transcripts / seconds if seconds else 0.0,
+            'workers': workers}
@@ -0,0 +1,117 @@
+"""
+This module contains tests for the admission control in project_admission.py
+
+Run them with pytest:
+  python3 -m pytest test_project_admission.py
+"""
+import multiprocessing
+import os
+import time
+
+from flask import Flask
+
+from project_admission import AdmissionController, SharedBucketStore
+
+
+def make_app(**config):
+    app = Flask(__name__)
+    app.config['ADMISSION_LIMITS'] = {
+        'write': {'methods': ('POST',),
+                  'client_rate': 0.001, 'client_burst': 2,
+                  'global_rate': 0.001, 'global_burst': 3},
+    }
+    app.config.update(config)
+    controller = AdmissionController(app)
+
+    @app.route('/write', methods=['GET', 'POST'])
+    def write():
+        return 'ok'
+
+    return app, controller
+
+
+def test_client_bucket_sheds_with_429():
+    '''
+    The third POST from one client should be shed; GETs are not limited.
+    '''
+    app, controller = make_app()
+    client = app.test_client()
+
+    statuses = [client.post('/write').status_code for _ in range(3)]
+
+    assert statuses == [200, 200, 429]
+    assert client.get('/write').status_code == 200
+    assert controller.stats() == {'write': {'admitted': 2, 'shed': 1}}
+
+
+def test_global_bucket_limits_all_clients():
+    '''
+    Different clients each have their own bucket but share the global one.
+    '''
+    app, controller = make_app()
+    client = app.test_client()
+
+    statuses = [client.post('/write', environ_base={
+                    'REMOTE_ADDR': '10.0.0.%d' % i}).status_code
+                for i in range(4)]
+
+    assert statuses == [200, 200, 200, 429]
+
+
+def test_global_rejection_gives_the_client_token_back():
+    '''
+    A request the global bucket sheds does not use up the client's bucket.
+    '''
+    app, controller = make_app()
+    limit = app.config['ADMISSION_LIMITS']['write']
+    limit['global_burst'] = 1
+    client = app.test_client()
+
+    assert client.post('/write').status_code == 200
+    assert client.post('/write').status_code == 429
+    assert controller.store.buckets['write|127.0.0.1'][0] >= 1.0
+
+
+def take_from_shared_store(path, key):
+    store = SharedBucketStore(path)
+    admitted = store.take(key, 0.001, 1, 0)[0]
+    store.close()
+    os._exit(0 if admitted else 1)
+
+
+def test_shared_store_is_seen_by_other_processes(tmpdir):
+    '''
+    A token taken in a forked process is gone from the bucket this process
+    sees on the same file.
+    '''
+    path = os.path.join(tmpdir, 'buckets')
+    store = SharedBucketStore(path)
+
+    child = multiprocessing.get_context('fork').Process(
+        target=take_from_shared_store, args=(path, 'login'))
+    child.start()
+    child.join()
+    assert child.exitcode == 0
+
+    assert not store.take('login', 0.001, 1, 0)[0]
+    assert store.take('register', 0.001, 1, 0)[0]
+    store.close()
+
+
+def test_shared_store_never_resets_another_key(tmpdir):
+    '''
+    Keys that probe the same slots keep their own buckets. A bucket that
+    has filled up again can be replaced; with no such slot left, a new key
+    is refused instead of taking a drawn-down bucket over.
+    '''
+    store = SharedBucketStore(os.path.join(tmpdir, 'buckets'), slots=2)
+
+    assert store.take('write', 0.001, 1, 0)[0]
+    assert store.take('read', 1000.0, 1, 0)[0]
+    time.sleep(0.01)  # 'read' is full again
+
+    assert store.take('write|10.0.0.1', 0.001, 2, 0)[0]
+    assert not store.take('write|10.0.0.2', 1000.0, 5, 0)[0]
+    assert not store.take('write', 0.001, 1, 0)[0]
+    assert store.take('write|10.0.0.1', 0.001, 2, 0)[0]
+    store.close()
@@ -0,0 +1,181 @@
+"""
+This module contains tests for the JSON API in project_api.py
+
+Run them with pytest:
+  python3 -m pytest test_project_api.py
+"""
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+import pytest
+from werkzeug.exceptions import MethodNotAllowed, NotFound
+
+import project_api
+from main_app import create_app
+from project_api import BATCH_MAX_REQUESTS
+
+
+@pytest.fixture
+def client():
+    '''
+    A test client of the whole app on a temporary, populated database.
+    '''
+    db_fd, db_path = tempfile.mkstemp()
+    app = create_app({'DATABASE': db_path, 'TESTING': True,
+                      'ADMISSION_LIMITS': {}, 'MAINTENANCE_INTERVAL': 0})
+    with app.app_context():
+        manager = app.extensions['db_manager']
+        manager.init_db('init_db.sql')
+        manager.migrate_db('migrations')
+        manager.populate_db('populate_db.sql')
+
+    yield app.test_client()
+
+    os.close(db_fd)
+    for path in (db_path, db_path + '-wal', db_path + '-shm'):
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def test_student_by_id(client):
+    '''
+    /api/students/<id> returns the grades of that student only, and a 404
+    for an id no student has.
+    '''
+    rows = client.get('/api/students/1?fields=student_id,c_name').get_json()
+    assert sorted(rows, key=lambda row: row['c_name']) == [
+        {'student_id': 1, 'c_name': 'CS-232'},
+        {'student_id': 1, 'c_name': 'Math-229'},
+        {'student_id': 1, 'c_name': 'Math-339'}]
+    assert client.get('/api/students/3').get_json() == []
+    assert client.get('/api/students/999').status_code == 404
+    assert len(client.get('/api/students/').get_json()) == 5
+
+
+def test_batch_answers_each_request_in_order(client):
+    '''
+    Every sub-request gets its own status and body, in the order sent.
+    '''
+    response = client.post('/api/batch', json={'requests': [
+        '/api/students/1?fields=c_name&class_id=1',
+        {'method': 'GET', 'path': '/api/students/999'},
+        '/api/nothing-here',
+        '/api/batch']})
+    assert response.status_code == 200
+    assert [(item['status'], item['body']) for item in response.get_json()] \
+        == [(200, [{'c_name': 'CS-232'}]),
+            (404, [{'error': 'student with that id not found'}]),
+            (404, [{'error': NotFound.description}]),
+            (405, [{'error': MethodNotAllowed.description}])]
+
+
+def test_batch_refuses_writes_and_oversized_batches(client):
+    '''
+    Only GET requests of the API can be batched, at most
+    BATCH_MAX_REQUESTS of them; anything else fails the whole batch.
+    '''
+    def post(requests):
+        return client.post('/api/batch', json={'requests': requests})
+
+    assert post(['/api/grades/'] * BATCH_MAX_REQUESTS).status_code == 200
+    too_many = post(['/api/grades/'] * (BATCH_MAX_REQUESTS + 1))
+    assert too_many.status_code == 422
+    assert post([{'method': 'POST', 'path': '/api/jobs/'}]).status_code \
+        == 422
+    assert post(['/student/micheas']).status_code == 422
+    assert post([]).status_code == 422
+
+
+def test_batch_reads_one_snapshot(client, monkeypatch):
+    '''
+    A grade committed by another connection while a batch runs is seen by
+    none of its sub-requests, and by the next request.
+    '''
+    app = client.application
+    dispatch = project_api.dispatch_sub_request
+    written = []
+
+    def dispatch_then_write(path):
+        result = dispatch(path)
+        if not written:
+            writer = sqlite3.connect(app.config['DATABASE'])
+            writer.execute('INSERT INTO grade(grade_code, class_id, '
+                           'student_id) VALUES (1, 4, 5);')
+            writer.commit()
+            writer.close()
+            written.append(path)
+        return result
+
+    monkeypatch.setattr(project_api, 'dispatch_sub_request',
+                        dispatch_then_write)
+    first, second = client.post('/api/batch', json={
+        'requests': ['/api/grades/', '/api/grades/']}).get_json()
+    assert first == second and len(first['body']) == 5
+    assert len(client.get('/api/grades/').get_json()) == 6
+
+
+def test_batch_reports_dead_jobs_without_ending_its_snapshot(client,
+                                                             monkeypatch):
+    '''
+    A job whose process has exited is reported failed inside a batch
+    without writing that down, since the write would commit the batch's
+    snapshot away; a request outside a batch records it.
+    '''
+    app = client.application
+    exited = subprocess.Popen([sys.executable, '-c', ''])
+    exited.wait()
+    with app.app_context():
+        job_id = app.extensions['db_manager'].create_job(
+            'import_roster', {}, exited.pid)
+
+    dispatch = project_api.dispatch_sub_request
+    written = []
+
+    def dispatch_then_write(path):
+        result = dispatch(path)
+        if not written:
+            writer = sqlite3.connect(app.config['DATABASE'])
+            writer.execute('INSERT INTO grade(grade_code, class_id, '
+                           'student_id) VALUES (1, 4, 5);')
+            writer.commit()
+            writer.close()
+            written.append(path)
+        return result
+
+    monkeypatch.setattr(project_api, 'dispatch_sub_request',
+                        dispatch_then_write)
+    job_path = '/api/jobs/%d' % job_id
+    before, job, after = client.post('/api/batch', json={
+        'requests': ['/api/grades/', job_path, '/api/grades/']}).get_json()
+    assert job['body'][0]['status'] == 'failed'
+    assert before == after and len(after['body']) == 5
+
+    with app.app_context():
+        assert app.extensions['db_manager'].get_job(job_id)['status'] == \
+            'queued'
+    assert client.get(job_path).get_json()[0]['status'] == 'failed'
+    with app.app_context():
+        assert app.extensions['db_manager'].get_job(job_id)['status'] == \
+            'failed'
+
+
+def test_class_grades_from_another_class_teacher_are_refused(client):
+    '''
+    Grades given in the name of a faculty member who does not teach the
+    class are refused with a 422 and not saved.
+    '''
+    response = client.post('/api/classes/1/grades',
+                           json={'faculty_id': 2, 'grades': [[1, 'F']]})
+    assert response.status_code == 422
+    assert response.get_json() == [
+        {'error': 'faculty member 2 does not teach class 1'}]
+    rows = client.get('/api/students/1?fields=c_name,grade').get_json()
+    assert {'c_name': 'CS-232', 'grade': 'A'} in rows
+
+    response = client.post('/api/classes/1/grades',
+                           json={'faculty_id': 1, 'grades': [[1, 'F']]})
+    assert response.status_code == 200
+    assert response.get_json()[0]['not_teaching'] == []
@@ -0,0 +1,92 @@
+"""
+This module contains tests for the hot backups in project_backup.py
+
+Run them with pytest:
+  python3 -m pytest test_project_backup.py
+"""
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from flask import Flask
+
+from main_app import create_app
+from project_backup import backup_database, prune_backups
+from project_db import DBManager
+from project_jobs import JOB_ADMIN_HEADER
+
+
+def test_backup_survives_concurrent_writes_and_prunes():
+    '''
+    A write between two steps restarts the copy; past max_restarts the rest
+    is copied in one step. The backup holds every committed row and old
+    backups are pruned.
+    '''
+    db_fd, db_path = tempfile.mkstemp()
+    app = Flask(__name__)
+    app.config['DATABASE'] = db_path
+    manager = DBManager(app)
+    with app.app_context():
+        manager.init_db('init_db.sql')
+        manager.migrate_db('migrations')
+        manager.populate_db('populate_db.sql')
+
+    writer = sqlite3.connect(db_path)
+
+    def write_between_steps(copied, total):
+        if copied == total:
+            return  # done; a write now would come after the snapshot
+        writer.execute("INSERT INTO class(name) VALUES ('Backups 101')")
+        writer.commit()
+
+    with tempfile.TemporaryDirectory() as directory:
+        result = backup_database(db_path, directory, pages=1, pause=0,
+                                 max_restarts=1,
+                                 progress=write_between_steps)
+        assert result['check'] == 'ok'
+        assert result['restarts'] == 2 and result['single_step']
+
+        copy = sqlite3.connect(result['path'])
+        live = writer.execute('SELECT COUNT(*) FROM class').fetchone()
+        assert copy.execute('SELECT COUNT(*) FROM class').fetchone() == live
+        copy.close()
+
+        second = backup_database(db_path, directory, pause=0)
+        assert prune_backups(directory, 1) == [result['path']]
+        assert os.listdir(directory) == [os.path.basename(second['path'])]
+
+    writer.close()
+    os.close(db_fd)
+    os.unlink(db_path)
+
+
+def test_backup_job_needs_the_admin_token():
+    '''
+    Anonymous clients cannot start a backup from the API; admins can.
+    '''
+    directory = tempfile.mkdtemp()
+    app = create_app({'DATABASE': os.path.join(directory, 'db.sqlite'),
+                      'TESTING': True, 'ADMISSION_LIMITS': {},
+                      'MAINTENANCE_INTERVAL': 0, 'JOB_ADMIN_TOKEN': 'admin',
+                      'BACKUP_DIR': os.path.join(directory, 'backups')})
+    with app.app_context():
+        app.extensions['db_manager'].init_db('init_db.sql')
+        app.extensions['db_manager'].migrate_db('migrations')
+    client = app.test_client()
+
+    job = {'kind': 'backup'}
+    assert client.post('/api/jobs/', json=job).status_code == 403
+    assert client.post('/api/jobs/', json=job, headers={
+        JOB_ADMIN_HEADER: 'wrong'}).status_code == 403
+    assert not os.path.exists(os.path.join(directory, 'backups'))
+    assert client.post('/api/jobs/', json=job, headers={
+        JOB_ADMIN_HEADER: 'admin'}).status_code == 202
+
+    runner = app.extensions['job_runner']
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline and runner.pending:
+        time.sleep(0.01)
+    assert len(os.listdir(os.path.join(directory, 'backups'))) == 1
+    shutil.rmtree(directory)
@@ -0,0 +1,68 @@
+"""
+This module contains tests for the traffic capture in project_capture.py
+
+Run them with pytest:
+  python3 -m pytest test_project_capture.py
+"""
+import json
+import os
+
+from flask import Flask
+
+from project_capture import CaptureWriter, TrafficRecorder
+
+
+def read_log(path, backups):
+    """
+    :return: the entries of path and its rotated logs, oldest first
+    """
+    entries = []
+    for name in ['%s.%d' % (path, number)
+                 for number in range(backups, 0, -1)] + [path]:
+        if os.path.exists(name):
+            with open(name, encoding='utf-8') as log:
+                entries.extend(json.loads(line) for line in log)
+    return entries
+
+
+def test_workers_rotate_one_log_between_them(tmpdir):
+    '''
+    Two writers (one per worker) appending to the same file and rotating it
+    lose no entry, and the rotated logs stay in the order written.
+    '''
+    path = os.path.join(tmpdir, 'traffic.jsonl')
+    workers = [CaptureWriter(path, max_bytes=200, backups=50)
+               for _ in range(2)]
+
+    for number in range(60):
+        workers[number % 2].write([{'n': number, 'path': '/student/ann'}])
+    for worker in workers:
+        worker.close()
+
+    assert os.path.exists(path + '.5')
+    assert [entry['n'] for entry in read_log(path, 50)] == list(range(60))
+
+
+def test_query_values_are_anonymized(tmpdir):
+    '''
+    Usernames in the path and the query string are replaced by the same
+    token; paging and format parameters are kept for the replay.
+    '''
+    path = os.path.join(tmpdir, 'traffic.jsonl')
+    app = Flask(__name__)
+    app.config.update(CAPTURE_FILE=path, SECRET_KEY='key')
+    recorder = TrafficRecorder(app)
+
+    @app.route('/student/<username>')
+    def student(username):
+        return 'ok'
+
+    app.test_client().get('/student/ann?username=ann&format=columns'
+                          '&after=20')
+    recorder.writer.close()
+
+    entry, = read_log(path, 0)
+    token = recorder.anonymize('ann')
+    assert 'ann' not in entry['path']
+    assert entry['path'] == ('/student/%s?username=%s&format=columns'
+                             '&after=20' % (token, token))
@@ -0,0 +1,259 @@
+"""
+This module contains tests for the DBManager class in project_db.py and the
+JSON encoding in project_json.py.
+
+Run them with pytest:
+  python3 -m pytest test_project_db.py
+"""
+import json
+import os
+import tempfile
+import time
+
+import pytest
+from flask import Flask
+
+import project_json
+from main_app import create_app
+from project_db import DBManager, RowSet
+
+
+@pytest.fixture
+def db():
+    '''
+    A DBManager on a temporary, populated database inside an app context.
+    '''
+    db_fd, db_path = tempfile.mkstemp()
+    app = Flask(__name__)
+    app.config['DATABASE'] = db_path
+    manager = DBManager(app)
+
+    with app.app_context():
+        manager.init_db('init_db.sql')
+        manager.migrate_db('migrations')
+        manager.populate_db('populate_db.sql')
+        yield manager
+
+    os.close(db_fd)
+    os.unlink(db_path)
+
+
+def test_read_rows_matches_dict_rows(db):
+    '''
+    A RowSet should hold exactly what the old dict(row) loop produced.
+    '''
+    query = 'SELECT name, username FROM student ORDER BY student_id;'
+    cur = db.get_db().cursor()
+    cur.execute(query)
+    expected = [dict(row) for row in cur.fetchall()]
+
+    rows = db.read_rows(query)
+
+    assert rows.columns == ('name', 'username')
+    assert rows.as_dicts() == expected
+    assert [dict(record) for record in rows] == expected
+    assert rows[0]['username'] == expected[0]['username']
+
+
+def test_encode_rowset_shapes():
+    '''
+    Both JSON shapes should round trip, with and without orjson.
+    '''
+    rows = RowSet(('s_name', 'grade'), [('Mo "%"', 'C+'), ('Bo', None)])
+    records = [{'s_name': 'Mo "%"', 'grade': 'C+'},
+               {'s_name': 'Bo', 'grade': None}]
+
+    for encoder in (project_json.orjson, None):
+        original, project_json.orjson = project_json.orjson, encoder
+        try:
+            assert json.loads(project_json.encode_rowset(rows)) == records
+            columns = json.loads(project_json.encode_rowset(rows, 'columns'))
+            assert columns == {'columns': ['s_name', 'grade'],
+                               'rows': [['Mo "%"', 'C+'], ['Bo', None]]}
+        finally:
+            project_json.orjson = original
+
+
+def test_app_responses_use_the_rowset_encoder(monkeypatch):
+    '''
+    The app's own provider encodes API RowSets directly, also with the
+    DEBUG=True that create_app() sets, unless indenting is asked for.
+    '''
+    calls = []
+    encode_rowset = project_json.encode_rowset
+    monkeypatch.setattr(project_json, 'encode_rowset',
+                        lambda *args: calls.append(args[1:]) or
+                        encode_rowset(*args))
+
+    db_fd, db_path = tempfile.mkstemp()
+    app = create_app({'DATABASE': db_path, 'TESTING': True,
+                      'ADMISSION_LIMITS': {}, 'MAINTENANCE_INTERVAL': 0})
+    with app.app_context():
+        app.extensions['db_manager'].init_db('init_db.sql')
+        app.extensions['db_manager'].migrate_db('migrations')
+        app.extensions['db_manager'].populate_db('populate_db.sql')
+        expected = app.extensions['db_manager'].read_class_grades().as_dicts()
+    client = app.test_client()
+
+    assert app.debug
+    response = client.get('/api/grades/')
+    assert calls == [('records',)]
+    assert response.get_json() == expected and b'\n ' not in response.data
+    columns = client.get('/api/grades/?format=columns').get_json()
+    assert calls[-1] == ('columns',) and len(columns['rows']) == len(expected)
+
+    app.json.compact = False
+    assert client.get('/api/grades/').get_json() == expected
+    assert len(calls) == 2
+
+    os.close(db_fd)
+    os.unlink(db_path)
+
+
+def test_save_class_grades(db):
+    '''
+    A roster is saved in one go, and nothing is saved if any student on it
+    is not enrolled in the class, any grade is not on the scale or the
+    faculty member giving them does not teach the class.
+    '''
+    saved = db.save_class_grades(1, [(1, 'B'), (9, 'A-')])
+    assert saved['saved'] == 2 and saved['not_enrolled'] == []
+    assert saved['faculty_id'] == 1
+
+    cur = db.get_db().execute('SELECT student_id, letter FROM grade '
+                              'JOIN grade_scale ON code = grade_code '
+                              'WHERE class_id = 1 ORDER BY student_id;')
+    assert [tuple(row) for row in cur] == [(1, 'B'), (9, 'A-')]
+
+    rejected = db.save_class_grades(1, [(1, 'C'), (999, 'A')])
+    assert rejected['not_enrolled'] == [999] and rejected['saved'] == 0
+    unknown = db.save_class_grades(1, [(1, 'C'), (9, 'Z')])
+    assert unknown['unknown_grades'] == ['Z'] and unknown['saved'] == 0
+    cur = db.get_db().execute('SELECT letter FROM grade '
+                              'JOIN grade_scale ON code = grade_code '
+                              'WHERE class_id = 1 AND student_id = 1;')
+    assert cur.fetchone()[0] == 'B'
+
+    for faculty_id in (2, 999):  # teaches another class / nobody
+        wrong = db.save_class_grades(1, [(1, 'C')], faculty_id)
+        assert wrong['not_teaching'] == [faculty_id] and wrong['saved'] == 0
+    assert db.save_class_grades(1, [(1, 'B')], 1)['not_teaching'] == []
+
+    replaced = db.save_class_grades(1, [(9, 'A')], replace=True)
+    assert replaced['removed'] == 1 and replaced['saved'] == 1
+    assert db.save_class_grades(12345, [(1, 'A')]) is None
+
+
+def test_student_id_ranges_cover_every_student(db):
+    '''
+    The ranges handed to transcript workers should split the students
+    evenly and leave nobody out.
+    '''
+    ranges = db.get_student_id_ranges(4)
+    assert [row['students'] for row in ranges] == [3, 2, 2, 2]
+    assert ranges[0]['first_id'] == 1 and ranges[-1]['last_id'] == 9
+
+    transcripts = db.get_transcripts(1, 9)
+    assert {row['student_id'] for row in transcripts} == set(range(1, 10))
+
+
+def test_change_log_records_and_compacts(db):
+    '''
+    Writes show up in the change log in order; compaction keeps only the
+    newest entry per row and moves the horizon past dropped deletes.
+    '''
+    before = db.get_changes(0, 1000)
+    cur = db.get_db().cursor()
+    cur.execute("UPDATE class SET name = 'CS-233' WHERE class_id = 1;")
+    cur.execute('DELETE FROM grade WHERE class_id = 6;')
+    db.get_db().commit()
+
+    new = db.get_changes(before.rows[-1][0], 1000)
+    assert [(row['table_name'], row['operation']) for row in new] == \
+        [('class', 'update'), ('grade', 'delete')]
+
+    result = db.compact_change_log(time.time() + 1)
+    assert result['superseded'] == 2 and result['deletes'] == 1
+    assert db.get_change_horizon() == new.rows[-1][0]
+    assert len(db.get_changes(0, 1000)) == len(before) + 2 - 3
+
+
+def test_read_class_grades_pairs_each_grade_with_its_student(db):
+    '''
+    Each grade comes with the student it was given to and the class it was
+    given in, and the filters match those; nothing else may reach the SQL.
+    '''
+    fields = ['s_name', 'c_name', 'grade', 'student_id', 'class_id']
+    assert sorted(db.read_class_grades(fields).rows) == [
+        ('A`dmin', 'CS-112', 'C+', 4, 5),
+        ('Micheas', 'CS-232', 'A', 1, 1),
+        ('Micheas', 'Math-229', 'B-', 1, 3),
+        ('Micheas', 'Math-339', 'A', 1, 2),
+        ('Ron Ronaldo', 'Math-211', 'C+', 8, 6)]
+
+    assert db.read_class_grades(fields, {'class_id': [1]}).rows == [
+        ('Micheas', 'CS-232', 'A', 1, 1)]
+    filtered = db.read_class_grades(['s_name', 'grade'],
+                                    {'class_id': [1, 5], 'grade': ['A']})
+    assert filtered.columns == ('s_name', 'grade')
+    assert filtered.rows == [('Micheas', 'A')]
+    assert sorted(db.read_class_grades(
+        ['c_name'], {'grade': ['C+']}).rows) == [('CS-112',), ('Math-211',)]
+    assert db.read_class_grades(
+        ['s_name', 'c_name'], {'faculty': ['Bowen']}).rows == [
+        ('Ron Ronaldo', 'Math-211')]
+    assert db.read_class_grades(
+        ['c_name'], {'username': ['admin']}).rows == [('CS-112',)]
+
+    with pytest.raises(ValueError):
+        db.read_class_grades(['password'])
+
+
+def test_query_listeners_belong_to_their_app(db):
+    '''
+    Creating more apps does not add listeners to the shared DBManager: each
+    app calls its own listeners once per statement, and no other app's.
+    '''
+    apps = [create_app({'DATABASE': db.app.config['DATABASE'], 'TESTING': True,
+                        'ADMISSION_LIMITS': {}, 'MAINTENANCE_INTERVAL': 0})
+            for _ in range(3)]
+    counts = {len(app.extensions.get('db_query_listeners', ()))
+              for app in apps}
+    assert len(counts) == 1
+
+    seen = []
+    manager = apps[0].extensions['db_manager']
+    manager.add_query_listener(apps[0], lambda *args: seen.append(args[0]))
+    with apps[1].app_context():
+        manager.read_class_grades()
+    assert seen == []
+    with apps[0].app_context():
+        manager.read_class_grades()
+    assert len(seen) == 1
+
+
+def test_migrations_keep_the_last_of_duplicate_grades():
+    '''
+    A database from before the migrations with the same student graded
+    twice in a class migrates, keeping the grade entered last.
+    '''
+    db_fd, db_path = tempfile.mkstemp()
+    app = Flask(__name__)
+    app.config['DATABASE'] = db_path
+    manager = DBManager(app)
+
+    with app.app_context():
+        manager.init_db('init_db.sql')
+        conn = manager.get_db()
+        conn.executescript('''
+            INSERT INTO class(name) VALUES ('CS-232');
+            INSERT INTO student(name, class_id) VALUES ('Ann', 1);
+            INSERT INTO grade(grade, class_id, student_id) VALUES
+                ('C', 1, 1), ('B', 1, 1), ('A-', 1, 1);
+            ''')
+
+        assert len(manager.migrate_db('migrations')) > 1
+        assert manager.read_class_grades().rows == [('Ann', 'CS-232', 'A-')]
+
+    os.close(db_fd)
+    os.unlink(db_path)
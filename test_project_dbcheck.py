@@ -0,0 +1,33 @@
+"""
+This module runs the differential check of project_dbcheck.py: every
+DBManager read method must return the rows of its reference implementation
+on a generated database.
+
+Run it with pytest:
+  python3 -m pytest test_project_dbcheck.py
+"""
+import os
+import tempfile
+
+from project_dbcheck import build_database, compare, regressions
+
+
+def test_read_methods_match_reference():
+    '''
+    Compares every read method with its reference on a small generated
+    database and lists the ones that differ.
+    '''
+    db_fd, db_path = tempfile.mkstemp()
+    os.close(db_fd)
+    build_database(db_path, 60, seed=7)
+
+    assert [name for name, _, _ in compare(db_path)] == []
+
+    os.unlink(db_path)
+
+
+def test_regressions_allow_noise_and_skip_new_methods():
+    baseline = {'fast': 0.01, 'slow': 10.0}
+    timings = {'fast': 0.05, 'slow': 13.0, 'new': 5.0}
+    assert regressions(timings, baseline, 25) == [('slow', 10.0, 13.0)]
+    assert regressions(timings, baseline, 50) == []
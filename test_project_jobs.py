@@ -0,0 +1,55 @@
+"""
+This module contains tests for the background jobs in project_jobs.py
+
+Run them with pytest:
+  python3 -m pytest test_project_jobs.py
+"""
+import json
+import os
+import tempfile
+import time
+
+from flask import Flask
+
+from project_db import DBManager
+from project_jobs import JobRunner
+
+
+def test_job_runs_in_background_and_records_result():
+    '''
+    submit() returns at once; the job's progress and result end up in the
+    job table, and a bad job is recorded as failed.
+    '''
+    db_fd, db_path = tempfile.mkstemp()
+    app = Flask(__name__)
+    app.config['DATABASE'] = db_path
+    manager = DBManager(app)
+    runner = JobRunner(app, manager)
+
+    with app.app_context():
+        manager.init_db('init_db.sql')
+        manager.migrate_db('migrations')
+        manager.populate_db('populate_db.sql')
+
+        students = [{'name': 'Student %d' % i, 'username': 'student%d' % i,
+                     'password': 'password'} for i in range(1200)]
+        imported = runner.submit('import_roster', {'class_id': 4,
+                                                   'students': students})
+        broken = runner.submit('import_roster', {'class_id': 4,
+                                                 'students': [1]})
+
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and runner.pending:
+            time.sleep(0.01)
+
+        job = runner.status(imported)
+        assert job['status'] == 'done' and job['progress'] == 1.0
+        assert job['result'] == {'class_id': 4, 'imported': 1200}
+        # the passwords were used, but never stored with the job
+        assert job['parameters']['students'][0] == {
+            'name': 'Student 0', 'username': 'student0'}
+        assert 'password' not in json.dumps(job)
+        assert runner.status(broken)['status'] == 'failed'
+
+    os.close(db_fd)
+    os.unlink(db_path)
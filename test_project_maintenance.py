@@ -0,0 +1,93 @@
+"""
+This module contains tests for the database maintenance in
+project_maintenance.py
+
+Run them with pytest:
+  python3 -m pytest test_project_maintenance.py
+"""
+import os
+import shutil
+import tempfile
+import time
+
+from flask import Flask
+
+from main_app import create_app
+from project_changes import ChangeFeed
+from project_db import DBManager
+from project_jobs import JOB_ADMIN_HEADER
+from project_maintenance import Maintenance
+
+
+def test_maintenance_round_analyzes_and_vacuums_when_due():
+    '''
+    Tables pass the write threshold and free pages pile up; one round
+    analyzes just those tables and hands the pages back, and a round is
+    only claimed by one caller per interval.
+    '''
+    db_fd, db_path = tempfile.mkstemp()
+    app = Flask(__name__)
+    app.config.update(DATABASE=db_path, TESTING=True,
+                      MAINTENANCE_ANALYZE_WRITES=100)
+    manager = DBManager(app)
+    ChangeFeed(app, manager)
+    maintenance = Maintenance(app, manager)
+
+    with app.app_context():
+        manager.init_db('init_db.sql')
+        manager.migrate_db('migrations')
+        manager.populate_db('populate_db.sql')
+        manager.insert_students(1, [
+            {'name': 'Student %d' % i, 'username': 'student%d' % i,
+             'password': 'x' * 200} for i in range(2000)])
+        for _ in range(200):  # the job table is not in the change log
+            manager.create_job('export_gradebook', {'pad': 'x' * 2000}, 0)
+        conn = manager.get_db()
+        conn.execute('DELETE FROM job;')
+        conn.commit()
+        assert manager.get_storage_stats()['freelist_count'] > 0
+
+        result = maintenance.run()
+        assert list(result['tasks']['analyze']) == ['student']
+        assert result['tasks']['vacuum']['freed_pages'] > 0
+        assert result['after']['storage']['freelist_count'] == 0
+        assert result['after']['file_bytes'] < result['before']['file_bytes']
+        assert 'analyze' not in maintenance.run()['tasks']
+
+        # the rounds above count; a scheduler must wait for the interval
+        assert not manager.claim_maintenance('round', 60)
+        assert manager.claim_maintenance('round', 0)
+        assert not manager.claim_maintenance('round', 60)
+
+    os.close(db_fd)
+    os.unlink(db_path)
+
+
+def test_maintenance_job_needs_the_admin_token():
+    '''
+    Without the admin token the API refuses a forced maintenance round and
+    records no job.
+    '''
+    directory = tempfile.mkdtemp()
+    app = create_app({'DATABASE': os.path.join(directory, 'db.sqlite'),
+                      'TESTING': True, 'ADMISSION_LIMITS': {},
+                      'MAINTENANCE_INTERVAL': 0, 'JOB_ADMIN_TOKEN': 'admin'})
+    manager = app.extensions['db_manager']
+    with app.app_context():
+        manager.init_db('init_db.sql')
+        manager.migrate_db('migrations')
+    client = app.test_client()
+
+    job = {'kind': 'maintenance', 'parameters': {'force': True}}
+    assert client.post('/api/jobs/', json=job).status_code == 403
+    with app.app_context():
+        assert manager.get_job(1) is None
+    response = client.post('/api/jobs/', json=job,
+                           headers={JOB_ADMIN_HEADER: 'admin'})
+    assert response.status_code == 202
+
+    runner = app.extensions['job_runner']
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline and runner.pending:
+        time.sleep(0.01)
+    shutil.rmtree(directory)
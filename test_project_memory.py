@@ -0,0 +1,94 @@
+"""
+This module contains tests for the memory instrumentation in
+project_memory.py
+
+Run them with pytest:
+  python3 -m pytest test_project_memory.py
+"""
+import os
+import tempfile
+import tracemalloc
+
+from flask import Flask
+
+from project_memory import MEMORY_HEADER, MemoryProfiler
+
+kept = []
+
+
+def make_app(**config):
+    app = Flask(__name__)
+    app.config.update(config)
+    memory_profiler = MemoryProfiler(app)
+
+    @app.route('/leak')
+    def leak():
+        kept.append(bytearray(256 * 1024))
+        return 'ok'
+
+    @app.route('/spike')
+    def spike():
+        return str(len(bytearray(512 * 1024)))
+
+    return app, memory_profiler
+
+
+def test_sampled_requests_record_peak_and_kept_bytes_per_route():
+    '''
+    A route that keeps what it allocates shows kept bytes; one that frees
+    it only shows the peak. Tracing stops once the request is done.
+    '''
+    app, memory_profiler = make_app(MEMORY_SAMPLE_RATE=1)
+    client = app.test_client()
+    for _ in range(3):
+        client.get('/leak')
+        client.get('/spike')
+
+    routes = {row['route']: row for row in memory_profiler.route_stats()}
+    assert routes['GET /leak']['requests'] == 3
+    assert routes['GET /leak']['mean_kept_kib'] >= 256
+    assert routes['GET /spike']['max_peak_kib'] >= 512
+    assert routes['GET /spike']['mean_kept_kib'] < 64
+    assert not tracemalloc.is_tracing()
+    del kept[:]
+
+
+def test_snapshots_show_growth_and_need_the_token():
+    '''
+    The second snapshot lists the line that grew in between; the endpoints
+    answer 404 without a configured token and 403 with a wrong one.
+    '''
+    from main_app import create_app
+
+    db_fd, db_path = tempfile.mkstemp()
+    app = create_app({'DATABASE': db_path, 'TESTING': True,
+                      'MEMORY_TOKEN': 'secret'})
+    client = app.test_client()
+    admin = {MEMORY_HEADER: 'secret'}
+
+    assert client.get('/api/admin/memory').status_code == 403
+    assert client.post('/api/admin/memory/snapshots',
+                       headers={MEMORY_HEADER: 'wrong'}).status_code == 403
+
+    first = client.post('/api/admin/memory/snapshots', headers=admin)
+    assert first.status_code == 200
+    assert first.get_json()[0]['status']['tracing']
+    kept.extend(bytearray(1024) for _ in range(500))
+    second = client.post('/api/admin/memory/snapshots?top=5',
+                         headers=admin).get_json()[0]
+    grown = second['since_previous'][0]
+    assert grown['site'].startswith('test_project_memory.py:')
+    assert grown['kib_diff'] >= 500
+
+    assert client.delete('/api/admin/memory/snapshots',
+                         headers=admin).status_code == 204
+    assert not client.get('/api/admin/memory',
+                          headers=admin).get_json()[0]['tracing']
+    del kept[:]
+
+    closed = create_app({'DATABASE': db_path, 'TESTING': True})
+    assert closed.test_client().get('/api/admin/memory',
+                                    headers=admin).status_code == 404
+
+    os.close(db_fd)
+    os.unlink(db_path)
@@ -0,0 +1,72 @@
+"""
+This module contains tests for the password hashing in project_passwords.py
+
+Run them with pytest:
+  python3 -m pytest test_project_passwords.py
+"""
+import os
+import tempfile
+
+import pytest
+from flask import Flask
+
+from project_db import DBManager
+from project_passwords import (MIN_COST, PasswordHasher, PasswordPoolFull,
+                               calibrate, check_password, hash_password,
+                               parse_hash)
+
+
+def test_hashes_are_salted_and_checked():
+    first = hash_password('secret', cost=1000)
+    second = hash_password('secret', 'scrypt', 2 ** 10)
+
+    assert parse_hash(first) == ('pbkdf2_sha256', 1000)
+    assert parse_hash(second) == ('scrypt', 1024)
+    assert first != hash_password('secret', cost=1000)
+    assert check_password('secret', first) and check_password('secret',
+                                                              second)
+    assert not check_password('Secret', first)
+    # rows from before hashing hold the password itself
+    assert check_password('secret', 'secret')
+    assert not check_password('secret', 'other')
+    assert calibrate('pbkdf2_sha256', 0.001) == MIN_COST['pbkdf2_sha256']
+
+
+def test_login_rehashes_legacy_rows_and_sheds_when_busy():
+    '''
+    A legacy plain password still logs in and is replaced by a hash; the
+    hash then logs in too. With no room on the pool, logins are refused.
+    '''
+    db_fd, db_path = tempfile.mkstemp()
+    app = Flask(__name__)
+    app.config.update(DATABASE=db_path, PASSWORD_COST=1000)
+    manager = DBManager(app)
+    hasher = PasswordHasher(app, manager)
+
+    with app.app_context():
+        manager.init_db('init_db.sql')
+        manager.migrate_db('migrations')
+        manager.populate_db('populate_db.sql')
+
+        assert hasher.login('Sommer', 'wrong') is None
+        assert hasher.login('nobody', 'Sommer') is None
+        assert hasher.login('Sommer', 'Sommer') == [{'username': 'Sommer',
+                                                     'faculty_id': 1}]
+        stored = manager.get_user_by_id('faculty', 1)['password']
+        assert parse_hash(stored) == ('pbkdf2_sha256', 1000)
+
+        assert hasher.login('Sommer', 'Sommer') is not None
+        assert manager.get_user_by_id('faculty', 1)['password'] == stored
+
+        # a higher cost makes the stored hash outdated
+        hasher.cost = 2000
+        assert hasher.login('Sommer', 'Sommer') is not None
+        assert parse_hash(manager.get_user_by_id(
+            'faculty', 1)['password']) == ('pbkdf2_sha256', 2000)
+
+        hasher.max_pending = 0
+        with pytest.raises(PasswordPoolFull):
+            hasher.login('Sommer', 'Sommer')
+
+    os.close(db_fd)
+    os.unlink(db_path)
@@ -0,0 +1,44 @@
+"""
+This module contains tests for the request profiler in project_profiling.py
+
+Run them with pytest:
+  python3 -m pytest test_project_profiling.py
+"""
+import glob
+import json
+import os
+
+from main_app import create_app
+from project_dbcheck import build_database
+from project_profiling import PROFILE_HEADER
+
+
+def test_streamed_page_is_profiled_to_its_last_byte(tmpdir):
+    '''
+    The profile of a streamed faculty page is written once the body is
+    sent, and lists the row fetch that runs while it is streamed.
+    '''
+    db_path = os.path.join(tmpdir, 'db.sqlite')
+    build_database(db_path, 100, seed=1)
+    profiles = os.path.join(tmpdir, 'profiles')
+    app = create_app({'DATABASE': db_path, 'TESTING': True,
+                      'ADMISSION_LIMITS': {}, 'MAINTENANCE_INTERVAL': 0,
+                      'PROFILE_TOKEN': 'admin', 'PROFILE_DIR': profiles})
+    client = app.test_client()
+
+    response = client.get('/faculty/prof1', buffered=False,
+                          headers={PROFILE_HEADER: 'admin'})
+    assert response.is_streamed
+    assert not os.path.exists(profiles)
+    body = response.get_data()
+    response.close()
+    assert b'</table>' in body
+
+    summary, = glob.glob(os.path.join(profiles, '*.json'))
+    with open(summary) as summary_file:
+        metadata = json.load(summary_file)
+    assert metadata['route'] == '/faculty/<username>'
+    assert metadata['status'] == 200
+    assert any('grade.rowid > ?' in query['sql']
+               for query in metadata['queries'])
+    assert glob.glob(os.path.join(profiles, '*.pstats'))
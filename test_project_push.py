@@ -0,0 +1,147 @@
+"""
+This module contains tests for the grade push of project_push.py
+
+Run them with pytest:
+  python3 -m pytest test_project_push.py
+"""
+import json
+import os
+import re
+
+import pytest
+
+from main_app import create_app
+
+
+@pytest.fixture
+def app(tmpdir):
+    '''
+    An app on a temporary, populated database, inside an app context.
+    '''
+    app = create_app({'DATABASE': os.path.join(tmpdir, 'db.sqlite'),
+                      'TESTING': True, 'ADMISSION_LIMITS': {},
+                      'MAINTENANCE_INTERVAL': 0, 'PUSH_HEARTBEAT': 0.05,
+                      # the broadcaster thread only takes its first look
+                      'PUSH_POLL_INTERVAL': 3600})
+    with app.app_context():
+        manager = app.extensions['db_manager']
+        manager.init_db('init_db.sql')
+        manager.migrate_db('migrations')
+        manager.populate_db('populate_db.sql')
+        yield app
+
+
+def test_grade_changes_reach_only_their_students_streams(app):
+    '''
+    A poll after a grade is saved hands it to the streams of that student
+    and no other, once.
+    '''
+    push = app.extensions['grade_push']
+    manager = app.extensions['db_manager']
+    database = manager.database_path()
+    micheas = push.subscribe(1)
+    ron = push.subscribe(8)
+
+    last_seq = push.poll(database, None)
+    manager.save_class_grades(1, [(1, 'B+')])
+    last_seq = push.poll(database, last_seq)
+
+    event, = micheas.wait(0)
+    assert event[0] == last_seq and tuple(event[1:]) == \
+        (1, 1, 'CS-232', 'B+', 'update')
+    assert ron.wait(0) == []
+    assert push.poll(database, last_seq) == last_seq
+    assert micheas.wait(0) == []
+
+    push.unsubscribe(micheas)
+    push.unsubscribe(ron)
+    assert push.streams == 0 and push.subscriptions == {}
+
+
+def test_poll_moves_past_changes_that_are_not_grades(app, monkeypatch):
+    '''
+    Once a poll has seen that the newest changes are not grades, the next
+    polls do not look for grades again until something else changes.
+    '''
+    push = app.extensions['grade_push']
+    manager = app.extensions['db_manager']
+    database = manager.database_path()
+    last_seq = push.poll(database, None)
+
+    manager.insert_user('newcomer', 'secret', 'Newcomer', 1)
+    reads = []
+    get_grade_changes = manager.get_grade_changes
+    monkeypatch.setattr(manager, 'get_grade_changes', lambda *args: (
+        reads.append(args) or get_grade_changes(*args)))
+
+    last_seq = push.poll(database, last_seq)
+    assert last_seq == manager.get_last_change() and len(reads) == 1
+    assert push.poll(database, last_seq) == last_seq
+    assert len(reads) == 1
+
+
+def test_stream_sends_missed_events_then_live_ones(app):
+    '''
+    A reconnecting page gets the grades it missed, then live events and
+    keep-alive comments; one whose missed events were compacted away is
+    told to reload.
+    '''
+    push = app.extensions['grade_push']
+    manager = app.extensions['db_manager']
+
+    reload_stream = push.stream(push.subscribe(1), None)
+    assert list(reload_stream) == ['retry: 5000\n\n',
+                                   'event: reload\ndata: {}\n\n']
+
+    start = manager.get_last_change()
+    manager.save_class_grades(1, [(1, 'C')])
+    missed = push.missed(1, start)
+    subscription = push.subscribe(1)
+    stream = push.stream(subscription, missed)
+
+    assert next(stream) == 'retry: 5000\n\n'
+    event = next(stream)
+    assert event.startswith('id: %d\nevent: grade\n' % missed[0][0])
+    assert json.loads(event.split('data: ', 1)[1]) == {
+        'class_id': 1, 'student_id': 1, 'c_name': 'CS-232', 'grade': 'C',
+        'operation': 'update'}
+    assert next(stream) == ': keep-alive\n\n'
+
+    subscription.events.put(missed[0])  # already sent: skipped
+    assert next(stream) == ': keep-alive\n\n'
+    stream.close()
+
+
+def test_student_page_rows_are_keyed_by_class_and_student(app):
+    '''
+    Each row of the student page is one grade of the student, marked with
+    the class_id and student_id a pushed change is matched by.
+    '''
+    body = app.test_client().get('/student/micheas').get_data(as_text=True)
+    rows = re.findall(r'data-class-id="(\d+)"\s+data-student-id="(\d+)">'
+                      r'\s*<td>(.*?)</td>\s*<td>(.*?)</td>', body)
+    assert sorted(rows) == [('1', '1', 'CS-232', 'A'),
+                            ('2', '1', 'Math-339', 'A'),
+                            ('3', '1', 'Math-229', 'B-')]
+
+
+def test_first_look_starts_at_the_page_seq(app):
+    '''
+    A grade saved after the student page was rendered, but before the
+    broadcaster first looked at the database, still reaches the stream
+    opened with the page's seq.
+    '''
+    push = app.extensions['grade_push']
+    manager = app.extensions['db_manager']
+
+    body = app.test_client().get('/student/micheas').get_data(as_text=True)
+    since = int(re.search(r'/student/micheas/events\?since=(\d+)',
+                          body).group(1))
+    assert since == manager.get_last_change()
+
+    manager.save_class_grades(1, [(1, 'D')])
+    subscription = push.subscribe(1, since)  # starts the broadcaster
+    event, = subscription.wait(5)
+    assert event[0] > since and tuple(event[1:]) == \
+        (1, 1, 'CS-232', 'D', 'update')
+    push.unsubscribe(subscription)
@@ -0,0 +1,97 @@
+"""
+This module contains tests for the load test replayer in project_replay.py
+
+Run them with pytest:
+  python3 -m pytest test_project_replay.py
+"""
+import json
+import os
+
+from flask import Flask, request, session
+
+import project_replay
+from project_replay import (InProcessTarget, load_requests, percentile,
+                            replay_closed_loop, replay_open_loop)
+
+
+def make_app():
+    app = Flask(__name__)
+    app.secret_key = 'replay'
+
+    @app.route('/login', methods=['POST'])
+    def login():
+        session['username'] = request.form['username']
+        return 'ok'
+
+    @app.route('/student/<username>')
+    def student(username):
+        if session.get('username') != username:
+            return 'not logged in', 403
+        return 'grades of ' + username
+
+    return app
+
+
+def write_log(tmpdir, entries):
+    path = os.path.join(tmpdir, 'traffic.jsonl')
+    with open(path, 'w') as log:
+        for entry in entries:
+            log.write(json.dumps(entry) + '\n')
+        log.write('\n{"method": "GET"}\n')  # skipped: no path
+    return path
+
+
+def test_closed_loop_users_keep_their_own_session(tmpdir):
+    '''
+    Each simulated user logs in with its own cookies, so every replayed
+    page view succeeds; timings are grouped by route.
+    '''
+    entries = load_requests(write_log(tmpdir, [
+        {'method': 'POST', 'path': '/login', 'form': {'username': 'ann'}},
+        {'path': '/student/ann?after=10', 'route': '/student/<username>'},
+    ]))
+    assert len(entries) == 2
+
+    report = replay_closed_loop(entries, InProcessTarget(make_app()),
+                                workers=3, repeat=2)
+    summary = report.summary()
+    assert summary['ALL']['count'] == 12
+    assert summary['ALL']['error_rate'] == 0.0
+    assert summary['GET /student/<username>']['count'] == 6
+    assert summary['POST /login']['count'] == 6
+
+
+def test_open_loop_counts_errors(tmpdir):
+    '''
+    Open-loop arrivals do not wait for a login, so pages of a user that
+    is not logged in count as errors.
+    '''
+    entries = [{'path': '/student/ann'}, {'path': '/missing'}]
+    report = replay_open_loop(entries, InProcessTarget(make_app()),
+                              rate=1000, workers=2, repeat=5, seed=1)
+    summary = report.summary()
+    assert summary['ALL']['count'] == 10
+    assert summary['ALL']['error_rate'] == 1.0
+    assert 'GET /missing' in report.format()
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([7], 90) == 7
+    assert percentile([], 50) == 0.0
+
+
+def test_main_replays_the_capture_file_by_default(tmpdir, monkeypatch,
+                                                 capsys):
+    '''
+    Run without a log, the replayer reads the capture file rather than
+    requests.jsonl.
+    '''
+    path = write_log(tmpdir, [{'path': '/student/ann'}])
+    monkeypatch.setattr(project_replay, 'DEFAULT_LOG', path)
+
+    project_replay.main(['--app', 'test_project_replay:make_app',
+                         '--workers', '1'])
+    assert 'GET /student/ann' in capsys.readouterr().out
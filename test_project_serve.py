@@ -0,0 +1,82 @@
+"""
+This module contains tests for the pre-fork server in project_serve.py
+
+Run them with pytest:
+  python3 -m pytest test_project_serve.py
+"""
+import os
+import re
+import signal
+import subprocess
+import sys
+import urllib.error
+import urllib.request
+
+import pytest
+
+SERVER = '''
+import os
+import time
+from flask import Flask
+import project_capture
+from project_serve import serve
+
+# a slow disk: entries are still queued when the worker is told to stop
+write = project_capture.CaptureWriter.write
+project_capture.CaptureWriter.write = lambda self, batch: (
+    time.sleep(0.5), write(self, batch))
+
+
+def create_app():
+    app = Flask(__name__)
+    app.config['CAPTURE_FILE'] = os.environ['CAPTURE_FILE']
+    project_capture.TrafficRecorder(app)
+
+    @app.route('/pid')
+    def pid():
+        return str(os.getpid())
+
+    @app.route('/fail')
+    def fail():
+        raise RuntimeError('failing on purpose')
+
+    return app
+
+
+serve(create_app, port=0, workers=2, threads=2)
+'''
+
+
+def test_workers_serve_and_stop_with_combined_stats(tmpdir):
+    '''
+    Worker processes, not the master, answer the requests; on SIGTERM the
+    master stops them and prints the requests and errors of all workers.
+    The workers write out the requests their capture writers still had
+    queued before they exit.
+    '''
+    capture = os.path.join(tmpdir, 'traffic.jsonl')
+    env = dict(os.environ, PYTHONPATH=os.getcwd(),
+               WOODLE_SERVE_STATS=str(tmpdir), CAPTURE_FILE=capture)
+    master = subprocess.Popen([sys.executable, '-c', SERVER], env=env,
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, text=True)
+    try:
+        banner = master.stdout.readline()
+        port = int(re.search(r':(\d+) with 2 workers', banner).group(1))
+        base = 'http://127.0.0.1:%d' % port
+
+        pids = {int(urllib.request.urlopen(base + '/pid', timeout=10).read())
+                for _ in range(20)}
+        assert master.pid not in pids
+        with pytest.raises(urllib.error.HTTPError) as failed:
+            urllib.request.urlopen(base + '/fail', timeout=10)
+        assert failed.value.code == 500
+    finally:
+        master.send_signal(signal.SIGTERM)
+        output, _ = master.communicate(timeout=60)
+
+    assert master.returncode == 0
+    total = re.search(r'total\s+(\d+)\s+(\d+)', output)
+    assert total.groups() == ('21', '1')
+    with open(capture) as log:
+        assert len(log.readlines()) == 21
@@ -0,0 +1,57 @@
+"""
+This module contains tests for the slow-query log in project_slowlog.py
+
+Run them with pytest:
+  python3 -m pytest test_project_slowlog.py
+"""
+import json
+import os
+
+from main_app import create_app
+from project_slowlog import fingerprint, summarize_log
+
+
+def test_fingerprint_ignores_literals_and_layout():
+    '''
+    The same statement with other literals or other whitespace has the
+    same fingerprint; another statement does not.
+    '''
+    first = fingerprint("SELECT * FROM student WHERE name = 'Ann' AND id = 3")
+    second = fingerprint('SELECT *\n  FROM student\n  WHERE name = '
+                         "'Bob' AND id = 41;")
+    assert first == second
+    assert first[1] == 'SELECT * FROM student WHERE name = ? AND id = ?'
+    assert fingerprint('SELECT * FROM class')[0] != first[0]
+
+
+def test_slow_statements_are_logged_without_their_values(tmpdir):
+    '''
+    Every statement over SLOW_QUERY_MS is logged with its plan and the
+    types of its bound values, never the values; the log groups by
+    fingerprint.
+    '''
+    path = os.path.join(tmpdir, 'slow.jsonl')
+    app = create_app({'DATABASE': os.path.join(tmpdir, 'db.sqlite'),
+                      'TESTING': True, 'ADMISSION_LIMITS': {},
+                      'MAINTENANCE_INTERVAL': 0, 'SLOW_QUERY_MS': 0,
+                      'SLOW_QUERY_LOG': path})
+    with app.app_context():
+        manager = app.extensions['db_manager']
+        manager.init_db('init_db.sql')
+        manager.migrate_db('migrations')
+        manager.populate_db('populate_db.sql')
+        open(path, 'w').close()  # only the reads below
+
+        for username in ('micheas', 'admin', 'micheas'):
+            manager.get_class_grade(username)
+
+    with open(path) as log:
+        entries = [json.loads(line) for line in log]
+    assert len(entries) == 3
+    assert 'micheas' not in json.dumps(entries)
+    assert entries[0]['parameters'] == ['str']
+    assert entries[0]['plan'] and entries[0]['rows'] is not None
+
+    group, = summarize_log(path)
+    assert group['count'] == 3 and group['fingerprint'] == \
+        entries[0]['fingerprint']
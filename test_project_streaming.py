@@ -0,0 +1,61 @@
+"""
+This module contains tests for the streamed, paged faculty and student
+pages of project_streaming.py
+
+Run them with pytest:
+  python3 -m pytest test_project_streaming.py
+"""
+import collections
+import html
+import os
+import re
+import tempfile
+
+from main_app import create_app
+from project_dbcheck import build_database
+
+CELLS = re.compile(r'<td>(.*?)</td>\s*<td>(.*?)</td>')
+NEXT = re.compile(r'href="([^"]*)">Next page')
+
+
+def test_pages_cover_every_row_once_and_are_streamed():
+    '''
+    Following the Next page links of a faculty member's roster shows every
+    row of get_faculty() exactly once; the page is sent in several chunks,
+    the first before the table is finished.
+    '''
+    db_fd, db_path = tempfile.mkstemp()
+    os.close(db_fd)
+    build_database(db_path, 300, seed=3)
+    app = create_app({'DATABASE': db_path, 'TESTING': True,
+                      'ADMISSION_LIMITS': {}, 'MAINTENANCE_INTERVAL': 0,
+                      'ROSTER_PAGE_SIZE': 10})
+    client = app.test_client()
+
+    with app.app_context():
+        manager = app.extensions['db_manager']
+        expected = collections.Counter(
+            (html.escape(row['c_name']), str(row['grade']))
+            for row in manager.get_faculty('prof2'))
+    assert sum(expected.values()) > 20
+
+    shown, pages, url = collections.Counter(), 0, '/faculty/prof2'
+    while url:
+        body = client.get(url).get_data(as_text=True)
+        shown.update(CELLS.findall(body))
+        pages += 1
+        match = NEXT.search(body)
+        url = html.unescape(match.group(1)) if match else None
+    assert shown == expected
+    assert pages == -(-sum(expected.values()) // 10)
+
+    app.config['ROSTER_PAGE_SIZE'] = 0
+    response = client.get('/faculty/prof2', buffered=False)
+    chunks = list(response.response)
+    response.close()
+    assert response.is_streamed and len(chunks) > 1
+    assert b'<h1>' in chunks[0] and b'</table>' not in chunks[0]
+
+    for path in (db_path, db_path + '-wal', db_path + '-shm'):
+        if os.path.exists(path):
+            os.unlink(path)
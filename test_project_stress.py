@@ -0,0 +1,36 @@
+"""
+This module runs a short level of the concurrency stress test in
+project_stress.py
+
+Run it with pytest:
+  python3 -m pytest test_project_stress.py
+"""
+import os
+import tempfile
+
+from project_stress import (DEFAULT_MIX, lost_writes, prepare_database,
+                            run_level, summarize)
+
+
+def test_concurrent_processes_lose_no_writes_and_never_lock():
+    '''
+    Two processes of four threads each log in, load pages, register and
+    post grades on one database file; every operation succeeds and every
+    acknowledged write is in the database afterwards.
+    '''
+    db_fd, db_path = tempfile.mkstemp()
+    os.close(db_fd)
+    prepare_database(db_path)
+
+    result = run_level(db_path, 8, 2, DEFAULT_MIX, 1.5)
+    summary = summarize(result)
+
+    assert summary['processes'] == 2
+    assert result['registered'] and result['grades']
+    assert dict(result['failures']) == {}
+    assert summary['locked'] == 0
+    assert lost_writes(db_path, result) == []
+
+    for path in (db_path, db_path + '-wal', db_path + '-shm'):
+        if os.path.exists(path):
+            os.unlink(path)
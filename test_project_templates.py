@@ -0,0 +1,56 @@
+"""
+This module contains tests for the compiled template cache in
+project_templates.py
+
+Run them with pytest:
+  python3 -m pytest test_project_templates.py
+"""
+import os
+
+from main_app import create_app
+
+
+def make_app(database, cache_dir):
+    return create_app({'DATABASE': database, 'TESTING': True,
+                       'ADMISSION_LIMITS': {}, 'MAINTENANCE_INTERVAL': 0,
+                       'TEMPLATE_CACHE_DIR': cache_dir})
+
+
+def test_templates_are_compiled_once_for_every_worker(tmpdir):
+    '''
+    The first app warms every template up into the cache directory; an app
+    created later (another worker) loads them from it instead of
+    compiling them again.
+    '''
+    cache_dir = os.path.join(tmpdir, 'jinja_cache')
+    database = os.path.join(tmpdir, 'db.sqlite')
+
+    first = make_app(database, cache_dir)
+    templates = first.jinja_env.list_templates(extensions=['html'])
+    cached = os.listdir(cache_dir)
+    assert len(cached) == len(templates)
+
+    second = make_app(database, cache_dir)
+    compiled = []
+    compile_templates = second.jinja_env.compile
+
+    def counting_compile(*args, **kwargs):
+        compiled.append(args)
+        return compile_templates(*args, **kwargs)
+
+    second.jinja_env.compile = counting_compile
+    second.jinja_env.cache.clear()
+    assert set(second.extensions['template_cache'].warm_up(second)) == \
+        set(templates)
+    assert compiled == []
+    assert sorted(os.listdir(cache_dir)) == sorted(cached)
+
+
+def test_tests_leave_the_instance_folder_alone(tmpdir):
+    '''
+    With TESTING set and no TEMPLATE_CACHE_DIR, templates are only cached
+    in memory.
+    '''
+    app = make_app(os.path.join(tmpdir, 'db.sqlite'), None)
+    assert app.jinja_env.bytecode_cache is None
+    assert app.extensions['template_cache'].directory is None
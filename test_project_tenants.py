@@ -0,0 +1,77 @@
+"""
+This module contains tests for the per-school routing in project_tenants.py
+
+Run them with pytest:
+  python3 -m pytest test_project_tenants.py
+"""
+import shutil
+import tempfile
+
+from main_app import create_app
+from project_tenants import TENANT_HEADER
+
+
+def make_app(directory, **config):
+    app = create_app(dict({
+        'DATABASE': directory + '/default.sqlite', 'TESTING': True,
+        'ADMISSION_LIMITS': {}, 'PASSWORD_COST': 1000,
+        'MAINTENANCE_INTERVAL': 0, 'TENANT_MODE': 'path',
+        'TENANT_DIRECTORY': directory, 'TENANT_ADMIN_TOKEN': 'admin'},
+        **config))
+    runner = app.test_cli_runner()
+    for name in ('lincoln', 'adams'):
+        result = runner.invoke(args=['tenant-init', name, '--populate'])
+        assert result.exit_code == 0, result.output
+    return app
+
+
+def test_tenants_have_their_own_users_and_sessions():
+    '''
+    A student registered at one school can log in there only, and a session
+    from one school is not a login at the other. Unknown schools are 404.
+    '''
+    directory = tempfile.mkdtemp()
+    client = make_app(directory).test_client()
+
+    client.post('/t/lincoln/register', data={
+        'username': 'ann', 'password': 'pw', 'is_student': 'y',
+        'name': 'Ann', 'title': '', 'class_id': '1'})
+    response = client.post('/t/adams/login',
+                           data={'username': 'ann', 'password': 'pw'})
+    assert response.location.endswith('/t/adams/register')
+
+    response = client.post('/t/lincoln/login',
+                           data={'username': 'ann', 'password': 'pw'})
+    assert response.location.endswith('/t/lincoln/student/ann')
+    assert client.get('/t/lincoln/student/ann').status_code == 200
+    assert client.get('/t/adams/student/ann/events').status_code == 302
+
+    assert client.get('/t/nowhere/login').status_code == 404
+    assert client.get('/t/../login').status_code == 404
+    shutil.rmtree(directory)
+
+
+def test_pool_is_bounded_and_metrics_are_per_tenant():
+    '''
+    With room for one database's connections, switching schools evicts the
+    other's; each school's requests and queries are counted on their own.
+    '''
+    directory = tempfile.mkdtemp()
+    app = make_app(directory, DATABASE_POOL_DATABASES=1)
+    client = app.test_client()
+
+    for _ in range(3):
+        assert client.get('/t/lincoln/api/grades/').status_code == 200
+        assert client.get('/t/adams/api/grades/').status_code == 200
+    assert client.get('/api/admin/tenants').status_code == 403
+
+    stats = client.get('/api/admin/tenants',
+                       headers={TENANT_HEADER: 'admin'}).get_json()[0]
+    assert stats['pool']['databases'] == 1
+    tenants = {entry['tenant']: entry for entry in stats['tenants']}
+    for name in ('lincoln', 'adams'):
+        assert tenants[name]['requests'] == 3
+        assert tenants[name]['server_errors'] == 0
+        assert tenants[name]['queries'] >= 3
+        assert tenants[name]['connections']['evicted'] >= 2
+    shutil.rmtree(directory)